@@ -1,6 +1,8 @@
 # AWS Lambdaデプロイ用のエントリーポイント
 # Lambda関数のハンドラー設定: lambda_function.lambda_handler
+# ワーカー関数のハンドラー設定（BOT_MODE=split時）: lambda_function.worker_handler
+# 再送キューの定期実行関数のハンドラー設定（BOT_MODE=sync時）: lambda_function.retry_handler
 
-from src.lambda_function import lambda_handler
+from src.lambda_function import lambda_handler, retry_handler, worker_handler
 
-__all__ = ['lambda_handler']
\ No newline at end of file
+__all__ = ['lambda_handler', 'retry_handler', 'worker_handler']
\ No newline at end of file
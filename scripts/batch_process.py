@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+JSONLファイル（または標準入力）のイベント・質問をMessage Batches APIでまとめて処理し、
+結果をLINEのプッシュメッセージで配信します
+
+各行の形式:
+    webhookボディ        {"destination": "...", "events": [...]}
+    キューのレコード      {"destination": "...", "event": {...}}
+    LINEのイベント        {"type": "message", "source": {"userId": "..."}, "message": {"type": "text", "text": "..."}}
+    質問                 {"user_id": "U...", "text": "...", "destination": "..."}（destinationは省略可）
+
+--failed-outputの失敗した質問は質問の形式（受信したチャネルのdestination付き）で書き出すため、
+そのまま入力に指定して同じチャネルから再実行できます
+
+使い方:
+    python scripts/batch_process.py backlog.jsonl --failed-output failed.jsonl
+    cat backlog.jsonl | python scripts/batch_process.py -
+"""
+
+import os
+import sys
+import json
+import argparse
+from dotenv import load_dotenv
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+# 環境変数を読み込み
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Message Batches APIによる一括処理')
+    parser.add_argument('input', help='JSONLファイルのパス（-で標準入力）')
+    parser.add_argument('--failed-output', help='失敗した質問を再実行用のJSONLとして書き出すパス')
+    args = parser.parse_args()
+
+    from src.batch_processing import failed_record
+    from src.lambda_function import run_batch
+
+    if args.input == '-':
+        summary = run_batch(sys.stdin)
+    else:
+        with open(args.input, encoding='utf-8') as f:
+            summary = run_batch(f)
+
+    failed = summary['failed']
+    print(
+        f"件数: {summary['items']} / 成功: {summary['succeeded']} / 配信: {summary['delivered']} / "
+        f"再送待ち: {summary['queued']} / dead letter: {summary['dead_lettered']} / 失敗: {len(failed)} / "
+        f"処理済みのため除外: {summary['duplicates']}"
+    )
+    if failed and args.failed_output:
+        with open(args.failed_output, 'w', encoding='utf-8') as f:
+            for result in failed:
+                f.write(json.dumps(failed_record(result), ensure_ascii=False) + '\n')
+        print(f"失敗した質問を書き出しました: {args.failed_output}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+複数イベントを含むwebhook配信の処理時間を計測するベンチマーク
+Claude APIとLINE APIは指定した遅延を持つスタブに置き換えて計測します
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import base64
+import argparse
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+CHANNEL_SECRET = 'benchmark-secret'
+os.environ['LINE_CHANNEL_SECRET'] = CHANNEL_SECRET
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'benchmark-token')
+os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark-key')
+
+import src.lambda_function as lambda_function
+from src.event_dispatcher import ConcurrentEventDispatcher
+
+
+def create_body(event_count, user_count):
+    """event_count件のテキストメッセージをuser_count人に割り振ったwebhookボディを作成"""
+    events = []
+    for i in range(event_count):
+        events.append({
+            "type": "message",
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "source": {"type": "user", "userId": f"U{i % user_count:032d}"},
+            "replyToken": f"benchmark-reply-token-{i}",
+            "message": {"type": "text", "id": str(i), "text": f"メッセージ{i}"}
+        })
+    return json.dumps({"destination": "Ubenchmark", "events": events})
+
+
+def sign(body):
+    digest = hmac.new(CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def run(body, signature, concurrency):
+    lambda_function._dispatcher = ConcurrentEventDispatcher(lambda_function.get_handler(), max_workers=concurrency)
+    event = {"headers": {"X-Line-Signature": signature}, "body": body}
+
+    start = time.perf_counter()
+    response = lambda_function.lambda_handler(event, None)
+    elapsed = time.perf_counter() - start
+
+    assert response['statusCode'] == 200, response
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='複数イベント配信の並行処理ベンチマーク')
+    parser.add_argument('--events', type=int, default=10, help='1配信あたりのイベント数')
+    parser.add_argument('--users', type=int, default=10, help='イベントを送信するユーザー数')
+    parser.add_argument('--latency', type=float, default=0.5, help='Claude API呼び出しの模擬遅延（秒）')
+    parser.add_argument('--concurrency', type=int, default=8, help='並行処理の上限')
+    args = parser.parse_args()
+
+    def fake_claude_response(user_message, user_id=None):
+        time.sleep(args.latency)
+        return f"応答: {user_message}"
+
+    lambda_function.get_claude_response = fake_claude_response
+    lambda_function.get_line_bot_api().reply_message = lambda reply_token, message, **kwargs: None
+
+    body = create_body(args.events, args.users)
+    signature = sign(body)
+
+    serial = run(body, signature, 1)
+    concurrent = run(body, signature, args.concurrency)
+
+    print(f"イベント数: {args.events} / ユーザー数: {args.users} / 模擬遅延: {args.latency}秒")
+    print(f"逐次処理 (concurrency=1): {serial:.3f}秒")
+    print(f"並行処理 (concurrency={args.concurrency}): {concurrent:.3f}秒")
+    print(f"短縮率: {serial / concurrent:.1f}倍")
+
+
+if __name__ == '__main__':
+    main()
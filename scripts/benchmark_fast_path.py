@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+イベント種別ごとのwebhook処理時間を計測するベンチマーク
+友だち追加・ポストバック・コマンドはClaudeを呼ばずに応答するため、通常のメッセージとの差を比較します
+Claude APIとLINE APIはスタブに置き換えて計測します
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import base64
+import argparse
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+CHANNEL_SECRET = 'benchmark-secret'
+os.environ['LINE_CHANNEL_SECRET'] = CHANNEL_SECRET
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'benchmark-token')
+os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark-key')
+os.environ.setdefault('RESPONSE_CACHE', 'false')
+
+import src.lambda_function as lambda_function
+
+
+def create_event(kind, i):
+    """イベント種別ごとのwebhookイベントを作成"""
+    event = {
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": f"U{i:032d}"},
+        "replyToken": f"benchmark-reply-token-{i}"
+    }
+    if kind == 'follow':
+        event["type"] = "follow"
+    elif kind == 'postback':
+        event["type"] = "postback"
+        event["postback"] = {"data": "action=help"}
+    else:
+        text = 'ヘルプ' if kind == 'command' else f"メッセージ{i}"
+        event["type"] = "message"
+        event["message"] = {"type": "text", "id": str(i), "text": text}
+    return event
+
+
+def sign(body):
+    digest = hmac.new(CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(kind, iterations):
+    latencies = []
+    for i in range(iterations):
+        body = json.dumps({"destination": "Ubenchmark", "events": [create_event(kind, i)]})
+        event = {"headers": {"X-Line-Signature": sign(body)}, "body": body}
+
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(event, None)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response['statusCode'] == 200, response
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ファストパスの処理時間ベンチマーク')
+    parser.add_argument('--iterations', type=int, default=50, help='イベント種別ごとの送信回数')
+    parser.add_argument('--latency', type=float, default=0.5, help='Claude API呼び出しの模擬遅延（秒）')
+    args = parser.parse_args()
+
+    def fake_claude_response(user_message, user_id=None):
+        time.sleep(args.latency)
+        return f"応答: {user_message}"
+
+    lambda_function.get_claude_response = fake_claude_response
+    lambda_function.RESPONSE_STREAMING = False
+    line_bot_api = lambda_function.get_line_bot_api()
+    line_bot_api.reply_message = lambda reply_token, message, **kwargs: None
+    line_bot_api.push_message = lambda to, message, **kwargs: None
+
+    print(f"送信回数: {args.iterations} / Claude模擬遅延: {args.latency}秒")
+    for kind in ('follow', 'postback', 'command', 'message'):
+        latencies = measure(kind, args.iterations)
+        print(f"{kind:>8}: p50 {percentile(latencies, 0.5):8.2f}ms / p95 {percentile(latencies, 0.95):8.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
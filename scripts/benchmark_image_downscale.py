@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+画像メッセージの縮小処理の所要時間と、Claudeに送るサイズ・推定トークン数を計測するマイクロベンチマーク
+フル解像度で展開してから縮小する素朴な方法と、縮小読み込み（src.image_processing）を比較します（要Pillow）
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from PIL import Image
+
+from src.image_processing import downscale_image
+
+
+def create_photo(width, height):
+    """スマートフォンの写真に近いサイズになるよう、ノイズを含むJPEG画像を作成"""
+    image = Image.blend(
+        Image.radial_gradient('L').resize((width, height)).convert('RGB'),
+        Image.effect_noise((width, height), 40).convert('RGB'),
+        0.5
+    )
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=92)
+    return output.getvalue()
+
+
+def naive_path(data, size, quality):
+    # フル解像度で展開してから縮小する
+    with Image.open(io.BytesIO(data)) as image:
+        resized = image.convert('RGB').resize(size, Image.LANCZOS)
+        output = io.BytesIO()
+        resized.save(output, 'JPEG', quality=quality)
+        return output.getvalue()
+
+
+def measure(func, iterations):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='画像の縮小処理のマイクロベンチマーク')
+    parser.add_argument('--sizes', nargs='+', default=['4032x3024', '3024x4032', '1920x1080'], help='元の画像の大きさ')
+    parser.add_argument('--max-tokens', type=int, default=1600, help='画像1枚あたりの推定トークン数の上限')
+    parser.add_argument('--quality', type=int, default=85, help='JPEGの品質')
+    parser.add_argument('--iterations', type=int, default=10, help='計測回数')
+    args = parser.parse_args()
+
+    print(f"計測回数: {args.iterations} / トークン上限: {args.max_tokens}")
+    for size in args.sizes:
+        width, height = (int(value) for value in size.split('x'))
+        data = create_photo(width, height)
+        prepared = downscale_image(data, max_tokens=args.max_tokens, quality=args.quality)
+        target = (prepared.width, prepared.height)
+
+        naive_p50, naive_p95 = measure(lambda: naive_path(data, target, args.quality), args.iterations)
+        lean_p50, lean_p95 = measure(
+            lambda: downscale_image(data, max_tokens=args.max_tokens, quality=args.quality), args.iterations
+        )
+        print(f"{size:>9} ({len(data) / 1024 / 1024:5.1f}MB, {width * height / 1e6:4.1f}MP) -> "
+              f"{prepared.width}x{prepared.height} ({len(prepared.data) / 1024:6.1f}KB, 約{prepared.estimated_tokens}トークン)  "
+              f"素朴 p50 {naive_p50:6.1f}ms / p95 {naive_p95:6.1f}ms  "
+              f"縮小読み込み p50 {lean_p50:6.1f}ms / p95 {lean_p95:6.1f}ms  ({naive_p50 / lean_p50:.1f}倍)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+コールドスタート時間を計測するベンチマーク
+新しいPythonプロセス（-X importtime付き）でモジュールのimportと初回呼び出しの各段階を計測し、
+段階ごとの所要時間とimport時間の内訳（トップレベルパッケージ単位）を出力します
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子プロセスで実行する計測コード（段階の区切りをstderrに出力してimporttimeの行と対応付ける）
+CHILD_CODE = r'''
+import sys, time, json, hmac, hashlib, base64
+sys.path.insert(0, {root!r})
+
+def phase(name):
+    sys.stderr.write("phase: " + name + "\n")
+    sys.stderr.flush()
+
+timings = {{}}
+
+phase("import")
+start = time.perf_counter()
+import src.lambda_function as lambda_function
+timings["import"] = time.perf_counter() - start
+
+phase("invalid_signature")
+start = time.perf_counter()
+lambda_function.lambda_handler({{"headers": {{"X-Line-Signature": "invalid"}}, "body": "{{}}"}}, None)
+timings["invalid_signature"] = time.perf_counter() - start
+
+phase("first_webhook")
+body = json.dumps({{"destination": "Ubenchmark", "events": []}})
+signature = base64.b64encode(
+    hmac.new(b"benchmark-secret", body.encode("utf-8"), hashlib.sha256).digest()
+).decode("utf-8")
+start = time.perf_counter()
+lambda_function.lambda_handler({{"headers": {{"X-Line-Signature": signature}}, "body": body}}, None)
+timings["first_webhook"] = time.perf_counter() - start
+
+phase("claude_client")
+start = time.perf_counter()
+lambda_function.get_claude_client()
+timings["claude_client"] = time.perf_counter() - start
+
+phase("end")
+print(json.dumps(timings))
+'''
+
+PHASES = ["import", "invalid_signature", "first_webhook", "claude_client"]
+
+
+def run_once():
+    """新しいプロセスで1回計測し、段階ごとの時間とimport内訳を返す"""
+    env = dict(os.environ)
+    env.update({
+        'LINE_CHANNEL_SECRET': 'benchmark-secret',
+        'LINE_CHANNEL_ACCESS_TOKEN': 'benchmark-token',
+        'ANTHROPIC_API_KEY': 'benchmark-key'
+    })
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD_CODE.format(root=project_root)],
+        capture_output=True, text=True, env=env, cwd=project_root, check=True
+    )
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # phase -> パッケージ -> self時間（マイクロ秒）
+    breakdown = defaultdict(lambda: defaultdict(int))
+    current = None
+    for line in result.stderr.splitlines():
+        if line.startswith('phase: '):
+            current = line[len('phase: '):]
+            continue
+        if not line.startswith('import time:') or current is None or '|' not in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        try:
+            self_us = int(parts[0].strip())
+        except ValueError:
+            continue
+        package = parts[2].strip().split('.')[0]
+        breakdown[current][package] += self_us
+
+    return timings, breakdown
+
+
+def main():
+    parser = argparse.ArgumentParser(description='コールドスタート時間のベンチマーク')
+    parser.add_argument('--runs', type=int, default=5, help='計測回数（中央値を採用）')
+    parser.add_argument('--top', type=int, default=10, help='段階ごとに表示するパッケージ数')
+    parser.add_argument('--output', help='計測結果を保存するJSONファイル')
+    parser.add_argument('--baseline', help='比較対象の計測結果JSONファイル')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='ベースラインに対する許容劣化率（デフォルト: 0.25）')
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+
+    medians = {
+        name: statistics.median(timings[name] for timings, _ in runs) * 1000
+        for name in PHASES
+    }
+    medians['total'] = sum(medians[name] for name in PHASES)
+
+    print(f"コールドスタート計測（{args.runs}回の中央値、ミリ秒）")
+    for name in PHASES + ['total']:
+        print(f"  {name:<18} {medians[name]:8.1f} ms")
+
+    # import内訳は最後の計測結果を表示
+    _, breakdown = runs[-1]
+    for name in PHASES:
+        packages = sorted(breakdown[name].items(), key=lambda item: item[1], reverse=True)
+        if not packages or args.top <= 0:
+            continue
+        print(f"\n[{name}] でimportされたパッケージ（self時間の合計）")
+        for package, self_us in packages[:args.top]:
+            print(f"  {package:<24} {self_us / 1000:8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(medians, f, indent=2)
+        print(f"\n計測結果を{args.output}に保存しました")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = [
+            name for name in PHASES + ['total']
+            if name in baseline and medians[name] > baseline[name] * (1 + args.tolerance)
+        ]
+        if regressions:
+            for name in regressions:
+                print(f"劣化: {name} {baseline[name]:.1f} ms -> {medians[name]:.1f} ms")
+            sys.exit(1)
+        print("ベースラインからの劣化はありません")
+
+
+if __name__ == '__main__':
+    main()
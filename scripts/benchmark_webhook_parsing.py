@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+webhookボディの署名検証・パースの処理時間を計測するマイクロベンチマーク
+SDKのモデルを生成する経路（WebhookParser）と軽量なイベントレコードの経路（src.lean_webhook）を比較します
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import base64
+import argparse
+import warnings
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+warnings.simplefilter('ignore')
+
+from linebot import WebhookHandler
+
+from src import lean_webhook
+
+CHANNEL_SECRET = 'benchmark-secret'
+
+
+def create_body(event_count):
+    """テキストメッセージをevent_count件含むwebhookボディを作成"""
+    events = [
+        {
+            "type": "message",
+            "mode": "active",
+            "timestamp": int(time.time() * 1000),
+            "webhookEventId": f"01H{i:023d}",
+            "deliveryContext": {"isRedelivery": False},
+            "source": {"type": "user", "userId": f"U{i % 50:032d}"},
+            "replyToken": f"benchmark-reply-token-{i}",
+            "message": {"type": "text", "id": str(i), "quoteToken": f"q{i}", "text": f"メッセージ{i}です。" * 5}
+        }
+        for i in range(event_count)
+    ]
+    return json.dumps({"destination": "Ubenchmark", "events": events}, ensure_ascii=False)
+
+
+def sign(body):
+    digest = hmac.new(CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def sdk_path(parser, body, signature):
+    # ConcurrentEventDispatcherの従来の経路（署名検証 + parse内の再検証とモデル生成）
+    assert parser.signature_validator.validate(body, signature)
+    return parser.parse(body, signature, as_payload=True)
+
+
+def lean_path(secret, body, signature):
+    raw = body.encode('utf-8')
+    assert lean_webhook.verify_signature(secret, raw, signature)
+    return lean_webhook.parse_payload(raw)
+
+
+def measure(func, iterations):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='webhookパースのマイクロベンチマーク')
+    parser.add_argument('--events', type=int, nargs='+', default=[1, 10, 100, 500], help='1配信あたりのイベント数')
+    parser.add_argument('--iterations', type=int, default=200, help='計測回数')
+    args = parser.parse_args()
+
+    webhook_parser = WebhookHandler(CHANNEL_SECRET).parser
+    secret = CHANNEL_SECRET.encode('utf-8')
+
+    json_impl = 'orjson' if lean_webhook._loads is not json.loads else 'json'
+    print(f"計測回数: {args.iterations} / JSONパーサー: {json_impl}")
+    for event_count in args.events:
+        body = create_body(event_count)
+        signature = sign(body)
+        sdk_p50, sdk_p95 = measure(lambda: sdk_path(webhook_parser, body, signature), args.iterations)
+        lean_p50, lean_p95 = measure(lambda: lean_path(secret, body, signature), args.iterations)
+        print(f"{event_count:>4}イベント ({len(body.encode('utf-8')) / 1024:7.1f}KB): "
+              f"SDK p50 {sdk_p50:7.3f}ms / p95 {sdk_p95:7.3f}ms  "
+              f"軽量 p50 {lean_p50:7.3f}ms / p95 {lean_p95:7.3f}ms  ({sdk_p50 / lean_p50:.1f}倍)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Claude API（Messages API）とLINE Messaging API（reply/push）のローカル擬似サーバー
+レイテンシ分布・トークン生成速度・429/5xxエラーの注入と、受信したリクエストの記録ができます
+
+ボットから利用する場合は以下の環境変数でエンドポイントを向けます:
+    ANTHROPIC_BASE_URL=http://localhost:8090
+    LINE_API_ENDPOINT=http://localhost:8090
+    LINE_API_DATA_ENDPOINT=http://localhost:8090
+"""
+
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import Counter, deque
+from flask import Flask, Response, request
+
+app = Flask(__name__)
+
+# 擬似応答の生成に使うトークン列
+FAKE_TOKENS = ["これは", "ローカル", "の", "擬似", "サーバー", "による", "応答", "です", "。",
+               "Claude", "APIの", "代わりに", "一定の", "速度で", "テキストを", "返します", "。", "\n"]
+
+config = argparse.Namespace()
+recorded = deque(maxlen=10000)
+stats = Counter()
+used_reply_tokens = set()
+accepted_retry_keys = set()
+batches = {}
+fake_images = {}
+lock = threading.Lock()
+
+
+def sample_latency(mean_ms, jitter_ms, distribution):
+    """指定した分布からレイテンシ（秒）をサンプリング"""
+    if mean_ms <= 0:
+        return 0.0
+    if distribution == 'uniform':
+        value = random.uniform(mean_ms - jitter_ms, mean_ms + jitter_ms)
+    elif distribution == 'normal':
+        value = random.gauss(mean_ms, jitter_ms)
+    elif distribution == 'lognormal':
+        sigma = jitter_ms / mean_ms if jitter_ms else 0.0
+        value = random.lognormvariate(0, sigma) * mean_ms
+    else:
+        value = mean_ms
+    return max(0.0, value) / 1000
+
+
+def record(api, status):
+    """受信したリクエストを記録"""
+    with lock:
+        recorded.append({
+            'time': time.time(),
+            'api': api,
+            'path': request.path,
+            'status': status,
+            'headers': {key: value for key, value in request.headers.items()
+                        if key.lower() not in ('authorization', 'x-api-key')},
+            'body': without_image_data(request.get_json(silent=True))
+        })
+        stats[f"{api} {request.path} {status}"] += 1
+
+
+def without_image_data(body):
+    """記録用に画像のbase64データをバイト数に置き換える"""
+    if not isinstance(body, dict) or not isinstance(body.get('messages'), list):
+        return body
+    messages = []
+    for message in body['messages']:
+        content = message.get('content')
+        if isinstance(content, list):
+            content = [
+                dict(block, source=dict(block['source'], data=f"<{len(block['source'].get('data', ''))} chars>"))
+                if block.get('type') == 'image' else block
+                for block in content
+            ]
+            message = dict(message, content=content)
+        messages.append(message)
+    return dict(body, messages=messages)
+
+
+def injected_error(rate_429, rate_5xx):
+    """注入するエラーのステータスコードを返す（注入しない場合はNone）"""
+    roll = random.random()
+    if roll < rate_429:
+        return 429
+    if roll < rate_429 + rate_5xx:
+        return random.choice([500, 503])
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Claude API (POST /v1/messages)
+# ---------------------------------------------------------------------------
+
+def claude_error(status):
+    error_types = {429: 'rate_limit_error', 500: 'api_error', 503: 'overloaded_error'}
+    body = {'type': 'error', 'error': {'type': error_types[status], 'message': 'Injected error by fake server'}}
+    headers = {'retry-after': str(config.retry_after)} if status == 429 else {}
+    return Response(json.dumps(body), status=status, headers=headers, mimetype='application/json')
+
+
+def generate_tokens(max_tokens):
+    count = min(max_tokens, config.output_tokens)
+    return [FAKE_TOKENS[i % len(FAKE_TOKENS)] for i in range(count)]
+
+
+def fake_message(body):
+    """Messages APIの非ストリーミング応答"""
+    tokens = generate_tokens(body.get('max_tokens', 1024))
+    return {
+        'id': f"msg_fake_{uuid.uuid4().hex[:24]}",
+        'type': 'message',
+        'role': 'assistant',
+        'model': body.get('model', 'claude-fake'),
+        'content': [{'type': 'text', 'text': ''.join(tokens)}],
+        'stop_reason': 'max_tokens' if len(tokens) >= body.get('max_tokens', 1024) else 'end_turn',
+        'stop_sequence': None,
+        'usage': {
+            'input_tokens': estimate_input_tokens(body.get('messages', [])),
+            'output_tokens': len(tokens)
+        }
+    }
+
+
+def estimate_input_tokens(messages):
+    """入力トークン数の概算（画像はbase64のサイズから見積もり、Claudeと同じく1枚1600トークン程度を上限とする）"""
+    image_tokens = sum(
+        min(1600, max(1, len(block['source'].get('data', '')) // 200))
+        for message in messages if isinstance(message.get('content'), list)
+        for block in message['content'] if block.get('type') == 'image'
+    )
+    text = json.dumps(without_image_data({'messages': messages})['messages'], ensure_ascii=False)
+    return max(1, len(text) // 4) + image_tokens
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/v1/messages', methods=['POST'])
+def messages():
+    """Messages APIの擬似エンドポイント（stream=trueでSSE）"""
+    body = request.get_json(force=True)
+
+    status = injected_error(config.claude_429_rate, config.claude_5xx_rate)
+    record('claude', status or 200)
+    if status:
+        time.sleep(sample_latency(config.error_latency_ms, 0, 'fixed'))
+        return claude_error(status)
+
+    tokens = generate_tokens(body.get('max_tokens', 1024))
+    input_tokens = max(1, len(json.dumps(body.get('messages', []), ensure_ascii=False)) // 4)
+    stop_reason = 'max_tokens' if len(tokens) >= body.get('max_tokens', 1024) else 'end_turn'
+    message_id = f"msg_fake_{uuid.uuid4().hex[:24]}"
+    model = body.get('model', 'claude-fake')
+    first_token_latency = sample_latency(config.claude_latency_ms, config.claude_jitter_ms, config.latency_dist)
+    token_interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+    if not body.get('stream'):
+        time.sleep(first_token_latency + token_interval * len(tokens))
+        return fake_message(body)
+
+    def stream():
+        yield sse('message_start', {
+            'type': 'message_start',
+            'message': {
+                'id': message_id, 'type': 'message', 'role': 'assistant', 'model': model,
+                'content': [], 'stop_reason': None, 'stop_sequence': None,
+                'usage': {'input_tokens': input_tokens, 'output_tokens': 1}
+            }
+        })
+        time.sleep(first_token_latency)
+        yield sse('content_block_start', {
+            'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}
+        })
+        for token in tokens:
+            yield sse('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': token}
+            })
+            time.sleep(token_interval)
+        yield sse('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        yield sse('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': stop_reason, 'stop_sequence': None},
+            'usage': {'output_tokens': len(tokens)}
+        })
+        yield sse('message_stop', {'type': 'message_stop'})
+
+    return Response(stream(), mimetype='text/event-stream')
+
+
+# ---------------------------------------------------------------------------
+# Claude Message Batches API (/v1/messages/batches)
+# ---------------------------------------------------------------------------
+
+def iso_time(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+def batch_object(batch):
+    """バッチの状態（作成から--batch-latency-ms経過すると終了）"""
+    ended = time.time() >= batch['ends_at']
+    counts = {'processing': 0, 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0}
+    if ended:
+        for result in batch['results']:
+            counts[result['result']['type']] += 1
+    else:
+        counts['processing'] = len(batch['results'])
+    return {
+        'id': batch['id'],
+        'type': 'message_batch',
+        'processing_status': 'ended' if ended else 'in_progress',
+        'request_counts': counts,
+        'created_at': iso_time(batch['created_at']),
+        'ended_at': iso_time(batch['ends_at']) if ended else None,
+        'expires_at': iso_time(batch['created_at'] + 24 * 3600),
+        'archived_at': None,
+        'cancel_initiated_at': None,
+        'results_url': f"{request.host_url}v1/messages/batches/{batch['id']}/results" if ended else None
+    }
+
+
+@app.route('/v1/messages/batches', methods=['POST'])
+def create_batch():
+    """バッチの作成（結果は作成時に生成し、一部は--claude-5xx-rateの割合でerroredにする）"""
+    body = request.get_json(force=True)
+    status = injected_error(config.claude_429_rate, 0.0)
+    record('claude', status or 200)
+    if status:
+        return claude_error(status)
+
+    results = []
+    for item in body.get('requests', []):
+        if random.random() < config.claude_5xx_rate:
+            result = {'type': 'errored', 'error': {'type': 'error', 'error': {
+                'type': 'api_error', 'message': 'Injected error by fake server'}}}
+        else:
+            result = {'type': 'succeeded', 'message': fake_message(item['params'])}
+        results.append({'custom_id': item['custom_id'], 'result': result})
+
+    now = time.time()
+    batch = {
+        'id': f"msgbatch_fake_{uuid.uuid4().hex[:24]}",
+        'created_at': now,
+        'ends_at': now + config.batch_latency_ms / 1000,
+        'results': results
+    }
+    with lock:
+        batches[batch['id']] = batch
+    return batch_object(batch)
+
+
+@app.route('/v1/messages/batches/<batch_id>', methods=['GET'])
+def retrieve_batch(batch_id):
+    record('claude', 200)
+    with lock:
+        batch = batches.get(batch_id)
+    if batch is None:
+        return Response(json.dumps({'type': 'error', 'error': {'type': 'not_found_error', 'message': 'Not found'}}),
+                        status=404, mimetype='application/json')
+    return batch_object(batch)
+
+
+@app.route('/v1/messages/batches/<batch_id>/results', methods=['GET'])
+def batch_results(batch_id):
+    """終了したバッチの結果（JSONL）"""
+    record('claude', 200)
+    with lock:
+        batch = batches.get(batch_id)
+    if batch is None or time.time() < batch['ends_at']:
+        return Response(json.dumps({'type': 'error', 'error': {'type': 'not_found_error', 'message': 'Not found'}}),
+                        status=404, mimetype='application/json')
+    lines = ''.join(json.dumps(result, ensure_ascii=False) + '\n' for result in batch['results'])
+    return Response(lines, mimetype='application/x-jsonl')
+
+
+# ---------------------------------------------------------------------------
+# LINE Messaging API (reply / push)
+# ---------------------------------------------------------------------------
+
+def line_response(status, message=None):
+    if status == 200:
+        return Response('{}', status=200, mimetype='application/json')
+    return Response(json.dumps({'message': message or 'Injected error by fake server'}),
+                    status=status, mimetype='application/json')
+
+
+@app.route('/v2/bot/message/reply', methods=['POST'])
+def reply():
+    """返信APIの擬似エンドポイント（返信トークンは1回のみ有効）"""
+    body = request.get_json(force=True)
+    time.sleep(sample_latency(config.line_latency_ms, config.line_jitter_ms, config.latency_dist))
+
+    status = injected_error(config.line_429_rate, config.line_5xx_rate)
+    if status:
+        record('line', status)
+        return line_response(status)
+
+    reply_token = body.get('replyToken')
+    with lock:
+        reused = reply_token in used_reply_tokens
+        used_reply_tokens.add(reply_token)
+    if reused:
+        record('line', 400)
+        return line_response(400, 'Invalid reply token')
+
+    record('line', 200)
+    return line_response(200)
+
+
+@app.route('/v2/bot/message/push', methods=['POST'])
+def push():
+    """プッシュAPIの擬似エンドポイント（X-Line-Retry-Keyが受理済みの場合は409）"""
+    time.sleep(sample_latency(config.line_latency_ms, config.line_jitter_ms, config.latency_dist))
+
+    status = injected_error(config.line_429_rate, config.line_5xx_rate)
+    if status:
+        record('line', status)
+        return line_response(status)
+
+    retry_key = request.headers.get('X-Line-Retry-Key')
+    with lock:
+        accepted = retry_key is not None and retry_key in accepted_retry_keys
+        if retry_key is not None:
+            accepted_retry_keys.add(retry_key)
+    if accepted:
+        record('line', 409)
+        return line_response(409, 'The retry key is already accepted')
+
+    record('line', 200)
+    return line_response(200)
+
+
+def fake_image(size):
+    """指定した大きさ（例: 4032x3024）のJPEG画像（初回のみ生成）"""
+    from io import BytesIO
+    from PIL import Image
+
+    with lock:
+        if size not in fake_images:
+            width, height = (int(value) for value in size.split('x'))
+            image = Image.blend(
+                Image.radial_gradient('L').resize((width, height)).convert('RGB'),
+                Image.effect_noise((width, height), 40).convert('RGB'),
+                0.5
+            )
+            output = BytesIO()
+            image.save(output, 'JPEG', quality=92)
+            fake_images[size] = output.getvalue()
+        return fake_images[size]
+
+
+@app.route('/v2/bot/message/<message_id>/content', methods=['GET'])
+def message_content(message_id):
+    """コンテンツAPIの擬似エンドポイント（--image-sizeの大きさのJPEG画像を返す）"""
+    time.sleep(sample_latency(config.line_latency_ms, config.line_jitter_ms, config.latency_dist))
+
+    status = injected_error(config.line_429_rate, config.line_5xx_rate)
+    if status:
+        record('line', status)
+        return line_response(status)
+
+    record('line', 200)
+    return Response(fake_image(config.image_size), mimetype='image/jpeg')
+
+
+# ---------------------------------------------------------------------------
+# 記録の参照
+# ---------------------------------------------------------------------------
+
+@app.route('/_fake/requests', methods=['GET'])
+def list_requests():
+    """記録したリクエストを返す（?api=claude|lineで絞り込み）"""
+    api = request.args.get('api')
+    with lock:
+        items = [item for item in recorded if api is None or item['api'] == api]
+    return {'requests': items}
+
+
+@app.route('/_fake/requests', methods=['DELETE'])
+def clear_requests():
+    """記録と統計をリセット"""
+    with lock:
+        recorded.clear()
+        stats.clear()
+        used_reply_tokens.clear()
+        accepted_retry_keys.clear()
+        batches.clear()
+    return {'status': 'ok'}
+
+
+@app.route('/_fake/config', methods=['POST'])
+def update_config():
+    """起動オプション（エラー率・レイテンシなど）を実行中に変更（例: {"line_5xx_rate": 1.0}）"""
+    updates = request.get_json(force=True)
+    unknown = [key for key in updates if not hasattr(config, key)]
+    if unknown:
+        return Response(json.dumps({'error': f"unknown options: {unknown}"}), status=400, mimetype='application/json')
+    with lock:
+        for key, value in updates.items():
+            setattr(config, key, value)
+    return vars(config)
+
+
+@app.route('/_fake/stats', methods=['GET'])
+def get_stats():
+    """エンドポイント・ステータス別のリクエスト件数を返す"""
+    with lock:
+        return dict(stats)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Claude API / LINE APIのローカル擬似サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--seed', type=int, default=None, help='乱数シード')
+    parser.add_argument('--latency-dist', choices=['fixed', 'uniform', 'normal', 'lognormal'],
+                        default='lognormal', help='レイテンシの分布 (デフォルト: lognormal)')
+
+    parser.add_argument('--claude-latency-ms', type=float, default=800, help='最初のトークンまでの時間（中央値）')
+    parser.add_argument('--claude-jitter-ms', type=float, default=200, help='最初のトークンまでの時間のばらつき')
+    parser.add_argument('--tokens-per-second', type=float, default=60, help='出力トークンの生成速度')
+    parser.add_argument('--output-tokens', type=int, default=200, help='出力トークン数（max_tokensが上限）')
+    parser.add_argument('--claude-429-rate', type=float, default=0.0, help='429を返す割合')
+    parser.add_argument('--claude-5xx-rate', type=float, default=0.0, help='5xxを返す割合')
+    parser.add_argument('--retry-after', type=float, default=1, help='429のretry-afterヘッダー（秒）')
+    parser.add_argument('--error-latency-ms', type=float, default=50, help='エラー応答までの時間')
+    parser.add_argument('--batch-latency-ms', type=float, default=3000, help='バッチの作成から処理終了までの時間')
+
+    parser.add_argument('--line-latency-ms', type=float, default=50, help='LINE APIの応答時間（中央値）')
+    parser.add_argument('--line-jitter-ms', type=float, default=20, help='LINE APIの応答時間のばらつき')
+    parser.add_argument('--line-429-rate', type=float, default=0.0, help='LINE APIで429を返す割合')
+    parser.add_argument('--line-5xx-rate', type=float, default=0.0, help='LINE APIで5xxを返す割合')
+    parser.add_argument('--image-size', default='4032x3024', help='コンテンツAPIが返す画像の大きさ（要Pillow）')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    config = parse_args()
+    if config.seed is not None:
+        random.seed(config.seed)
+
+    print(f"""
+    Claude API / LINE API 擬似サーバー
+    ====================
+    http://{config.host}:{config.port} で実行中
+
+    エンドポイント:
+    - POST   /v1/messages            : Claude Messages API（stream対応）
+    - POST   /v1/messages/batches    : Claude Message Batches API（作成・取得・結果）
+    - POST   /v2/bot/message/reply   : LINE 返信API
+    - POST   /v2/bot/message/push    : LINE プッシュAPI
+    - GET    /v2/bot/message/<id>/content : LINE コンテンツAPI（画像）
+    - GET    /_fake/requests         : 記録したリクエスト
+    - DELETE /_fake/requests         : 記録のリセット
+    - POST   /_fake/config           : 設定の変更
+    - GET    /_fake/stats            : リクエスト件数
+    """)
+
+    app.run(host=config.host, port=config.port, threaded=True)
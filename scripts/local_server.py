@@ -2,17 +2,28 @@
 """
 LINE botのwebhookをテストするためのローカルFlaskサーバー
 Lambda関数をローカルでシミュレートします
+
+--productionを指定すると、Lambdaの代わりにコンテナでホストするための
+マルチワーカーのWSGIサーバー（gunicorn）で起動します
 """
 
 import os
+import sys
 import json
+import argparse
 import hmac
 import hashlib
 import base64
+import time
+import threading
 from flask import Flask, request, abort
 from datetime import datetime
 from dotenv import load_dotenv
 
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
 # 環境変数を読み込み
 load_dotenv()
 
@@ -22,6 +33,9 @@ app = Flask(__name__)
 LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET', '')
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN', '')
 PORT = int(os.getenv('LOCAL_SERVER_PORT', 5000))
+BOT_MODE = os.getenv('BOT_MODE', 'sync')
+WORKER_POLL_INTERVAL = float(os.getenv('WORKER_POLL_INTERVAL', 0.2))
+DELIVERY_RETRY_INTERVAL = float(os.getenv('DELIVERY_RETRY_INTERVAL', 5))
 
 def verify_signature(body, signature):
     """LINE webhookの署名を検証"""
@@ -172,13 +186,164 @@ def test_webhook():
         print(f"Lambdaハンドラーでエラーが発生: {str(e)}")
         return {"error": str(e)}, 500
 
+def run_worker_loop():
+    """BOT_MODE=split時にキューを処理するローカルワーカー"""
+    from src.lambda_function import worker_handler
+
+    while True:
+        try:
+            result = worker_handler({}, None)
+            if result['received'] == 0:
+                time.sleep(WORKER_POLL_INTERVAL)
+        except Exception as e:
+            print(f"ワーカーでエラーが発生: {str(e)}")
+            time.sleep(WORKER_POLL_INTERVAL)
+
+def run_retry_loop():
+    """BOT_MODE=sync時に再送キューを定期的に処理するローカルの定期実行"""
+    from src.lambda_function import retry_handler
+
+    while True:
+        time.sleep(DELIVERY_RETRY_INTERVAL)
+        try:
+            retry_handler({}, None)
+        except Exception as e:
+            print(f"再送でエラーが発生: {str(e)}")
+
+def start_background_loop():
+    """BOT_MODEに応じてキューワーカー（split）または再送の定期実行（sync）を起動"""
+    target = run_worker_loop if BOT_MODE == 'split' else run_retry_loop
+    threading.Thread(target=target, daemon=True).start()
+
 @app.errorhandler(Exception)
 def handle_error(error):
     """グローバルエラーハンドラー"""
     print(f"エラー: {str(error)}")
     return {"error": str(error)}, 500
 
+# ---------------------------------------------------------------------------
+# 本番モード（--production）
+# Flaskを介さない軽量なWSGIアプリで、ハンドラーはワーカーごとに1回だけimportする
+# ---------------------------------------------------------------------------
+
+_lambda_handler = None
+
+def get_lambda_handler():
+    """Lambdaハンドラーを初回のみimportして返す"""
+    global _lambda_handler
+    if _lambda_handler is None:
+        from src.lambda_function import lambda_handler
+        _lambda_handler = lambda_handler
+    return _lambda_handler
+
+def create_lean_lambda_event(environ, body):
+    """WSGI環境からハンドラーが参照する項目だけのLambdaイベントを作成"""
+    return {
+        "path": environ.get('PATH_INFO', '/'),
+        "httpMethod": environ['REQUEST_METHOD'],
+        "headers": {
+            "Content-Type": environ.get('CONTENT_TYPE', ''),
+            "X-Line-Signature": environ.get('HTTP_X_LINE_SIGNATURE', '')
+        },
+        "requestContext": {
+            "requestTimeEpoch": int(time.time() * 1000)
+        },
+        "body": body,
+        "isBase64Encoded": False
+    }
+
+def respond(start_response, status_code, body):
+    status = {200: '200 OK', 400: '400 Bad Request', 404: '404 Not Found', 500: '500 Internal Server Error'}.get(
+        status_code, f'{status_code} Error')
+    start_response(status, [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(body)))
+    ])
+    return [body]
+
+def read_body(environ):
+    """リクエストボディを読み込む（Content-Lengthがないchunked転送はEOFまで読む）"""
+    stream = environ['wsgi.input']
+    length = environ.get('CONTENT_LENGTH')
+    if length:
+        return stream.read(int(length))
+    chunks = []
+    while True:
+        chunk = stream.read(65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+def production_app(environ, start_response):
+    """本番モードのWSGIアプリ（GET / と POST /webhook のみ）"""
+    method = environ['REQUEST_METHOD']
+    path = environ.get('PATH_INFO', '/')
+    
+    if method == 'GET' and path == '/':
+        return respond(start_response, 200, b'{"status": "ok"}')
+    if method != 'POST' or path != '/webhook':
+        return respond(start_response, 404, b'{"error": "not found"}')
+    
+    try:
+        body = read_body(environ).decode('utf-8')
+    except (UnicodeDecodeError, ValueError):
+        return respond(start_response, 400, b'{"error": "bad request"}')
+    
+    try:
+        response = get_lambda_handler()(create_lean_lambda_event(environ, body), {})
+    except Exception as e:
+        print(f"Lambdaハンドラーでエラーが発生: {str(e)}")
+        return respond(start_response, 500, b'{"error": "internal server error"}')
+    return respond(start_response, response.get('statusCode', 200), response.get('body', '').encode('utf-8'))
+
+def post_worker_init(worker):
+    """gunicornのワーカー起動時にハンドラーを読み込み、キューワーカーまたは再送の定期実行を起動"""
+    get_lambda_handler()
+    start_background_loop()
+
+def run_production(workers, threads):
+    """gunicorn（gthreadワーカー）で本番モードのサーバーを起動"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("本番モードにはgunicornが必要です: pip install gunicorn")
+        sys.exit(1)
+    
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'0.0.0.0:{PORT}',
+                'workers': workers,
+                'threads': threads,
+                'worker_class': 'gthread',
+                'keepalive': 5,
+                'accesslog': None,
+                'loglevel': 'warning',
+                'post_worker_init': post_worker_init
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+        
+        def load(self):
+            return production_app
+    
+    print(f"本番モードで起動: http://0.0.0.0:{PORT} （workers={workers}, threads={threads}）")
+    ProductionServer().run()
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='LINE Bot ローカルサーバー')
+    parser.add_argument('--production', action='store_true',
+                        help='マルチワーカーのWSGIサーバーで起動（デバッグ出力なし）')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('LOCAL_SERVER_WORKERS', os.cpu_count() or 1)),
+                        help='ワーカープロセス数 (デフォルト: CPU数)')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('LOCAL_SERVER_THREADS', 8)),
+                        help='ワーカーごとのスレッド数 (デフォルト: 8)')
+    args = parser.parse_args()
+    
+    if args.production:
+        run_production(args.workers, args.threads)
+        sys.exit(0)
+    
     print(f"""
     LINE Bot ローカルサーバー
     ====================
@@ -192,6 +357,11 @@ if __name__ == '__main__':
     環境変数:
     - LINE_CHANNEL_SECRET: {'設定済み' if LINE_CHANNEL_SECRET else '未設定'}
     - LINE_CHANNEL_ACCESS_TOKEN: {'設定済み' if LINE_CHANNEL_ACCESS_TOKEN else '未設定'}
+    - BOT_MODE: {BOT_MODE}
     """)
     
+    # debugリローダーの親プロセスではワーカーを起動しない
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_loop()
+    
     app.run(host='0.0.0.0', port=PORT, debug=True)
\ No newline at end of file
@@ -8,6 +8,13 @@ import json
 import hmac
 import hashlib
 import base64
+import math
+import time
+import uuid
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import argparse
 from dotenv import load_dotenv
@@ -16,6 +23,13 @@ import os
 # 環境変数を読み込み
 load_dotenv()
 
+DEFAULT_USER_ID = "U123456789abcdef0123456789abcdef0"
+EVENT_TYPES = ['message', 'follow', 'postback']
+SAMPLE_MESSAGES = ['Hello!', 'こんにちは', '営業時間を教えてください', 'ありがとう', 'Pythonについて説明して']
+# 固定レートで予定の送信時刻から遅れたとみなす秒数
+SCHEDULE_LAG_THRESHOLD = 0.01
+HISTOGRAM_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
 def generate_signature(channel_secret, body):
     """LINE webhook署名を生成"""
     hash = hmac.new(
@@ -25,67 +39,44 @@ def generate_signature(channel_secret, body):
     ).digest()
     return base64.b64encode(hash).decode('utf-8')
 
-def send_test_message(url, message_text, channel_secret=None):
-    """テストテキストメッセージwebhookを送信"""
+def create_event(event_type, user_id, message_text='Hello, bot!', data='action=test&value=123'):
+    """指定タイプのLINE webhookイベントを作成"""
+    now = datetime.now()
     
-    webhook_body = {
-        "destination": "U123456789abcdef0123456789abcdef0",
-        "events": [
-            {
-                "type": "message",
-                "mode": "active",
-                "timestamp": int(datetime.now().timestamp() * 1000),
-                "source": {
-                    "type": "user",
-                    "userId": "U123456789abcdef0123456789abcdef0"
-                },
-                "replyToken": "test-reply-token-" + str(datetime.now().timestamp()),
-                "message": {
-                    "type": "text",
-                    "id": str(int(datetime.now().timestamp() * 1000)),
-                    "text": message_text
-                }
-            }
-        ]
+    event = {
+        "type": event_type,
+        "mode": "active",
+        "timestamp": int(now.timestamp() * 1000),
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {
+            "isRedelivery": False
+        },
+        "source": {
+            "type": "user",
+            "userId": user_id
+        },
+        "replyToken": "test-reply-token-" + str(now.timestamp())
     }
     
-    body_json = json.dumps(webhook_body)
-    
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "LineBotWebhook/2.0"
-    }
-    
-    if channel_secret:
-        signature = generate_signature(channel_secret, body_json)
-        headers["X-Line-Signature"] = signature
+    if event_type == 'message':
+        event["message"] = {
+            "type": "text",
+            "id": str(int(now.timestamp() * 1000)),
+            "text": message_text
+        }
+    elif event_type == 'postback':
+        event["postback"] = {
+            "data": data
+        }
     
-    try:
-        response = requests.post(url, data=body_json, headers=headers)
-        print(f"レスポンスステータス: {response.status_code}")
-        print(f"レスポンスボディ: {response.text}")
-        return response
-    except Exception as e:
-        print(f"リクエスト送信エラー: {str(e)}")
-        return None
+    return event
 
-def send_follow_event(url, channel_secret=None):
-    """テストフォローイベントwebhookを送信"""
+def create_webhook_request(events, channel_secret=None):
+    """イベントのリストからwebhookボディとヘッダーを作成"""
     
     webhook_body = {
         "destination": "U123456789abcdef0123456789abcdef0",
-        "events": [
-            {
-                "type": "follow",
-                "mode": "active",
-                "timestamp": int(datetime.now().timestamp() * 1000),
-                "source": {
-                    "type": "user",
-                    "userId": "U123456789abcdef0123456789abcdef0"
-                },
-                "replyToken": "test-reply-token-" + str(datetime.now().timestamp())
-            }
-        ]
+        "events": events
     }
     
     body_json = json.dumps(webhook_body)
@@ -99,6 +90,13 @@ def send_follow_event(url, channel_secret=None):
         signature = generate_signature(channel_secret, body_json)
         headers["X-Line-Signature"] = signature
     
+    return body_json, headers
+
+def post_webhook(url, events, channel_secret=None):
+    """webhookを1回送信して結果を表示"""
+    
+    body_json, headers = create_webhook_request(events, channel_secret)
+    
     try:
         response = requests.post(url, data=body_json, headers=headers)
         print(f"レスポンスステータス: {response.status_code}")
@@ -108,47 +106,165 @@ def send_follow_event(url, channel_secret=None):
         print(f"リクエスト送信エラー: {str(e)}")
         return None
 
+def send_test_message(url, message_text, channel_secret=None):
+    """テストテキストメッセージwebhookを送信"""
+    event = create_event('message', DEFAULT_USER_ID, message_text=message_text)
+    return post_webhook(url, [event], channel_secret)
+
+def send_follow_event(url, channel_secret=None):
+    """テストフォローイベントwebhookを送信"""
+    event = create_event('follow', DEFAULT_USER_ID)
+    return post_webhook(url, [event], channel_secret)
+
 def send_postback_event(url, data, channel_secret=None):
     """テストポストバックイベントwebhookを送信"""
+    event = create_event('postback', DEFAULT_USER_ID, data=data)
+    return post_webhook(url, [event], channel_secret)
+
+def parse_mix(mix):
+    """'message=8,follow=1,postback=1'形式のイベント構成比を解析"""
+    weights = {}
+    for item in mix.split(','):
+        event_type, _, weight = item.partition('=')
+        event_type = event_type.strip()
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type: {event_type}")
+        weights[event_type] = float(weight or 1)
+    return weights
+
+def percentile(sorted_values, p):
+    """ソート済みの値から最近接順位法でパーセンタイルを求める"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class LoadGenerator:
+    """webhookを並行送信してレイテンシを計測する負荷生成器"""
     
-    webhook_body = {
-        "destination": "U123456789abcdef0123456789abcdef0",
-        "events": [
-            {
-                "type": "postback",
-                "mode": "active",
-                "timestamp": int(datetime.now().timestamp() * 1000),
-                "source": {
-                    "type": "user",
-                    "userId": "U123456789abcdef0123456789abcdef0"
-                },
-                "replyToken": "test-reply-token-" + str(datetime.now().timestamp()),
-                "postback": {
-                    "data": data
-                }
-            }
-        ]
-    }
+    def __init__(self, url, channel_secret, concurrency, rps, duration,
+                 mix, events_per_body, users, timeout):
+        self.url = url
+        self.channel_secret = channel_secret
+        self.concurrency = concurrency
+        self.rps = rps
+        self.duration = duration
+        self.events_per_body = events_per_body
+        self.user_ids = [f"U{i:032x}" for i in range(users)]
+        self.timeout = timeout
+        self.event_types = list(mix.keys())
+        self.weights = list(mix.values())
+        
+        self.latencies = []
+        self.statuses = Counter()
+        # 固定レートで、予定時刻から遅れて送信を開始した件数と最大の遅れ
+        self.behind_schedule = 0
+        self.max_lag = 0.0
+        self.lock = threading.Lock()
+        self.local = threading.local()
     
-    body_json = json.dumps(webhook_body)
+    def session(self):
+        # スレッドごとにSessionを持ち、keep-aliveで接続を再利用する
+        if not hasattr(self.local, 'session'):
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.local.session = session
+        return self.local.session
     
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "LineBotWebhook/2.0"
-    }
+    def create_events(self):
+        events = []
+        for event_type in random.choices(self.event_types, self.weights, k=self.events_per_body):
+            user_id = random.choice(self.user_ids)
+            events.append(create_event(
+                event_type,
+                user_id,
+                message_text=random.choice(SAMPLE_MESSAGES)
+            ))
+        return events
     
-    if channel_secret:
-        signature = generate_signature(channel_secret, body_json)
-        headers["X-Line-Signature"] = signature
+    def send_one(self, scheduled=None):
+        # 固定レートでは予定の送信時刻から計測し、空きワーカー待ちの時間もレイテンシに含める
+        # （実際の送信時刻から計測すると、サーバーが詰まった間の待ち時間が結果から抜け落ちる）
+        body_json, headers = create_webhook_request(self.create_events(), self.channel_secret)
+        
+        start = time.perf_counter()
+        lag = 0.0
+        if scheduled is not None:
+            lag = max(0.0, start - scheduled)
+            start = scheduled
+        try:
+            response = self.session().post(self.url, data=body_json, headers=headers, timeout=self.timeout)
+            status = str(response.status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        latency = time.perf_counter() - start
+        
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[status] += 1
+            if lag > SCHEDULE_LAG_THRESHOLD:
+                self.behind_schedule += 1
+                self.max_lag = max(self.max_lag, lag)
     
-    try:
-        response = requests.post(url, data=body_json, headers=headers)
-        print(f"レスポンスステータス: {response.status_code}")
-        print(f"レスポンスボディ: {response.text}")
-        return response
-    except Exception as e:
-        print(f"リクエスト送信エラー: {str(e)}")
-        return None
+    def run(self):
+        start = time.perf_counter()
+        deadline = start + self.duration
+        
+        if self.rps:
+            # 固定レート（オープンループ）: 応答を待たずに一定間隔で送信
+            interval = 1.0 / self.rps
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                next_send = start
+                while next_send < deadline:
+                    executor.submit(self.send_one, next_send)
+                    next_send += interval
+                    time.sleep(max(0.0, next_send - time.perf_counter()))
+        else:
+            # 固定並行数（クローズドループ）: 各ワーカーが応答を受け取り次第次を送信
+            def worker():
+                while time.perf_counter() < deadline:
+                    self.send_one()
+            
+            threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        return time.perf_counter() - start
+    
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        total = len(latencies)
+        errors = sum(count for status, count in self.statuses.items() if not status.startswith('2'))
+        
+        print("\n負荷テスト結果")
+        print("=" * 50)
+        print(f"リクエスト数: {total} （{elapsed:.1f}秒）")
+        print(f"スループット: {total / elapsed:.1f} req/s （{total * self.events_per_body / elapsed:.1f} events/s）")
+        print(f"エラー率: {errors / total * 100 if total else 0:.2f}% （{errors}件）")
+        print("ステータス: " + ", ".join(f"{status}={count}" for status, count in sorted(self.statuses.items())))
+        if self.rps:
+            print(f"予定より遅れた送信: {self.behind_schedule}件 （最大{self.max_lag * 1000:.1f}ms）")
+        
+        if not latencies:
+            return
+        
+        print(f"レイテンシ: p50={percentile(latencies, 50) * 1000:.1f}ms "
+              f"p95={percentile(latencies, 95) * 1000:.1f}ms "
+              f"p99={percentile(latencies, 99) * 1000:.1f}ms "
+              f"max={latencies[-1] * 1000:.1f}ms")
+        
+        print("\nレイテンシ分布")
+        lower = 0
+        for upper in HISTOGRAM_BUCKETS_MS + [float('inf')]:
+            count = sum(1 for latency in latencies if lower <= latency * 1000 < upper)
+            label = f"{lower:>5}-{upper:<5}ms" if upper != float('inf') else f"{lower:>5}+     ms"
+            bar = '#' * round(count / total * 50)
+            print(f"  {label} {count:>7} {bar}")
+            lower = upper
 
 def main():
     parser = argparse.ArgumentParser(description='LINE botサーバーにテストwebhookを送信')
@@ -165,6 +281,24 @@ def main():
     parser.add_argument('--no-signature', action='store_true',
                         help='署名生成をスキップ')
     
+    # 負荷テストモード
+    parser.add_argument('--load', action='store_true',
+                        help='負荷テストモードで送信')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='同時送信数 (デフォルト: 10)')
+    parser.add_argument('--rps', type=float, default=None,
+                        help='1秒あたりの送信数 (指定時は固定レート、未指定時は固定並行数)')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='負荷テストの実行秒数 (デフォルト: 30)')
+    parser.add_argument('--mix', default='message=8,follow=1,postback=1',
+                        help='イベントタイプの構成比 (デフォルト: message=8,follow=1,postback=1)')
+    parser.add_argument('--events-per-body', type=int, default=1,
+                        help='1リクエストに含めるイベント数 (デフォルト: 1)')
+    parser.add_argument('--users', type=int, default=100,
+                        help='送信元ユーザーIDの数 (デフォルト: 100)')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='リクエストのタイムアウト秒数 (デフォルト: 30)')
+    
     args = parser.parse_args()
     
     # 環境からチャンネルシークレットを取得
@@ -176,6 +310,23 @@ def main():
     else:
         url = args.url
     
+    if args.load:
+        generator = LoadGenerator(
+            url, channel_secret,
+            concurrency=args.concurrency,
+            rps=args.rps,
+            duration=args.duration,
+            mix=parse_mix(args.mix),
+            events_per_body=args.events_per_body,
+            users=args.users,
+            timeout=args.timeout
+        )
+        mode = f"{args.rps} req/s" if args.rps else f"並行数 {args.concurrency}"
+        print(f"{url}に負荷テストを実行 （{mode}、{args.duration}秒）")
+        elapsed = generator.run()
+        generator.report(elapsed)
+        return
+    
     print(f"{args.type}イベントを{url}に送信")
     
     if args.type == 'message':
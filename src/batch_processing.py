@@ -0,0 +1,233 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.delivery_queue import DELIVERY_DEAD_LETTERED, DELIVERY_QUEUED
+
+logger = logging.getLogger()
+
+# Message Batches APIの1バッチあたりのリクエスト数の上限
+MAX_BATCH_REQUESTS = 100000
+
+# 読み込めない行をログに出力する際の最大文字数
+LOG_LINE_MAX_CHARS = 200
+
+
+class BatchItem:
+    """
+    バッチで処理する1件の質問（送信先のユーザーとテキスト、受信したチャネルのdestination、
+    webhookイベントから取り出した場合はwebhookEventId）
+    """
+
+    __slots__ = ('custom_id', 'user_id', 'text', 'destination', 'event_id')
+
+    def __init__(self, custom_id: str, user_id: str, text: str, destination: Optional[str] = None,
+                 event_id: Optional[str] = None) -> None:
+        self.custom_id = custom_id
+        self.user_id = user_id
+        self.text = text
+        self.destination = destination
+        self.event_id = event_id
+
+
+class BatchResult:
+    """
+    バッチの1件の結果（成功時はtextとusage、失敗時はerror）
+    """
+
+    __slots__ = ('item', 'text', 'usage', 'model', 'stop_reason', 'error')
+
+    def __init__(self, item: BatchItem, text: Optional[str] = None, usage: Any = None, model: Optional[str] = None,
+                 stop_reason: Optional[str] = None, error: Optional[str] = None) -> None:
+        self.item = item
+        self.text = text
+        self.usage = usage
+        self.model = model
+        self.stop_reason = stop_reason
+        self.error = error
+
+
+def read_items(lines: Iterable[str]) -> Iterator[BatchItem]:
+    """
+    JSONLの各行からテキストメッセージを取り出す
+    各行はwebhookボディ（destination・events）、キューのレコード（destination・event）、
+    LINEのイベント、または {"user_id": ..., "text": ...} のいずれか（テキスト以外のイベントは無視）
+    読み込めない行はログに出力して読み飛ばし、他の行の処理を続ける
+    """
+    index = 0
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items = list(_line_items(json.loads(line)))
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+            logger.error("%d行目を読み込めません: %s %s", number, str(e), line[:LOG_LINE_MAX_CHARS])
+            continue
+
+        for user_id, text, destination, event_id in items:
+            yield BatchItem(f"item-{index}", user_id, text, destination, event_id)
+            index += 1
+
+
+def _line_items(record: Dict[str, Any]) -> Iterator[Tuple[str, str, Optional[str], Optional[str]]]:
+    # 1行分のレコードから (user_id, text, destination, webhookEventId) を取り出す
+    if 'events' in record:
+        events = record['events']
+    elif 'event' in record:
+        events = [record['event']]
+    else:
+        events = [record]
+
+    for event in events:
+        if 'user_id' in event and 'text' in event:
+            user_id, text = event['user_id'], event['text']
+        elif event.get('type') == 'message' and (event.get('message') or {}).get('type') == 'text':
+            user_id, text = (event.get('source') or {}).get('userId'), event['message']['text']
+        else:
+            continue
+        if not user_id or not text:
+            continue
+        yield user_id, text, event.get('destination') or record.get('destination'), event.get('webhookEventId')
+
+
+def failed_record(result: BatchResult) -> Dict[str, Any]:
+    """
+    失敗した質問を再実行用に書き出すレコード（read_itemsで同じチャネルの質問として読み込める）
+    """
+    return {
+        'user_id': result.item.user_id,
+        'text': result.item.text,
+        'destination': result.item.destination,
+        'error': result.error
+    }
+
+
+class BatchProcessor:
+    """
+    Message Batches APIで複数の質問をまとめてClaudeに送信し、完了後に結果を配信する
+    リアルタイムの会話とは別のレート制限枠で処理されるため、大量の再処理でも通常の応答に影響しない
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        build_params: Callable[[BatchItem], Dict[str, Any]],
+        poll_interval_seconds: float = 10.0,
+        max_wait_seconds: float = 24 * 3600,
+        delivery_concurrency: int = 4,
+        max_requests: int = MAX_BATCH_REQUESTS
+    ) -> None:
+        self._client = client
+        self._build_params = build_params
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.delivery_concurrency = max(1, delivery_concurrency)
+        self.max_requests = min(max_requests, MAX_BATCH_REQUESTS)
+
+    def submit(self, items: List[BatchItem]) -> str:
+        """
+        1つのバッチとして送信し、バッチIDを返す
+        """
+        batch = self._client.messages.batches.create(requests=[
+            {'custom_id': item.custom_id, 'params': self._build_params(item)}
+            for item in items
+        ])
+        logger.info("%d件のバッチを送信: %s", len(items), batch.id)
+        return batch.id
+
+    def wait(self, batch_id: str) -> Any:
+        """
+        バッチの処理が終わるまでポーリングし、終了したバッチを返す
+        """
+        deadline = time.monotonic() + self.max_wait_seconds
+        while True:
+            batch = self._client.messages.batches.retrieve(batch_id)
+            if batch.processing_status == 'ended':
+                counts = batch.request_counts
+                logger.info(
+                    "バッチ%sの処理が終了: succeeded=%d errored=%d expired=%d canceled=%d",
+                    batch_id, counts.succeeded, counts.errored, counts.expired, counts.canceled
+                )
+                return batch
+            if time.monotonic() + self.poll_interval_seconds > deadline:
+                raise TimeoutError(f"Batch {batch_id} did not finish within {self.max_wait_seconds} seconds")
+            time.sleep(self.poll_interval_seconds)
+
+    def results(self, batch_id: str, items: List[BatchItem]) -> List[BatchResult]:
+        """
+        バッチの結果を取得し、送信した順に並べて返す
+        """
+        by_id = {item.custom_id: item for item in items}
+        results: Dict[str, BatchResult] = {}
+        for entry in self._client.messages.batches.results(batch_id):
+            item = by_id.get(entry.custom_id)
+            if item is None:
+                continue
+            result = entry.result
+            if result.type == 'succeeded':
+                message = result.message
+                text = ''.join(block.text for block in message.content if getattr(block, 'type', None) == 'text')
+                results[item.custom_id] = BatchResult(
+                    item, text=text, usage=message.usage, model=message.model, stop_reason=message.stop_reason
+                )
+            else:
+                error = getattr(getattr(getattr(result, 'error', None), 'error', None), 'message', None)
+                results[item.custom_id] = BatchResult(item, error=error or result.type)
+
+        return [results.get(item.custom_id) or BatchResult(item, error='missing') for item in items]
+
+    def deliver(self, results: List[BatchResult], send: Callable[[BatchResult], Optional[str]]) -> Dict[str, int]:
+        """
+        成功した結果をユーザーごとに送信した順で配信（異なるユーザーはdelivery_concurrencyまで並行）
+        sendの戻り値（送信結果）ごとに、送信できた件数・再送キューに保存した件数・dead letterに保存した件数を返す
+        """
+        lanes: Dict[str, List[BatchResult]] = OrderedDict()
+        for result in results:
+            if result.error is None:
+                lanes.setdefault(result.item.user_id, []).append(result)
+
+        def run_lane(lane: List[BatchResult]) -> Dict[str, int]:
+            counts = {'delivered': 0, 'queued': 0, 'dead_lettered': 0}
+            for result in lane:
+                try:
+                    status = send(result)
+                except Exception as e:
+                    logger.error(f"バッチ結果の配信中にエラーが発生: {result.item.custom_id} {str(e)}")
+                    continue
+                if status == DELIVERY_QUEUED:
+                    counts['queued'] += 1
+                elif status == DELIVERY_DEAD_LETTERED:
+                    counts['dead_lettered'] += 1
+                else:
+                    counts['delivered'] += 1
+            return counts
+
+        totals = {'delivered': 0, 'queued': 0, 'dead_lettered': 0}
+        with ThreadPoolExecutor(max_workers=self.delivery_concurrency, thread_name_prefix='batch-deliver') as executor:
+            for counts in executor.map(run_lane, lanes.values()):
+                for key, count in counts.items():
+                    totals[key] += count
+        return totals
+
+    def run(self, items: List[BatchItem], send: Callable[[BatchResult], Optional[str]]) -> Dict[str, Any]:
+        """
+        max_requests件ごとにバッチを送信・待機・配信し、件数の集計を返す
+        deliveredは送信できた件数のみで、再送キュー・dead letterに保存した件数はqueued・dead_letteredに数える
+        """
+        summary: Dict[str, Any] = {
+            'items': len(items), 'succeeded': 0, 'failed': [], 'delivered': 0, 'queued': 0, 'dead_lettered': 0
+        }
+        for offset in range(0, len(items), self.max_requests):
+            chunk = items[offset:offset + self.max_requests]
+            batch_id = self.submit(chunk)
+            self.wait(batch_id)
+            results = self.results(batch_id, chunk)
+            summary['succeeded'] += sum(1 for result in results if result.error is None)
+            summary['failed'].extend(result for result in results if result.error is not None)
+            for key, count in self.deliver(results, send).items():
+                summary[key] += count
+        return summary
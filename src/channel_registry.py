@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class Channel:
+    """
+    1つのLINEチャネルの設定（webhookのdestinationで識別）
+    """
+
+    __slots__ = ('destination', 'name', 'channel_secret', 'access_token', 'system_prompt')
+
+    def __init__(self, destination: str, name: str, channel_secret: str, access_token: str,
+                 system_prompt: Optional[str] = None) -> None:
+        self.destination = destination
+        self.name = name
+        self.channel_secret = channel_secret
+        self.access_token = access_token
+        self.system_prompt = system_prompt
+
+
+class ChannelClients:
+    """
+    チャネルごとのクライアント（送信用のLineBotApiと署名検証・解析用のWebhookParser）
+    """
+
+    __slots__ = ('line_bot_api', 'parser')
+
+    def __init__(self, line_bot_api: Any, parser: Any) -> None:
+        self.line_bot_api = line_bot_api
+        self.parser = parser
+
+
+# 現在処理中のチャネル（Noneは環境変数で設定したデフォルトのチャネル）
+_channel: ContextVar[Optional[Channel]] = ContextVar('channel', default=None)
+
+
+def current_channel() -> Optional[Channel]:
+    return _channel.get()
+
+
+@contextmanager
+def channel_scope(channel: Optional[Channel]) -> Iterator[Optional[Channel]]:
+    """
+    with文の中で処理するチャネルを設定
+    """
+    token = _channel.set(channel)
+    try:
+        yield channel
+    finally:
+        _channel.reset(token)
+
+
+class ChannelRegistry:
+    """
+    destinationごとのチャネル設定と、チャネルごとのクライアントを保持する
+    クライアントは初回利用時にclient_factoryで生成してウォームコンテナの呼び出し間で再利用し、
+    max_clientsを超えた場合は最も長く使われていないチャネルのものから破棄する
+    """
+
+    def __init__(self, channels: List[Channel], client_factory: Callable[[Channel], ChannelClients],
+                 max_clients: int = 16) -> None:
+        self._channels = {channel.destination: channel for channel in channels}
+        self._client_factory = client_factory
+        self.max_clients = max(1, max_clients)
+
+        self._lock = threading.Lock()
+        self._clients: 'OrderedDict[str, ChannelClients]' = OrderedDict()
+        self.created = 0
+        self.evictions = 0
+
+    def resolve(self, destination: Optional[str]) -> Optional[Channel]:
+        """
+        destinationに対応するチャネル（未登録の場合はNone）
+        """
+        if not destination:
+            return None
+        return self._channels.get(destination)
+
+    def clients(self, channel: Channel) -> ChannelClients:
+        """
+        チャネルのクライアントを返す（未生成・破棄済みの場合は生成する）
+        """
+        with self._lock:
+            clients = self._clients.get(channel.destination)
+            if clients is not None:
+                self._clients.move_to_end(channel.destination)
+                return clients
+
+        # 生成中に他のチャネルの処理を止めないよう、ロックの外で生成する
+        created = self._client_factory(channel)
+        with self._lock:
+            clients = self._clients.get(channel.destination)
+            if clients is not None:
+                self._clients.move_to_end(channel.destination)
+                return clients
+            self._clients[channel.destination] = created
+            self.created += 1
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+        return created
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'cached_clients': len(self._clients),
+                'created': self.created,
+                'evictions': self.evictions
+            }
+
+
+def load_channels(config: str) -> List[Channel]:
+    """
+    チャネル設定のJSON（またはJSONファイルのパス）を読み込む
+    各チャネルはdestination・name・system_promptと、channel_secret・access_tokenの値
+    またはそれらを格納した環境変数名（channel_secret_env・access_token_env）を持つ
+    """
+    config = config.strip()
+    if not config.startswith('['):
+        with open(config, encoding='utf-8') as f:
+            config = f.read()
+
+    channels = []
+    for entry in json.loads(config):
+        destination = entry['destination']
+        channel_secret = entry.get('channel_secret') or os.environ.get(entry.get('channel_secret_env', ''))
+        access_token = entry.get('access_token') or os.environ.get(entry.get('access_token_env', ''))
+        if not channel_secret or not access_token:
+            raise ValueError(f"Channel {destination} has no channel secret or access token")
+        channels.append(Channel(
+            destination,
+            entry.get('name') or destination,
+            channel_secret,
+            access_token,
+            entry.get('system_prompt') or None
+        ))
+    return channels
+
+
+def create_channel_registry(client_factory: Callable[[Channel], ChannelClients]) -> ChannelRegistry:
+    """
+    環境変数の設定からチャネルの登録情報を作成
+    """
+    return ChannelRegistry(
+        load_channels(os.environ['CHANNELS_CONFIG']),
+        client_factory,
+        max_clients=int(os.environ.get('CHANNEL_CLIENT_CACHE_SIZE', '16'))
+    )
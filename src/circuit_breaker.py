@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# メトリクスに出力する状態の値
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """
+    依存先が不調のため、サーキットブレーカーが呼び出しを遮断した
+    """
+
+
+class CircuitBreaker:
+    """
+    直近window_seconds秒の呼び出しのエラー率・遅延率を監視するサーキットブレーカー
+    しきい値を超えると開いて呼び出しを即座に遮断し、open_seconds後に半開状態で
+    half_open_probes件の試行呼び出しがすべて成功すれば閉じる（1件でも失敗すれば再び開く）
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 30.0,
+        min_calls: int = 10,
+        error_rate: float = 0.5,
+        slow_call_seconds: float = 10.0,
+        slow_call_rate: float = 0.8,
+        open_seconds: float = 15.0,
+        half_open_probes: int = 2,
+        on_transition: Optional[Callable[[str, str], None]] = None
+    ) -> None:
+        self.window_seconds = window_seconds
+        self.min_calls = max(1, min_calls)
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.on_transition = on_transition
+
+        self._lock = threading.Lock()
+        # (記録時刻, 失敗したか, 遅延したか)
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.transitions = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            transition = self._refresh()
+            state = self._state
+        self._notify(transition)
+        return state
+
+    def allow(self) -> bool:
+        """
+        呼び出してよいかを判定（半開状態では試行呼び出しの枠を確保する）
+        Trueの場合は呼び出し後にrecord_success・record_failure・releaseのいずれかを呼ぶ
+        """
+        with self._lock:
+            transition = self._refresh()
+            allowed = self._state == CLOSED
+            if self._state == HALF_OPEN and self._probes_in_flight + self._probe_successes < self.half_open_probes:
+                self._probes_in_flight += 1
+                allowed = True
+            if not allowed:
+                self.rejected += 1
+        self._notify(transition)
+        return allowed
+
+    def record_success(self, latency_seconds: float) -> None:
+        slow = latency_seconds >= self.slow_call_seconds
+        transition = None
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if slow:
+                    transition = self._transition(OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        transition = self._transition(CLOSED)
+            elif self._state == CLOSED:
+                transition = self._add_outcome(False, slow)
+        self._notify(transition)
+
+    def record_failure(self, latency_seconds: float) -> None:
+        transition = None
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                transition = self._transition(OPEN)
+            elif self._state == CLOSED:
+                transition = self._add_outcome(True, latency_seconds >= self.slow_call_seconds)
+        self._notify(transition)
+
+    def release(self) -> None:
+        """
+        結果を記録せずに試行呼び出しの枠を返す（呼び出し元が途中で処理をやめた場合など）
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def call(self, func: Callable[[], Any], is_failure: Callable[[Exception], bool] = lambda error: True) -> Any:
+        """
+        funcをサーキットブレーカーの下で実行（遮断中はCircuitOpenを送出）
+        is_failureがFalseを返す例外（利用者側の誤りなど）は依存先の失敗として数えない
+        """
+        if not self.allow():
+            raise CircuitOpen("Claude API circuit breaker is open")
+        start = time.monotonic()
+        try:
+            result = func()
+        except Exception as error:
+            if is_failure(error):
+                self.record_failure(time.monotonic() - start)
+            else:
+                self.release()
+            raise
+        self.record_success(time.monotonic() - start)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            transition = self._refresh()
+            self._prune(time.monotonic())
+            total = len(self._outcomes)
+            failures = sum(1 for _, failed, _ in self._outcomes if failed)
+            stats = {
+                'state': self._state,
+                'calls': total,
+                'error_rate': round(failures / total, 3) if total else 0.0,
+                'transitions': self.transitions,
+                'rejected': self.rejected
+            }
+        self._notify(transition)
+        return stats
+
+    def _refresh(self) -> Optional[Tuple[str, str]]:
+        # 開いてからopen_seconds経過していれば半開状態に移る
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            return self._transition(HALF_OPEN)
+        return None
+
+    def _add_outcome(self, failed: bool, slow: bool) -> Optional[Tuple[str, str]]:
+        now = time.monotonic()
+        self._outcomes.append((now, failed, slow))
+        self._prune(now)
+
+        total = len(self._outcomes)
+        if total < self.min_calls:
+            return None
+        failures = sum(1 for _, failed_call, _ in self._outcomes if failed_call)
+        slow_calls = sum(1 for _, _, slow_call in self._outcomes if slow_call)
+        if failures / total >= self.error_rate or slow_calls / total >= self.slow_call_rate:
+            return self._transition(OPEN)
+        return None
+
+    def _prune(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _transition(self, state: str) -> Tuple[str, str]:
+        previous, self._state = self._state, state
+        self.transitions += 1
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        return previous, state
+
+    def _notify(self, transition: Optional[Tuple[str, str]]) -> None:
+        if transition is not None and self.on_transition is not None:
+            self.on_transition(*transition)
+
+
+def create_circuit_breaker(on_transition: Optional[Callable[[str, str], None]] = None) -> CircuitBreaker:
+    """
+    環境変数の設定からサーキットブレーカーを作成
+    """
+    return CircuitBreaker(
+        window_seconds=float(os.environ.get('CIRCUIT_WINDOW_SECONDS', '30')),
+        min_calls=int(os.environ.get('CIRCUIT_MIN_CALLS', '10')),
+        error_rate=float(os.environ.get('CIRCUIT_ERROR_RATE', '0.5')),
+        slow_call_seconds=float(os.environ.get('CIRCUIT_SLOW_CALL_SECONDS', '10')),
+        slow_call_rate=float(os.environ.get('CIRCUIT_SLOW_CALL_RATE', '0.8')),
+        open_seconds=float(os.environ.get('CIRCUIT_OPEN_SECONDS', '15')),
+        half_open_probes=int(os.environ.get('CIRCUIT_HALF_OPEN_PROBES', '2')),
+        on_transition=on_transition
+    )
@@ -0,0 +1,228 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+class UserRateLimitExceeded(Exception):
+    """
+    ユーザーごとのリクエスト上限を超えた
+    """
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Claude API呼び出しの期限（リトライ・待機を含む）を超えた
+    """
+
+
+class DeadlineExceededBeforeCall(DeadlineExceeded):
+    """
+    Claude APIを呼び出す前に期限を超えた（同時実行枠の待機・残り時間の不足）
+    Claude API側の失敗ではないため、サーキットブレーカーや利用量のエラーには数えない
+    """
+
+
+class TokenBucket:
+    """
+    トークンバケット（rate: 1秒あたりの補充数、capacity: 最大バースト数）
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def anthropic_retry_after(error: Exception) -> Optional[float]:
+    """
+    リトライ可能なAnthropic SDKの例外であれば待機秒数（retry-afterがなければ0）を返す
+    リトライ不可の場合はNone
+    """
+    import anthropic
+
+    if isinstance(error, (anthropic.APIConnectionError, anthropic.APITimeoutError)):
+        return 0.0
+    if not isinstance(error, anthropic.APIStatusError):
+        return None
+    if error.status_code != 429 and error.status_code < 500:
+        return None
+
+    headers = error.response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return 0.0
+
+
+class ClaudeGovernor:
+    """
+    Claude API呼び出しの流量制御
+    全体の同時実行数の上限、ユーザーごとのトークンバケット、
+    retry-afterを考慮したジッター付き指数バックオフ、呼び出し全体の期限を管理する
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        user_rate_per_minute: float = 20,
+        user_burst: float = 5,
+        max_retries: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        deadline_seconds: float = 25.0,
+        retry_after: Callable[[Exception], Optional[float]] = anthropic_retry_after,
+        max_tracked_users: int = 10000
+    ) -> None:
+        self.user_rate = user_rate_per_minute / 60
+        self.user_burst = user_burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline_seconds = deadline_seconds
+        self.retry_after = retry_after
+        self.max_tracked_users = max_tracked_users
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.deadline_exceeded = 0
+
+    def call(self, func: Callable[[float], Any], user_id: Optional[str] = None,
+             deadline: Optional[float] = None) -> Any:
+        """
+        funcを流量制御の下で実行（funcには残り時間（秒）をタイムアウトとして渡す）
+        deadlineはtime.monotonic()基準の期限（省略時はdeadline_seconds後）
+        """
+        self.admit(user_id)
+        deadline = self._deadline(deadline)
+
+        with self._slot(deadline):
+            attempt = 0
+            while True:
+                try:
+                    return func(self._remaining(deadline, attempt == 0))
+                except Exception as error:
+                    attempt += 1
+                    self._backoff(error, attempt, deadline)
+
+    def stream(self, open_stream: Callable[[float], Iterator[Any]], user_id: Optional[str] = None,
+               deadline: Optional[float] = None) -> Iterator[Any]:
+        """
+        ストリーミング呼び出しを流量制御の下で実行
+        最初の要素を受け取る前の失敗のみリトライする
+        """
+        self.admit(user_id)
+        deadline = self._deadline(deadline)
+
+        with self._slot(deadline):
+            attempt = 0
+            while True:
+                started = False
+                try:
+                    for item in open_stream(self._remaining(deadline, attempt == 0)):
+                        started = True
+                        yield item
+                    return
+                except Exception as error:
+                    if started:
+                        raise
+                    attempt += 1
+                    self._backoff(error, attempt, deadline)
+
+    def admit(self, user_id: Optional[str]) -> None:
+        """
+        ユーザーごとのトークンバケットを確認し、上限を超えていればUserRateLimitExceededを送出
+        """
+        if not user_id or self.user_rate <= 0:
+            return
+
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate, self.user_burst)
+                self._buckets[user_id] = bucket
+                while len(self._buckets) > self.max_tracked_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user_id)
+
+            if not bucket.take():
+                self.throttled += 1
+                raise UserRateLimitExceeded(f"User rate limit exceeded: {user_id}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'deadline_exceeded': self.deadline_exceeded
+            }
+
+    def _deadline(self, deadline: Optional[float]) -> float:
+        own = time.monotonic() + self.deadline_seconds
+        return min(own, deadline) if deadline is not None else own
+
+    def _remaining(self, deadline: float, before_call: bool) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._count_deadline_exceeded()
+            if before_call:
+                raise DeadlineExceededBeforeCall("Claude API deadline exceeded before the first attempt")
+            raise DeadlineExceeded("Claude API deadline exceeded")
+        return remaining
+
+    @contextmanager
+    def _slot(self, deadline: float) -> Iterator[None]:
+        if not self._semaphore.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            self._count_deadline_exceeded()
+            raise DeadlineExceededBeforeCall("Timed out waiting for a Claude API slot")
+        with self._lock:
+            self.calls += 1
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    def _backoff(self, error: Exception, attempt: int, deadline: float) -> None:
+        # リトライできない場合は元の例外をそのまま送出する
+        if isinstance(error, DeadlineExceeded):
+            raise error
+        retry_after = self.retry_after(error)
+        if retry_after is None or attempt > self.max_retries:
+            raise error
+
+        delay = max(retry_after, random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))))
+        if time.monotonic() + delay >= deadline:
+            self._count_deadline_exceeded()
+            raise error
+
+        with self._lock:
+            self.retries += 1
+        time.sleep(delay)
+
+    def _count_deadline_exceeded(self) -> None:
+        with self._lock:
+            self.deadline_exceeded += 1
@@ -0,0 +1,304 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+# Turnオブジェクト1件あたりの概算オーバーヘッド（バイト）
+TURN_OVERHEAD_BYTES = 120
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算（ASCIIは約4文字で1トークン、それ以外は1文字1トークン）
+    """
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+class Turn:
+    """
+    会話履歴の1発言
+    """
+
+    __slots__ = ('role', 'content', 'tokens', 'created_at')
+
+    def __init__(self, role: str, content: str, created_at: Optional[float] = None) -> None:
+        self.role = role
+        self.content = content
+        self.tokens = estimate_tokens(content)
+        self.created_at = created_at if created_at is not None else time.time()
+
+    def size(self) -> int:
+        return len(self.content.encode('utf-8')) + TURN_OVERHEAD_BYTES
+
+
+class ConversationBackend:
+    """
+    会話履歴の永続化バックエンドの基底クラス
+    """
+
+    def load(self, user_id: str, limit: int) -> List[Turn]:
+        raise NotImplementedError
+
+    def save_batch(self, items: List[Tuple[str, Turn]]) -> None:
+        raise NotImplementedError
+
+    def delete(self, user_id: str) -> None:
+        raise NotImplementedError
+
+
+class SQLiteConversationBackend(ConversationBackend):
+    """
+    SQLiteを使った会話履歴の永続化（ローカル実行用）
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_turns ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+                "role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_conversation_turns_user "
+                "ON conversation_turns (user_id, id)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def load(self, user_id: str, limit: int) -> List[Turn]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content, created_at FROM conversation_turns "
+                "WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+        return [Turn(role, content, created_at) for role, content, created_at in reversed(rows)]
+
+    def save_batch(self, items: List[Tuple[str, Turn]]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO conversation_turns (user_id, role, content, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(user_id, turn.role, turn.content, turn.created_at) for user_id, turn in items]
+            )
+
+    def delete(self, user_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM conversation_turns WHERE user_id = ?", (user_id,))
+
+
+class ConversationStore:
+    """
+    ユーザーごとの会話履歴ストア
+    メモリ上はLRU + TTLで保持し（ウォームLambdaの呼び出し間で維持）、
+    永続化バックエンドがあれば書き込みをまとめて反映する
+    バックエンドがある場合はrefresh_secondsごとに読み直し、他のコンテナの書き込みを取り込む
+    """
+
+    def __init__(
+        self,
+        backend: Optional[ConversationBackend] = None,
+        ttl_seconds: float = 1800,
+        max_users: int = 1000,
+        max_bytes: int = 8 * 1024 * 1024,
+        max_turns: int = 20,
+        flush_batch_size: int = 20,
+        refresh_seconds: float = 0
+    ) -> None:
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.flush_batch_size = flush_batch_size
+        self.refresh_seconds = refresh_seconds
+
+        self._conversations: "OrderedDict[str, List[Turn]]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._bytes = 0
+        self._pending: List[Tuple[str, Turn]] = []
+        self._saving: List[Tuple[str, Turn]] = []
+        self._lock = threading.RLock()
+
+    def history(self, user_id: str, token_budget: int) -> List[Dict[str, str]]:
+        """
+        トークン予算に収まる直近の履歴をClaude APIのmessages形式で返す
+        """
+        with self._lock:
+            turns = self._get_turns(user_id)
+
+            selected = []
+            used = 0
+            for turn in reversed(turns):
+                if used + turn.tokens > token_budget:
+                    break
+                selected.append(turn)
+                used += turn.tokens
+            selected.reverse()
+
+            # messagesはuserの発言から始める必要がある
+            while selected and selected[0].role != 'user':
+                selected.pop(0)
+
+            return [{'role': turn.role, 'content': turn.content} for turn in selected]
+
+    def append(self, user_id: str, role: str, content: str) -> None:
+        """
+        発言を履歴に追加（永続化はflush時にまとめて行う）
+        """
+        turn = Turn(role, content)
+        with self._lock:
+            turns = self._get_turns(user_id)
+            turns.append(turn)
+            self._bytes += turn.size()
+
+            while len(turns) > self.max_turns:
+                self._bytes -= turns.pop(0).size()
+
+            if self.backend is not None:
+                self._pending.append((user_id, turn))
+                if len(self._pending) >= self.flush_batch_size:
+                    self.flush()
+
+            self._evict()
+
+    def clear(self, user_id: str) -> None:
+        """
+        メモリ上の履歴を削除
+        """
+        with self._lock:
+            self._drop(user_id)
+
+    def forget(self, user_id: str) -> None:
+        """
+        メモリ上・未反映・永続化バックエンドのすべての履歴を削除（リセットコマンド・ブロック時）
+        """
+        with self._lock:
+            self._drop(user_id)
+            self._pending = [(pending_user, turn) for pending_user, turn in self._pending if pending_user != user_id]
+            self._saving = [(saving_user, turn) for saving_user, turn in self._saving if saving_user != user_id]
+        if self.backend is not None:
+            self.backend.delete(user_id)
+
+    def flush(self) -> None:
+        """
+        未反映の発言を永続化バックエンドにまとめて書き込む
+        書き込みに失敗した発言は未反映に戻し、次回のflushで再度書き込む
+        """
+        with self._lock:
+            if self.backend is None or not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            self._saving = self._saving + pending
+        try:
+            self.backend.save_batch(pending)
+        except Exception:
+            with self._lock:
+                # 再試行待ちが無制限に増えないよう、保持できる発言数を上限にする
+                limit = self.max_users * self.max_turns
+                self._pending = (pending + self._pending)[-limit:]
+            raise
+        finally:
+            with self._lock:
+                saved = {id(turn) for _, turn in pending}
+                self._saving = [item for item in self._saving if id(item[1]) not in saved]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'users': len(self._conversations),
+                'bytes': self._bytes,
+                'pending': len(self._pending)
+            }
+
+    def _get_turns(self, user_id: str) -> List[Turn]:
+        now = time.time()
+        turns = self._conversations.get(user_id)
+
+        if turns is not None and now - self._last_access[user_id] > self.ttl_seconds:
+            self._drop(user_id)
+            turns = None
+
+        if self.backend is not None and (
+            turns is None or now - self._loaded_at.get(user_id, 0) >= self.refresh_seconds
+        ):
+            turns = self._reload(user_id, turns, now)
+        elif turns is None:
+            turns = []
+            self._conversations[user_id] = turns
+        else:
+            self._conversations.move_to_end(user_id)
+
+        self._last_access[user_id] = now
+        return turns
+
+    def _reload(self, user_id: str, cached: Optional[List[Turn]], now: float) -> List[Turn]:
+        # 永続化済みの発言に、このコンテナで未反映の発言を重ねて最新の履歴を組み立てる
+        try:
+            stored = self.backend.load(user_id, self.max_turns)
+        except Exception as e:
+            logger.error(f"会話履歴の読み込み中にエラーが発生: {str(e)}")
+            if cached is not None:
+                self._conversations.move_to_end(user_id)
+                return cached
+            stored = []
+
+        seen = {(turn.role, turn.content, turn.created_at) for turn in stored}
+        for pending_user, turn in self._saving + self._pending:
+            key = (turn.role, turn.content, turn.created_at)
+            if pending_user == user_id and key not in seen:
+                stored.append(turn)
+                seen.add(key)
+        stored.sort(key=lambda turn: turn.created_at)
+
+        turns = [turn for turn in stored if now - turn.created_at <= self.ttl_seconds][-self.max_turns:]
+        self._drop(user_id)
+        self._conversations[user_id] = turns
+        self._bytes += sum(turn.size() for turn in turns)
+        self._loaded_at[user_id] = now
+        return turns
+
+    def _drop(self, user_id: str) -> None:
+        turns = self._conversations.pop(user_id, None)
+        self._last_access.pop(user_id, None)
+        self._loaded_at.pop(user_id, None)
+        if turns:
+            self._bytes -= sum(turn.size() for turn in turns)
+
+    def _evict(self) -> None:
+        # 件数上限とメモリ上限を超えた分を古い順に破棄する
+        while self._conversations and (
+            len(self._conversations) > self.max_users or self._bytes > self.max_bytes
+        ):
+            user_id = next(iter(self._conversations))
+            self._drop(user_id)
+
+
+def create_conversation_store() -> ConversationStore:
+    """
+    環境変数の設定から会話履歴ストアを作成
+    """
+    backend = None
+    if os.environ.get('CONVERSATION_BACKEND', 'none') == 'sqlite':
+        backend = SQLiteConversationBackend(
+            os.environ.get('CONVERSATION_SQLITE_PATH', 'conversations.db')
+        )
+
+    return ConversationStore(
+        backend=backend,
+        ttl_seconds=float(os.environ.get('CONVERSATION_TTL_SECONDS', '1800')),
+        max_users=int(os.environ.get('CONVERSATION_MAX_USERS', '1000')),
+        max_bytes=int(os.environ.get('CONVERSATION_MAX_BYTES', str(8 * 1024 * 1024))),
+        max_turns=int(os.environ.get('CONVERSATION_MAX_TURNS', '20')),
+        flush_batch_size=int(os.environ.get('CONVERSATION_FLUSH_BATCH_SIZE', '20')),
+        refresh_seconds=float(os.environ.get('CONVERSATION_REFRESH_SECONDS', '0'))
+    )
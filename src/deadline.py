@@ -0,0 +1,62 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+# 現在の処理の期限（time.monotonic()基準、Noneは期限なし）
+_deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+
+
+def earliest(*deadlines: Optional[float]) -> Optional[float]:
+    """
+    Noneを除いた最も早い期限を返す（すべてNoneの場合はNone）
+    """
+    values = [deadline for deadline in deadlines if deadline is not None]
+    return min(values) if values else None
+
+
+def current_deadline() -> Optional[float]:
+    """
+    現在の処理の期限を返す
+    """
+    return _deadline.get()
+
+
+def remaining(deadline: Optional[float] = None) -> Optional[float]:
+    """
+    期限（省略時は現在の処理の期限）までの残り秒数を返す（期限がない場合はNone）
+    """
+    deadline = deadline if deadline is not None else _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[float]) -> Iterator[Optional[float]]:
+    """
+    with文の中の期限を設定（外側の期限より遅くはならない）
+    """
+    effective = earliest(_deadline.get(), deadline)
+    token = _deadline.set(effective)
+    try:
+        yield effective
+    finally:
+        _deadline.reset(token)
+
+
+def lambda_deadline(context: Any, safety_margin_seconds: float = 0.5) -> Optional[float]:
+    """
+    Lambdaのcontextの残り実行時間から期限を計算（ローカル実行などでcontextがない場合はNone）
+    """
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining is None:
+        return None
+    return time.monotonic() + get_remaining() / 1000 - safety_margin_seconds
+
+
+def wall_clock_deadline(epoch_seconds: float) -> float:
+    """
+    UNIX時刻の期限をtime.monotonic()基準に変換
+    """
+    return time.monotonic() + (epoch_seconds - time.time())
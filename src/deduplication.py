@@ -0,0 +1,167 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger()
+
+
+class SharedDedupStore:
+    """
+    複数コンテナで共有する処理済みイベントIDストアの基底クラス
+    """
+
+    def claim(self, event_id: str, ttl_seconds: float) -> bool:
+        """
+        イベントIDを登録し、未登録だった場合のみTrueを返す
+        """
+        raise NotImplementedError
+
+
+class SQLiteDedupStore(SharedDedupStore):
+    """
+    SQLiteを使った処理済みイベントIDストア（ローカル実行用）
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed_events ("
+                "event_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def claim(self, event_id: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM processed_events WHERE event_id = ? AND expires_at <= ?", (event_id, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO processed_events (event_id, expires_at) VALUES (?, ?)",
+                (event_id, now + ttl_seconds)
+            )
+            return cursor.rowcount == 1
+
+
+class DynamoDBDedupStore(SharedDedupStore):
+    """
+    DynamoDBの条件付き書き込みを使った処理済みイベントIDストア（Lambda本番用）
+    テーブルはパーティションキーevent_id（文字列）、TTL属性expires_atを想定
+    """
+
+    def __init__(self, table_name: str) -> None:
+        import boto3
+
+        self._table_name = table_name
+        self._client = boto3.client('dynamodb')
+
+    def claim(self, event_id: str, ttl_seconds: float) -> bool:
+        now = int(time.time())
+        try:
+            self._client.put_item(
+                TableName=self._table_name,
+                Item={
+                    'event_id': {'S': event_id},
+                    'expires_at': {'N': str(now + int(ttl_seconds))}
+                },
+                ConditionExpression='attribute_not_exists(event_id) OR expires_at < :now',
+                ExpressionAttributeValues={':now': {'N': str(now)}}
+            )
+            return True
+        except self._client.exceptions.ConditionalCheckFailedException:
+            return False
+
+
+class EventDeduplicator:
+    """
+    webhookEventIdによる重複イベントの検出
+    メモリ上のTTL付き集合（ウォームコンテナ内）と任意の共有ストアの2段構成
+    """
+
+    def __init__(
+        self,
+        shared: Optional[SharedDedupStore] = None,
+        ttl_seconds: float = 3600,
+        max_entries: int = 10000
+    ) -> None:
+        self.shared = shared
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.duplicates = 0
+        self.redeliveries = 0
+        self.store_errors = 0
+
+    def claim(self, event_id: str, is_redelivery: bool = False) -> bool:
+        """
+        イベントを処理対象として登録し、初めてのイベントであればTrueを返す
+        共有ストアの障害時は未処理として扱い（重複よりも取りこぼしを避ける）、webhook全体を失敗させない
+        """
+        now = time.time()
+
+        with self._lock:
+            if is_redelivery:
+                self.redeliveries += 1
+
+            expires_at = self._seen.get(event_id)
+            if expires_at is not None and expires_at > now:
+                self.duplicates += 1
+                return False
+
+            self._seen[event_id] = now + self.ttl_seconds
+            self._seen.move_to_end(event_id)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+
+        if self.shared is not None:
+            try:
+                claimed = self.shared.claim(event_id, self.ttl_seconds)
+            except Exception as e:
+                logger.error(f"共有ストアでの重複確認中にエラーが発生したため未処理として扱います: {event_id} {str(e)}")
+                with self._lock:
+                    self.store_errors += 1
+                claimed = True
+            # 初回配信（isRedelivery=false）は他コンテナで処理済みでないため、登録結果にかかわらず処理する
+            if not claimed and is_redelivery:
+                with self._lock:
+                    self.duplicates += 1
+                return False
+
+        with self._lock:
+            self.processed += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'processed': self.processed,
+                'duplicates': self.duplicates,
+                'redeliveries': self.redeliveries,
+                'store_errors': self.store_errors
+            }
+
+
+def create_event_deduplicator() -> EventDeduplicator:
+    """
+    環境変数の設定から重複イベント検出器を作成
+    """
+    shared = None
+    backend = os.environ.get('EVENT_DEDUP_BACKEND', 'none')
+    if backend == 'sqlite':
+        shared = SQLiteDedupStore(os.environ.get('EVENT_DEDUP_SQLITE_PATH', 'processed_events.db'))
+    elif backend == 'dynamodb':
+        shared = DynamoDBDedupStore(os.environ['EVENT_DEDUP_DYNAMODB_TABLE'])
+
+    return EventDeduplicator(
+        shared=shared,
+        ttl_seconds=float(os.environ.get('EVENT_DEDUP_TTL_SECONDS', '3600')),
+        max_entries=int(os.environ.get('EVENT_DEDUP_MAX_ENTRIES', '10000'))
+    )
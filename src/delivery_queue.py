@@ -0,0 +1,444 @@
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+# プッシュ送信の結果（送信済み・再送キューに保存・dead letterに保存）
+DELIVERY_SENT = 'sent'
+DELIVERY_QUEUED = 'queued'
+DELIVERY_DEAD_LETTERED = 'dead_lettered'
+
+
+class RawMessage:
+    """
+    キューに保存したメッセージのJSONを、LineBotApiに送信メッセージとして渡すためのラッパー
+    """
+
+    __slots__ = ('data',)
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
+
+    def as_json_dict(self) -> Dict[str, Any]:
+        return self.data
+
+
+def line_error_status(error: Exception) -> Optional[int]:
+    """
+    LINE APIのエラーのステータスコード（LineBotApiError以外はNone）
+    """
+    from linebot.exceptions import LineBotApiError
+
+    return error.status_code if isinstance(error, LineBotApiError) else None
+
+
+def is_invalid_reply_token(error: Exception) -> bool:
+    """
+    返信トークンの期限切れ・使用済みによる返信APIの失敗かどうか
+    """
+    if line_error_status(error) != 400:
+        return False
+    message = getattr(getattr(error, 'error', None), 'message', '') or ''
+    return 'reply token' in message.lower()
+
+
+def is_retryable_line_error(error: Exception) -> bool:
+    """
+    時間をおいて再送すれば成功しうる失敗（429・5xx・タイムアウト・接続エラー）かどうか
+    """
+    import httpx
+
+    status = line_error_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+class PendingDelivery:
+    """
+    再送キューから取り出した1件のメッセージ
+    """
+
+    __slots__ = ('id', 'recipient', 'messages', 'retry_key', 'channel', 'attempts', 'created_at', 'claimed_until')
+
+    def __init__(self, id: Any, recipient: str, messages: List[Dict[str, Any]], retry_key: str,
+                 channel: Optional[str], attempts: int, created_at: float, claimed_until: float = 0.0) -> None:
+        self.id = id
+        self.recipient = recipient
+        self.messages = messages
+        self.retry_key = retry_key
+        self.channel = channel
+        self.attempts = attempts
+        self.created_at = created_at
+        self.claimed_until = claimed_until
+
+
+class BaseDeliveryQueue:
+    """
+    送信に失敗したプッシュメッセージを保存し、指数バックオフで再送するキューの基底クラス
+    max_attempts回失敗したもの・再送しても成功しない失敗はdead letterに移す
+    channelには送信元のチャネル（destination、デフォルトのチャネルはNone）を保存し、再送時にsendに渡す
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 2.0, max_delay: float = 300.0) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def enqueue(self, recipient: str, messages: List[Dict[str, Any]], retry_key: str, error: str,
+                attempts: int = 1, channel: Optional[str] = None) -> None:
+        """
+        送信に失敗したメッセージを保存（attempts回目の失敗としてバックオフ後に再送する）
+        """
+        raise NotImplementedError
+
+    def dead_letter(self, recipient: str, messages: List[Dict[str, Any]], retry_key: str, error: str,
+                    attempts: int = 1, channel: Optional[str] = None) -> None:
+        """
+        再送しないメッセージをdead letterとして保存
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def _claim_due(self, now: float, limit: int) -> List[PendingDelivery]:
+        """
+        再送時刻を過ぎたメッセージを最大limit件、他のスレッド・プロセスと重複しないよう取得する
+        取得したメッセージは送信中に再送されないよう、再送時刻をmax_delay秒先送りしておく
+        """
+        raise NotImplementedError
+
+    def _release(self, deliveries: List[PendingDelivery], next_attempt_at: float) -> None:
+        raise NotImplementedError
+
+    def _reschedule(self, delivery: PendingDelivery, attempts: int, next_attempt_at: float, error: str) -> None:
+        raise NotImplementedError
+
+    def _move_to_dead_letters(self, delivery: PendingDelivery, attempts: int, error: str) -> None:
+        raise NotImplementedError
+
+    def _delete(self, delivery: PendingDelivery) -> None:
+        raise NotImplementedError
+
+    def retry_due(self, send: Callable[[str, List[RawMessage], str, Optional[str]], None],
+                  is_retryable: Callable[[Exception], bool], limit: int = 10,
+                  expired: Optional[Callable[[], bool]] = None) -> Dict[str, int]:
+        """
+        再送時刻を過ぎたメッセージを最大limit件送信し、結果ごとの件数を返す
+        expiredがTrueを返した時点で送信をやめ、残りは次回の再送に回す
+        """
+        now = time.time()
+        deliveries = self._claim_due(now, limit)
+
+        result = {'delivered': 0, 'retrying': 0, 'dead_lettered': 0, 'deferred': 0}
+        for index, delivery in enumerate(deliveries):
+            if expired is not None and expired():
+                self._release(deliveries[index:], now)
+                result['deferred'] = len(deliveries) - index
+                break
+            try:
+                send(delivery.recipient, [RawMessage(message) for message in delivery.messages],
+                     delivery.retry_key, delivery.channel)
+            except Exception as e:
+                attempts = delivery.attempts + 1
+                if is_retryable(e) and attempts < self.max_attempts:
+                    self._reschedule(delivery, attempts, time.time() + self._backoff(attempts), str(e))
+                    result['retrying'] += 1
+                else:
+                    self._move_to_dead_letters(delivery, attempts, str(e))
+                    result['dead_lettered'] += 1
+                continue
+
+            self._delete(delivery)
+            result['delivered'] += 1
+        return result
+
+    def _backoff(self, attempts: int) -> float:
+        # ジッター付き指数バックオフ（attempts回目の失敗後の待機秒数）
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+
+class DeliveryQueue(BaseDeliveryQueue):
+    """
+    SQLiteの再送キュー（ローカル実行・同じコンテナ内での再送用）
+    再送待ちはpending_deliveries、再送しないものはdead_lettersテーブルに保存する
+    """
+
+    def __init__(self, path: str, max_attempts: int = 5, base_delay: float = 2.0, max_delay: float = 300.0) -> None:
+        super().__init__(max_attempts, base_delay, max_delay)
+        self._path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_deliveries ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, recipient TEXT NOT NULL, messages TEXT NOT NULL, "
+                "retry_key TEXT NOT NULL, channel TEXT, attempts INTEGER NOT NULL, next_attempt_at REAL NOT NULL, "
+                "created_at REAL NOT NULL, last_error TEXT)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_pending_deliveries_next ON pending_deliveries (next_attempt_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, recipient TEXT NOT NULL, messages TEXT NOT NULL, "
+                "retry_key TEXT NOT NULL, channel TEXT, attempts INTEGER NOT NULL, created_at REAL NOT NULL, "
+                "failed_at REAL NOT NULL, last_error TEXT)"
+            )
+            for table in ('pending_deliveries', 'dead_letters'):
+                columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if 'channel' not in columns:
+                    # channel列の追加前に作成されたファイル（Lambdaの/tmpやローカル実行で残っている場合）
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN channel TEXT")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def enqueue(self, recipient: str, messages: List[Dict[str, Any]], retry_key: str, error: str,
+                attempts: int = 1, channel: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO pending_deliveries "
+                "(recipient, messages, retry_key, channel, attempts, next_attempt_at, created_at, last_error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (recipient, json.dumps(messages, ensure_ascii=False), retry_key, channel, attempts,
+                 now + self._backoff(attempts), now, error)
+            )
+
+    def dead_letter(self, recipient: str, messages: List[Dict[str, Any]], retry_key: str, error: str,
+                    attempts: int = 1, channel: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO dead_letters "
+                "(recipient, messages, retry_key, channel, attempts, created_at, failed_at, last_error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (recipient, json.dumps(messages, ensure_ascii=False), retry_key, channel, attempts, now, now, error)
+            )
+
+    def _claim_due(self, now: float, limit: int) -> List[PendingDelivery]:
+        with self._lock, self._connect() as conn:
+            # BEGIN IMMEDIATEで書き込みロックを取ってから読み、他のプロセスが同じ行を同時に取得しないようにする
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, recipient, messages, retry_key, channel, attempts, created_at FROM pending_deliveries "
+                "WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE pending_deliveries SET next_attempt_at = ? WHERE id = ?",
+                [(now + self.max_delay, row[0]) for row in rows]
+            )
+        return [
+            PendingDelivery(row_id, recipient, json.loads(messages), retry_key, channel, attempts, created_at)
+            for row_id, recipient, messages, retry_key, channel, attempts, created_at in rows
+        ]
+
+    def _release(self, deliveries: List[PendingDelivery], next_attempt_at: float) -> None:
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "UPDATE pending_deliveries SET next_attempt_at = ? WHERE id = ?",
+                [(next_attempt_at, delivery.id) for delivery in deliveries]
+            )
+
+    def _reschedule(self, delivery: PendingDelivery, attempts: int, next_attempt_at: float, error: str) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE pending_deliveries SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, next_attempt_at, error, delivery.id)
+            )
+
+    def _move_to_dead_letters(self, delivery: PendingDelivery, attempts: int, error: str) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO dead_letters "
+                "(recipient, messages, retry_key, channel, attempts, created_at, failed_at, last_error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (delivery.recipient, json.dumps(delivery.messages, ensure_ascii=False), delivery.retry_key,
+                 delivery.channel, attempts, delivery.created_at, time.time(), error)
+            )
+            conn.execute("DELETE FROM pending_deliveries WHERE id = ?", (delivery.id,))
+
+    def _delete(self, delivery: PendingDelivery) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM pending_deliveries WHERE id = ?", (delivery.id,))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock, self._connect() as conn:
+            pending = conn.execute("SELECT COUNT(*) FROM pending_deliveries").fetchone()[0]
+            dead_letters = conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        return {'pending': pending, 'dead_letters': dead_letters}
+
+
+class DynamoDBDeliveryQueue(BaseDeliveryQueue):
+    """
+    DynamoDBの再送キュー（Lambda本番用、どのコンテナからでも再送できる）
+    テーブルはパーティションキーid（文字列）を想定し、再送待ちはstatus=pending、dead letterはstatus=deadで保存する
+    再送するメッセージは条件付き更新で取得し、同じメッセージを複数のコンテナが同時に再送しないようにする
+    """
+
+    def __init__(self, table_name: str, max_attempts: int = 5, base_delay: float = 2.0,
+                 max_delay: float = 300.0) -> None:
+        import boto3
+
+        super().__init__(max_attempts, base_delay, max_delay)
+        self._table_name = table_name
+        self._client = boto3.client('dynamodb')
+
+    def enqueue(self, recipient: str, messages: List[Dict[str, Any]], retry_key: str, error: str,
+                attempts: int = 1, channel: Optional[str] = None) -> None:
+        now = time.time()
+        self._put('pending', recipient, messages, retry_key, error, attempts, channel, now,
+                  {'next_attempt_at': {'N': repr(now + self._backoff(attempts))}})
+
+    def dead_letter(self, recipient: str, messages: List[Dict[str, Any]], retry_key: str, error: str,
+                    attempts: int = 1, channel: Optional[str] = None) -> None:
+        now = time.time()
+        self._put('dead', recipient, messages, retry_key, error, attempts, channel, now,
+                  {'failed_at': {'N': repr(now)}})
+
+    def _put(self, status: str, recipient: str, messages: List[Dict[str, Any]], retry_key: str, error: str,
+             attempts: int, channel: Optional[str], created_at: float, extra: Dict[str, Any]) -> None:
+        item = {
+            'id': {'S': str(uuid.uuid4())},
+            'status': {'S': status},
+            'recipient': {'S': recipient},
+            'messages': {'S': json.dumps(messages, ensure_ascii=False)},
+            'retry_key': {'S': retry_key},
+            'attempts': {'N': str(attempts)},
+            'created_at': {'N': repr(created_at)},
+            'last_error': {'S': error}
+        }
+        if channel:
+            item['channel'] = {'S': channel}
+        item.update(extra)
+        self._client.put_item(TableName=self._table_name, Item=item)
+
+    def _claim_due(self, now: float, limit: int) -> List[PendingDelivery]:
+        claimed: List[PendingDelivery] = []
+        claimed_until = now + self.max_delay
+        kwargs = {
+            'TableName': self._table_name,
+            'FilterExpression': '#status = :pending AND next_attempt_at <= :now',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {':pending': {'S': 'pending'}, ':now': {'N': repr(now)}}
+        }
+        while len(claimed) < limit:
+            page = self._client.scan(**kwargs)
+            for item in page.get('Items', []):
+                if len(claimed) >= limit:
+                    break
+                try:
+                    # 読んだ時点の再送時刻のままの場合だけ先送りし、他のコンテナが取得済みの行は飛ばす
+                    self._client.update_item(
+                        TableName=self._table_name,
+                        Key={'id': item['id']},
+                        UpdateExpression='SET next_attempt_at = :until',
+                        ConditionExpression='#status = :pending AND next_attempt_at = :seen',
+                        ExpressionAttributeNames={'#status': 'status'},
+                        ExpressionAttributeValues={
+                            ':until': {'N': repr(claimed_until)},
+                            ':pending': {'S': 'pending'},
+                            ':seen': item['next_attempt_at']
+                        }
+                    )
+                except self._client.exceptions.ConditionalCheckFailedException:
+                    continue
+                claimed.append(PendingDelivery(
+                    item['id']['S'],
+                    item['recipient']['S'],
+                    json.loads(item['messages']['S']),
+                    item['retry_key']['S'],
+                    item['channel']['S'] if 'channel' in item else None,
+                    int(item['attempts']['N']),
+                    float(item['created_at']['N']),
+                    claimed_until
+                ))
+            if 'LastEvaluatedKey' not in page:
+                break
+            kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+        return claimed
+
+    def _update_claimed(self, delivery: PendingDelivery, expression: str, values: Dict[str, Any]) -> None:
+        # 取得後に他のコンテナが先送りの期限切れで取り直していない場合だけ更新する
+        kwargs = {
+            'TableName': self._table_name,
+            'Key': {'id': {'S': delivery.id}},
+            'UpdateExpression': expression,
+            'ConditionExpression': 'next_attempt_at = :claimed',
+            'ExpressionAttributeValues': dict(values, **{':claimed': {'N': repr(delivery.claimed_until)}})
+        }
+        if '#status' in expression:
+            kwargs['ExpressionAttributeNames'] = {'#status': 'status'}
+        try:
+            self._client.update_item(**kwargs)
+        except self._client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def _release(self, deliveries: List[PendingDelivery], next_attempt_at: float) -> None:
+        for delivery in deliveries:
+            self._update_claimed(delivery, 'SET next_attempt_at = :next', {':next': {'N': repr(next_attempt_at)}})
+
+    def _reschedule(self, delivery: PendingDelivery, attempts: int, next_attempt_at: float, error: str) -> None:
+        self._update_claimed(delivery, 'SET attempts = :attempts, next_attempt_at = :next, last_error = :error', {
+            ':attempts': {'N': str(attempts)},
+            ':next': {'N': repr(next_attempt_at)},
+            ':error': {'S': error}
+        })
+
+    def _move_to_dead_letters(self, delivery: PendingDelivery, attempts: int, error: str) -> None:
+        self._update_claimed(
+            delivery,
+            'SET #status = :dead, attempts = :attempts, failed_at = :now, last_error = :error REMOVE next_attempt_at',
+            {
+                ':dead': {'S': 'dead'},
+                ':attempts': {'N': str(attempts)},
+                ':now': {'N': repr(time.time())},
+                ':error': {'S': error}
+            }
+        )
+
+    def _delete(self, delivery: PendingDelivery) -> None:
+        self._client.delete_item(TableName=self._table_name, Key={'id': {'S': delivery.id}})
+
+    def stats(self) -> Dict[str, int]:
+        counts = {'pending': 0, 'dead_letters': 0}
+        kwargs = {
+            'TableName': self._table_name,
+            'ProjectionExpression': '#status',
+            'ExpressionAttributeNames': {'#status': 'status'}
+        }
+        while True:
+            page = self._client.scan(**kwargs)
+            for item in page.get('Items', []):
+                counts['pending' if item['status']['S'] == 'pending' else 'dead_letters'] += 1
+            if 'LastEvaluatedKey' not in page:
+                return counts
+            kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def create_delivery_queue() -> BaseDeliveryQueue:
+    """
+    環境変数の設定から再送キューを作成
+    sqlite（デフォルト）は一時ディレクトリ（Lambdaでは/tmp）のファイルで、書き込んだプロセス・コンテナからのみ再送できる
+    """
+    if os.environ.get('DELIVERY_QUEUE_BACKEND', 'sqlite') == 'dynamodb':
+        return DynamoDBDeliveryQueue(
+            os.environ['DELIVERY_QUEUE_DYNAMODB_TABLE'],
+            max_attempts=int(os.environ.get('DELIVERY_MAX_ATTEMPTS', '5')),
+            base_delay=float(os.environ.get('DELIVERY_RETRY_BASE_DELAY', '2')),
+            max_delay=float(os.environ.get('DELIVERY_RETRY_MAX_DELAY', '300'))
+        )
+    return DeliveryQueue(
+        os.environ.get('DELIVERY_QUEUE_SQLITE_PATH') or os.path.join(tempfile.gettempdir(), 'line_delivery_queue.db'),
+        max_attempts=int(os.environ.get('DELIVERY_MAX_ATTEMPTS', '5')),
+        base_delay=float(os.environ.get('DELIVERY_RETRY_BASE_DELAY', '2')),
+        max_delay=float(os.environ.get('DELIVERY_RETRY_MAX_DELAY', '300'))
+    )
@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, List, Optional
+
+# SQSのsend_message_batchで失敗したエントリを再送する回数
+SQS_SEND_ATTEMPTS = 3
+
+
+class QueuedRecord:
+    """
+    キューから取り出したレコード（receiptは処理完了の通知に使う）
+    """
+
+    __slots__ = ('body', 'receipt')
+
+    def __init__(self, body: str, receipt: Any = None) -> None:
+        self.body = body
+        self.receipt = receipt
+
+
+class EventQueue:
+    """
+    webhookイベントを受付ステージからワーカーステージへ受け渡すキューの基底クラス
+    取り出したレコードは処理に成功した後でackし、ackしなかったレコードは再び取り出される
+    """
+
+    def enqueue(self, records: List[str]) -> None:
+        raise NotImplementedError
+
+    def dequeue(self, max_records: int = 10) -> List[QueuedRecord]:
+        raise NotImplementedError
+
+    def ack(self, records: List[QueuedRecord]) -> None:
+        raise NotImplementedError
+
+
+class InMemoryEventQueue(EventQueue):
+    """
+    プロセス内キュー（ローカル実行用、取り出したレコードはプロセス内にのみ存在するためackは不要）
+    """
+
+    def __init__(self) -> None:
+        self._records = deque()
+        self._lock = threading.Lock()
+
+    def enqueue(self, records: List[str]) -> None:
+        with self._lock:
+            self._records.extend(records)
+
+    def dequeue(self, max_records: int = 10) -> List[QueuedRecord]:
+        with self._lock:
+            count = min(max_records, len(self._records))
+            return [QueuedRecord(self._records.popleft()) for _ in range(count)]
+
+    def ack(self, records: List[QueuedRecord]) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+class SQLiteEventQueue(EventQueue):
+    """
+    SQLiteファイルを使ったキュー（複数プロセスで共有するローカル実行用）
+    取り出したレコードはvisibility_timeout秒間ほかのワーカーから見えなくなり、ackされなければ再び取り出される
+    """
+
+    def __init__(self, path: str, visibility_timeout: float = 300) -> None:
+        self._path = path
+        self.visibility_timeout = visibility_timeout
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS event_queue ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, record TEXT NOT NULL, "
+                "visible_at REAL NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(event_queue)")]
+            if 'visible_at' not in columns:
+                conn.execute("ALTER TABLE event_queue ADD COLUMN visible_at REAL NOT NULL DEFAULT 0")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30, isolation_level=None)
+
+    def enqueue(self, records: List[str]) -> None:
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO event_queue (record) VALUES (?)",
+                [(record,) for record in records]
+            )
+
+    def dequeue(self, max_records: int = 10) -> List[QueuedRecord]:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute(
+                    "SELECT id, record FROM event_queue WHERE visible_at <= ? ORDER BY id LIMIT ?",
+                    (now, max_records)
+                ).fetchall()
+                if rows:
+                    conn.execute(
+                        f"UPDATE event_queue SET visible_at = ? WHERE id IN ({','.join('?' * len(rows))})",
+                        [now + self.visibility_timeout] + [row[0] for row in rows]
+                    )
+                conn.execute("COMMIT")
+                return [QueuedRecord(record, record_id) for record_id, record in rows]
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+    def ack(self, records: List[QueuedRecord]) -> None:
+        if not records:
+            return
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"DELETE FROM event_queue WHERE id IN ({','.join('?' * len(records))})",
+                [record.receipt for record in records]
+            )
+
+
+class SQSEventQueue(EventQueue):
+    """
+    Amazon SQSを使ったキュー（Lambda本番用）
+    """
+
+    def __init__(self, queue_url: str) -> None:
+        import boto3
+
+        self._queue_url = queue_url
+        self._client = boto3.client('sqs')
+
+    def enqueue(self, records: List[str]) -> None:
+        # send_message_batchは1回あたり最大10件
+        for start in range(0, len(records), 10):
+            self._send_batch(records[start:start + 10])
+
+    def _send_batch(self, chunk: List[str]) -> None:
+        # 一部のエントリだけが失敗することがあるため、失敗したエントリを再送し、それでも残れば例外にする
+        entries = {str(i): record for i, record in enumerate(chunk)}
+        failed = []
+        for _ in range(SQS_SEND_ATTEMPTS):
+            response = self._client.send_message_batch(
+                QueueUrl=self._queue_url,
+                Entries=[{'Id': entry_id, 'MessageBody': record} for entry_id, record in entries.items()]
+            )
+            failed = response.get('Failed', [])
+            retryable = {entry['Id'] for entry in failed if not entry.get('SenderFault')}
+            if not failed or len(retryable) < len(failed):
+                break
+            entries = {entry_id: entries[entry_id] for entry_id in retryable}
+
+        if failed:
+            codes = ', '.join(sorted({str(entry.get('Code')) for entry in failed}))
+            raise RuntimeError(f"Failed to enqueue {len(failed)} records to SQS: {codes}")
+
+    def dequeue(self, max_records: int = 10) -> List[QueuedRecord]:
+        # 削除は処理後のackで行い、ackされなかったメッセージは可視性タイムアウト後に再配信される
+        response = self._client.receive_message(
+            QueueUrl=self._queue_url,
+            MaxNumberOfMessages=min(max_records, 10),
+            WaitTimeSeconds=0
+        )
+        return [
+            QueuedRecord(message['Body'], message['ReceiptHandle'])
+            for message in response.get('Messages', [])
+        ]
+
+    def ack(self, records: List[QueuedRecord]) -> None:
+        for start in range(0, len(records), 10):
+            self._client.delete_message_batch(
+                QueueUrl=self._queue_url,
+                Entries=[
+                    {'Id': str(i), 'ReceiptHandle': record.receipt}
+                    for i, record in enumerate(records[start:start + 10])
+                ]
+            )
+
+
+def create_event_queue(backend: Optional[str] = None) -> EventQueue:
+    """
+    環境変数EVENT_QUEUE_BACKEND（memory / sqlite / sqs）に応じてキューを作成
+    """
+    backend = backend or os.environ.get('EVENT_QUEUE_BACKEND', 'memory')
+
+    if backend == 'memory':
+        return InMemoryEventQueue()
+    if backend == 'sqlite':
+        return SQLiteEventQueue(
+            os.environ.get('EVENT_QUEUE_SQLITE_PATH', 'event_queue.db'),
+            float(os.environ.get('EVENT_QUEUE_VISIBILITY_SECONDS', '300'))
+        )
+    if backend == 'sqs':
+        return SQSEventQueue(os.environ['EVENT_QUEUE_SQS_URL'])
+
+    raise ValueError(f"Unknown event queue backend: {backend}")
@@ -0,0 +1,70 @@
+import json
+import os
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from linebot.models import TextSendMessage
+
+from src.response_cache import normalize_text
+
+DEFAULT_TEMPLATES = {
+    'follow': "友だち追加ありがとうございます！\n質問やメッセージを送ると、AIがお答えします。\n「ヘルプ」で使い方を表示します。",
+    'help': "メッセージを送ると、AIがお答えします。\n\nコマンド:\n・ヘルプ（help）: この説明を表示\n・リセット（reset）: 会話履歴を消去",
+    'reset': "会話履歴をリセットしました。新しい話題でどうぞ。"
+}
+
+DEFAULT_COMMANDS = {
+    'help': ['help', '/help', 'ヘルプ', '使い方'],
+    'reset': ['reset', '/reset', 'リセット', '履歴を消去']
+}
+
+
+class FastPathRouter:
+    """
+    Claudeを呼び出さずに応答できるイベント（友だち追加・ポストバック・コマンド）の振り分け
+    応答メッセージは生成時に作成しておき、コマンドは正規化したテキストの完全一致で判定する
+    """
+
+    def __init__(self, templates: Dict[str, str], commands: Dict[str, List[str]]) -> None:
+        self.messages = {name: TextSendMessage(text=text) for name, text in templates.items()}
+        self._commands = {
+            normalize_text(alias): name
+            for name, aliases in commands.items()
+            for alias in aliases
+        }
+
+    def match_command(self, text: str) -> Optional[str]:
+        """
+        テキストがコマンドであればコマンド名を返す（「/」で始まる場合は最初の語で判定）
+        """
+        key = normalize_text(text)
+        name = self._commands.get(key)
+        if name is None and key.startswith('/'):
+            name = self._commands.get(key.split(' ', 1)[0])
+        return name
+
+    @staticmethod
+    def postback_action(data: str) -> Optional[str]:
+        """
+        ポストバックのdata（action=...&...形式）からactionを取り出す
+        """
+        values = parse_qs(data or '').get('action')
+        return values[0] if values else None
+
+    def message(self, name: str) -> Optional[TextSendMessage]:
+        return self.messages.get(name)
+
+
+def create_fast_path_router() -> FastPathRouter:
+    """
+    環境変数の設定からファストパスの振り分けを作成
+    FAST_PATH_TEMPLATES（名前→応答文）とFAST_PATH_COMMANDS（名前→別名のリスト）のJSONで追加・上書きできる
+    """
+    templates = dict(DEFAULT_TEMPLATES)
+    templates.update(json.loads(os.environ.get('FAST_PATH_TEMPLATES') or '{}'))
+    if os.environ.get('FOLLOW_MESSAGE'):
+        templates['follow'] = os.environ['FOLLOW_MESSAGE']
+
+    commands = dict(DEFAULT_COMMANDS)
+    commands.update(json.loads(os.environ.get('FAST_PATH_COMMANDS') or '{}'))
+    return FastPathRouter(templates, commands)
@@ -0,0 +1,168 @@
+import importlib.util
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import httpx
+from linebot.http_client import HttpClient, HttpResponse
+
+logger = logging.getLogger()
+
+Timeout = Union[float, Tuple[float, float], None]
+
+
+class HttpTransport:
+    """
+    LINE SDKとAnthropic SDKで共有するHTTPクライアント（コネクションプール・keep-alive・HTTP/2）
+    ウォームコンテナでは呼び出し間で接続を再利用し、TLSハンドシェイクを省略する
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        http2: bool = True,
+        connect_timeout: float = 3.0,
+        timeout: float = 30.0,
+        transport: Optional[httpx.BaseTransport] = None
+    ) -> None:
+        # HTTP/2はh2パッケージがある場合のみ有効にする
+        self.http2 = http2 and importlib.util.find_spec('h2') is not None
+        self.client = httpx.Client(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            transport=transport
+        )
+
+    def prewarm(self, urls: List[str], timeout: float = 2.0) -> int:
+        """
+        各URLのホストに接続してプールに残しておく（失敗は無視）、接続できた数を返す
+        """
+        start = time.perf_counter()
+        warmed = 0
+        for url in urls:
+            try:
+                self.client.head(url, timeout=timeout)
+                warmed += 1
+            except httpx.HTTPError as e:
+                logger.warning(f"接続の事前確立に失敗: {url} {str(e)}")
+        logger.info("%d/%d件の接続を事前に確立 (%.0fms)", warmed, len(urls), (time.perf_counter() - start) * 1000)
+        return warmed
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class HttpxLineClient(HttpClient):
+    """
+    共有のhttpx.Clientを使うLINE SDK（LineBotApi）用のHttpClient
+    SDK標準のRequestsHttpClientはリクエストごとに新しい接続を開くため、その代わりに使う
+    """
+
+    def __init__(self, client: httpx.Client, timeout: Timeout = HttpClient.DEFAULT_TIMEOUT) -> None:
+        super().__init__(timeout)
+        self._client = client
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._send('GET', url, headers=headers, params=params, stream=stream, timeout=timeout)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._send('POST', url, headers=headers, data=data, timeout=timeout)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._send('DELETE', url, headers=headers, data=data, timeout=timeout)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._send('PUT', url, headers=headers, data=data, timeout=timeout)
+
+    def _send(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+              params: Optional[Dict[str, Any]] = None, data: Any = None, stream: bool = False,
+              timeout: Timeout = None) -> 'HttpxLineResponse':
+        body: Dict[str, Any] = {}
+        if hasattr(data, 'read'):
+            data = data.read()
+        if isinstance(data, (str, bytes)):
+            body['content'] = data
+        elif data is not None:
+            body['data'] = data
+
+        request = self._client.build_request(
+            method, url, headers=headers, params=params,
+            timeout=to_httpx_timeout(timeout if timeout is not None else self.timeout),
+            **body
+        )
+        return HttpxLineResponse(self._client.send(request, stream=stream))
+
+
+class HttpxLineResponse(HttpResponse):
+    """
+    httpx.ResponseをLINE SDKのHttpResponseとして扱うラッパー
+    """
+
+    def __init__(self, response: httpx.Response) -> None:
+        self.response = response
+
+    @property
+    def status_code(self) -> int:
+        return self.response.status_code
+
+    @property
+    def headers(self) -> httpx.Headers:
+        return self.response.headers
+
+    @property
+    def text(self) -> str:
+        return self.read().text
+
+    @property
+    def content(self) -> bytes:
+        return self.read().content
+
+    @property
+    def json(self) -> Any:
+        return self.read().json()
+
+    def read(self) -> httpx.Response:
+        # ストリームで受け取ったレスポンス（エラー応答など）も本文を読み切ってから参照し、接続をプールに戻す
+        self.response.read()
+        return self.response
+
+    def iter_content(self, chunk_size: int = 1024, decode_unicode: bool = False) -> Iterator[Any]:
+        if decode_unicode:
+            return self.response.iter_text(chunk_size)
+        return self.response.iter_bytes(chunk_size)
+
+    def close(self) -> None:
+        # ストリームを最後まで読まなかった場合に接続をプールに戻す
+        self.response.close()
+
+
+def to_httpx_timeout(timeout: Timeout) -> httpx.Timeout:
+    """
+    requests形式のタイムアウト（秒、または(接続, 読み取り)のタプル）をhttpx.Timeoutに変換
+    """
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def create_http_transport() -> HttpTransport:
+    """
+    環境変数の設定から共有HTTPクライアントを作成
+    """
+    return HttpTransport(
+        max_connections=int(os.environ.get('HTTP_POOL_MAX_CONNECTIONS', '20')),
+        max_keepalive_connections=int(os.environ.get('HTTP_POOL_MAX_KEEPALIVE', '10')),
+        keepalive_expiry=float(os.environ.get('HTTP_KEEPALIVE_EXPIRY_SECONDS', '60')),
+        http2=os.environ.get('HTTP2', 'true').lower() == 'true',
+        connect_timeout=float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', '3')),
+        timeout=float(os.environ.get('HTTP_TIMEOUT_SECONDS', '30'))
+    )
@@ -0,0 +1,211 @@
+import base64
+import io
+import math
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+# Claudeが縮小せずに扱う画像の長辺の上限と、画像のトークン数の目安（幅×高さ/750）
+CLAUDE_MAX_IMAGE_EDGE = 1568
+PIXELS_PER_TOKEN = 750
+# Messages APIで送れる1画像あたりのサイズの上限
+CLAUDE_MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+# 縮小が不要な場合に、再エンコードせずにそのまま送る形式
+PASSTHROUGH_MEDIA_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp'
+}
+
+# EXIFのOrientationのうち、縦横が入れ替わるもの
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class ImageError(Exception):
+    """
+    画像メッセージをClaudeに送れる形に変換できなかった
+    """
+
+
+class ImageTooLarge(ImageError):
+    """
+    画像のファイルサイズが受け付ける上限を超えている
+    """
+
+
+class UnsupportedImage(ImageError):
+    """
+    画像として読み込めない、または対応していない形式
+    """
+
+
+class ImageUnavailable(ImageError):
+    """
+    コンテンツAPIから画像を取得できなかった（保存期間切れ・削除済みなど）
+    """
+
+
+class PreparedImage:
+    """
+    Claudeに送る画像（縮小・再エンコード済みのバイト列と、元の画像のサイズ）
+    """
+
+    __slots__ = ('data', 'media_type', 'width', 'height', 'source_bytes', 'source_width', 'source_height')
+
+    def __init__(self, data: bytes, media_type: str, width: int, height: int,
+                 source_bytes: int, source_width: int, source_height: int) -> None:
+        self.data = data
+        self.media_type = media_type
+        self.width = width
+        self.height = height
+        self.source_bytes = source_bytes
+        self.source_width = source_width
+        self.source_height = source_height
+
+    @property
+    def estimated_tokens(self) -> int:
+        return estimate_image_tokens(self.width, self.height)
+
+    def as_content_block(self) -> Dict[str, Any]:
+        """
+        Messages APIのimageコンテンツブロック
+        """
+        return {
+            'type': 'image',
+            'source': {
+                'type': 'base64',
+                'media_type': self.media_type,
+                'data': base64.b64encode(self.data).decode('ascii')
+            }
+        }
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    return math.ceil(width * height / PIXELS_PER_TOKEN)
+
+
+def target_size(width: int, height: int, max_edge: int, max_tokens: int) -> Tuple[int, int]:
+    """
+    縦横比を保ったまま、長辺がmax_edge以下・推定トークン数がmax_tokens以下になる大きさ（拡大はしない）
+    """
+    scale = min(
+        1.0,
+        max_edge / max(width, height),
+        math.sqrt(max_tokens * PIXELS_PER_TOKEN / (width * height))
+    )
+    if scale >= 1.0:
+        return width, height
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def read_limited(chunks: Iterable[bytes], max_bytes: int) -> bytes:
+    """
+    チャンクをmax_bytesまで読み込む（超えた時点で読み込みをやめてImageTooLargeを送出）
+    """
+    buffer = io.BytesIO()
+    for chunk in chunks:
+        buffer.write(chunk)
+        if buffer.tell() > max_bytes:
+            raise ImageTooLarge(f"Image exceeds {max_bytes} bytes")
+    return buffer.getvalue()
+
+
+def downscale_image(data: bytes, max_edge: int = CLAUDE_MAX_IMAGE_EDGE, max_tokens: int = 1600,
+                    quality: int = 85) -> PreparedImage:
+    """
+    画像を縮小してJPEGに再エンコード（縮小・回転が不要で対応形式の場合は元のバイト列のまま）
+    JPEGはデコード時に1/2・1/4・1/8の縮小読み込み（draft）を使い、フル解像度での展開を避ける
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        image = Image.open(io.BytesIO(data))
+    except (UnidentifiedImageError, OSError) as e:
+        raise UnsupportedImage(str(e)) from e
+
+    with image:
+        source_format = image.format
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        transposed = orientation in TRANSPOSED_ORIENTATIONS
+        width, height = (image.height, image.width) if transposed else image.size
+        size = target_size(width, height, max_edge, max_tokens)
+
+        if (size == (width, height) and orientation == 1 and source_format in PASSTHROUGH_MEDIA_TYPES
+                and len(data) <= CLAUDE_MAX_IMAGE_BYTES):
+            return PreparedImage(data, PASSTHROUGH_MEDIA_TYPES[source_format], width, height,
+                                 len(data), width, height)
+
+        try:
+            image.draft('RGB', (size[1], size[0]) if transposed else size)
+            converted = ImageOps.exif_transpose(image)
+            if converted.mode in ('RGBA', 'LA') or (converted.mode == 'P' and 'transparency' in converted.info):
+                # 透過部分は白で塗りつぶす（JPEGは透過を扱えない）
+                rgba = converted.convert('RGBA')
+                converted = Image.new('RGB', rgba.size, (255, 255, 255))
+                converted.paste(rgba, mask=rgba.getchannel('A'))
+            elif converted.mode != 'RGB':
+                converted = converted.convert('RGB')
+            if converted.size != size:
+                converted = converted.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+            output = io.BytesIO()
+            converted.save(output, 'JPEG', quality=quality)
+        except (OSError, ValueError) as e:
+            raise UnsupportedImage(str(e)) from e
+
+    return PreparedImage(output.getvalue(), 'image/jpeg', size[0], size[1], len(data), width, height)
+
+
+class ImagePreparer:
+    """
+    画像メッセージの取得・縮小を行い、元の画像と送信した画像のサイズを集計する
+    縮小した画像は保持しない（再配信・再処理された画像への応答はレスポンスキャッシュで省略する）
+    """
+
+    def __init__(self, max_edge: int = CLAUDE_MAX_IMAGE_EDGE, max_tokens: int = 1600, quality: int = 85,
+                 max_input_bytes: int = 20 * 1024 * 1024) -> None:
+        self.max_edge = min(max_edge, CLAUDE_MAX_IMAGE_EDGE)
+        self.max_tokens = max_tokens
+        self.quality = quality
+        self.max_input_bytes = max_input_bytes
+
+        self._lock = threading.Lock()
+        self.prepared = 0
+        self.source_bytes = 0
+        self.sent_bytes = 0
+
+    def prepare(self, fetch: Callable[[], Iterable[bytes]]) -> PreparedImage:
+        """
+        fetchのチャンクを読み込んで縮小した画像を返す
+        """
+        prepared = downscale_image(
+            read_limited(fetch(), self.max_input_bytes), self.max_edge, self.max_tokens, self.quality
+        )
+        with self._lock:
+            self.prepared += 1
+            self.source_bytes += prepared.source_bytes
+            self.sent_bytes += len(prepared.data)
+        return prepared
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'prepared': self.prepared,
+                'source_bytes': self.source_bytes,
+                'sent_bytes': self.sent_bytes
+            }
+
+
+def create_image_preparer() -> ImagePreparer:
+    """
+    環境変数の設定から画像の縮小処理を作成
+    """
+    return ImagePreparer(
+        max_edge=int(os.environ.get('IMAGE_MAX_EDGE', str(CLAUDE_MAX_IMAGE_EDGE))),
+        max_tokens=int(os.environ.get('IMAGE_MAX_TOKENS', '1600')),
+        quality=int(os.environ.get('IMAGE_JPEG_QUALITY', '85')),
+        max_input_bytes=int(os.environ.get('IMAGE_MAX_INPUT_BYTES', str(20 * 1024 * 1024)))
+    )
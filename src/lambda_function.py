@@ -1,31 +1,372 @@
 import json
+import atexit
 import os
+import hmac
+import hashlib
+import base64
+import functools
+import time
+import random
 import logging
-from typing import Dict, Any
-import anthropic
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import TextMessage, MessageEvent, TextSendMessage
+import threading
+import uuid
+from contextlib import closing
+from typing import Dict, Any, List, Iterable, Iterator, Optional, Callable, Tuple
+from src.event_queue import create_event_queue
+from src.streaming import SentenceChunker, pack_messages, trim_to_sentence
+from src.conversation_store import create_conversation_store
+from src.response_cache import create_response_cache
+from src.deduplication import create_event_deduplicator
+from src.tracing import create_tracer, TruncatedJson, COUNT
+from src.claude_governor import ClaudeGovernor, UserRateLimitExceeded, DeadlineExceeded, DeadlineExceededBeforeCall
+from src.model_router import Route, create_model_router, should_fall_back
+from src.message_coalescer import MessageCoalescer
+from src.usage_accounting import create_usage_accountant
+from src.delivery_queue import (
+    DELIVERY_DEAD_LETTERED, DELIVERY_QUEUED, DELIVERY_SENT, DeliveryQueue, create_delivery_queue,
+    is_invalid_reply_token, is_retryable_line_error, line_error_status
+)
+from src.circuit_breaker import CircuitOpen, STATE_VALUES, create_circuit_breaker
+from src.channel_registry import ChannelClients, channel_scope, create_channel_registry, current_channel
+from src.image_processing import ImageError, ImageTooLarge, ImageUnavailable, create_image_preparer
+from src.deadline import current_deadline, deadline_scope, earliest, lambda_deadline, remaining, wall_clock_deadline
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-line_bot_api = LineBotApi(os.environ.get('LINE_CHANNEL_ACCESS_TOKEN'))
-handler = WebhookHandler(os.environ.get('LINE_CHANNEL_SECRET'))
-claude_client = anthropic.Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
+# 1回のwebhook配信内のイベントを並行処理する上限（同一ユーザーのイベントは順序を維持）
+EVENT_CONCURRENCY = int(os.environ.get('EVENT_CONCURRENCY', '4'))
+
+# SDKのモデルを生成せず、必要な項目だけを軽量なレコードに変換してハンドラーに渡す
+LEAN_WEBHOOK_PARSING = os.environ.get('LEAN_WEBHOOK_PARSING', 'false').lower() == 'true'
+
+# 区間ごとの所要時間をEMF形式のメトリクスとして出力
+tracer = create_tracer()
+
+# 受信イベント全体のログはサンプリングし、サイズを制限して出力する
+LOG_EVENT_SAMPLE_RATE = float(os.environ.get('LOG_EVENT_SAMPLE_RATE', '0.01'))
+LOG_EVENT_MAX_CHARS = int(os.environ.get('LOG_EVENT_MAX_CHARS', '2000'))
+
+# 処理の期限（Lambdaの残り実行時間と返信トークンの有効期限のうち早い方）
+DEADLINE_SAFETY_MARGIN_SECONDS = float(os.environ.get('DEADLINE_SAFETY_MARGIN_SECONDS', '0.5'))
+REPLY_TOKEN_TTL_SECONDS = float(os.environ.get('REPLY_TOKEN_TTL_SECONDS', '55'))
+# Claudeの応答後に返信を送るために残しておく時間と、Claudeを呼び出すのに最低限必要な残り時間
+LINE_REPLY_RESERVE_SECONDS = float(os.environ.get('LINE_REPLY_RESERVE_SECONDS', '1.0'))
+MIN_CLAUDE_SECONDS = float(os.environ.get('MIN_CLAUDE_SECONDS', '1.0'))
+LINE_TIMEOUT_SECONDS = 5.0
+LINE_MIN_TIMEOUT_SECONDS = 0.5
+
+# APIのエンドポイント（ローカルの擬似サーバーに向ける場合に変更）
+LINE_API_ENDPOINT = os.environ.get('LINE_API_ENDPOINT', 'https://api.line.me')
+LINE_API_DATA_ENDPOINT = os.environ.get('LINE_API_DATA_ENDPOINT', 'https://api-data.line.me')
+ANTHROPIC_BASE_URL = os.environ.get('ANTHROPIC_BASE_URL') or None
+
+# true: コンテナの初期化時にクライアントを生成し、LINE API・Claude APIへの接続を確立しておく
+HTTP_PREWARM = os.environ.get('HTTP_PREWARM', 'false').lower() == 'true'
+HTTP_PREWARM_TIMEOUT_SECONDS = float(os.environ.get('HTTP_PREWARM_TIMEOUT_SECONDS', '2'))
+
+# LINE SDK・Anthropic SDKのクライアントは初回利用時に生成する（コールドスタート短縮のため）
+# 両クライアントはコネクションプールを持つ1つのHTTPクライアントを共有する
+_clients_lock = threading.Lock()
+_http_transport = None
+_line_bot_api = None
+_handler = None
+_dispatcher = None
+_fast_path = None
+_claude_client = None
+
+# sync: webhook内でClaude応答まで処理 / split: webhookはキュー投入のみ、応答はworker_handlerで処理
+BOT_MODE = os.environ.get('BOT_MODE', 'sync')
+WORKER_BATCH_SIZE = int(os.environ.get('WORKER_BATCH_SIZE', '10'))
+
+# Message Batches APIによる一括処理（run_batch、scripts/batch_process.py）
+BATCH_POLL_INTERVAL_SECONDS = float(os.environ.get('BATCH_POLL_INTERVAL_SECONDS', '10'))
+BATCH_MAX_WAIT_SECONDS = float(os.environ.get('BATCH_MAX_WAIT_SECONDS', str(24 * 3600)))
+BATCH_DELIVERY_CONCURRENCY = int(os.environ.get('BATCH_DELIVERY_CONCURRENCY', '4'))
+
+event_queue = create_event_queue() if BOT_MODE == 'split' else None
+
+# true: Claudeの応答をストリーミングで受け取り、最初の文がそろった時点で返信し、残りはプッシュで送信
+RESPONSE_STREAMING = os.environ.get('RESPONSE_STREAMING', 'false').lower() == 'true'
+STREAM_FIRST_CHUNK_CHARS = int(os.environ.get('STREAM_FIRST_CHUNK_CHARS', '40'))
+STREAM_PUSH_CHARS = int(os.environ.get('STREAM_PUSH_CHARS', '1000'))
+
+# LINEの1メッセージの上限文字数と、1回の返信・プッシュで送れるメッセージ数の上限
+LINE_MAX_TEXT_CHARS = 5000
+LINE_MAX_MESSAGES = 5
+
+# 応答は文単位でREPLY_MESSAGE_CHARS以内の吹き出しに分けて返信し、6通目以降はプッシュで送信
+# 届ける文字数の上限REPLY_MAX_CHARSは1回の返信で送れる量（5通×REPLY_MESSAGE_CHARS）から決め、
+# 環境変数ではそれより小さくだけできる。生成量（max_tokens）も同じ値にする（日本語は約1文字1トークン）
+REPLY_MESSAGE_CHARS = min(int(os.environ.get('REPLY_MESSAGE_CHARS', '200')), LINE_MAX_TEXT_CHARS)
+REPLY_BUDGET_CHARS = LINE_MAX_MESSAGES * REPLY_MESSAGE_CHARS
+REPLY_MAX_CHARS = min(int(os.environ.get('REPLY_MAX_CHARS', str(REPLY_BUDGET_CHARS))), REPLY_BUDGET_CHARS)
+CLAUDE_MAX_TOKENS = REPLY_MAX_CHARS
+
+# メッセージの内容で小さく速いモデルと大きいモデルを使い分ける（無効時はCLAUDE_MODELのみ）
+MODEL_ROUTING = os.environ.get('MODEL_ROUTING', 'true').lower() == 'true'
+model_router = create_model_router(CLAUDE_MAX_TOKENS) if MODEL_ROUTING else None
+DEFAULT_ROUTE = Route(
+    name='default',
+    model=os.environ.get('CLAUDE_MODEL', 'claude-3-sonnet-20240229'),
+    max_tokens=CLAUDE_MAX_TOKENS,
+    deadline_seconds=None
+)
+
+# 画像メッセージはコンテンツAPIからストリームで取得し、縮小・再エンコードしてからClaudeに送る
+IMAGE_MESSAGES = os.environ.get('IMAGE_MESSAGES', 'true').lower() == 'true'
+IMAGE_PROMPT = os.environ.get('IMAGE_PROMPT', 'この画像について説明してください。')
+IMAGE_CHUNK_BYTES = 64 * 1024
+image_preparer = create_image_preparer() if IMAGE_MESSAGES else None
+
+# ユーザーごとの会話履歴（ウォームコンテナの呼び出し間で維持）
+CONVERSATION_MEMORY = os.environ.get('CONVERSATION_MEMORY', 'true').lower() == 'true'
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get('CONVERSATION_TOKEN_BUDGET', '2000'))
+conversation_store = create_conversation_store() if CONVERSATION_MEMORY else None
+
+# 履歴を伴わない質問へのClaude応答のキャッシュ
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'true').lower() == 'true'
+response_cache = create_response_cache() if RESPONSE_CACHE else None
+
+# ユーザー・モデルごとのトークン数・レイテンシ・エラー数の集計（呼び出し終了時にまとめて出力）
+USAGE_ACCOUNTING = os.environ.get('USAGE_ACCOUNTING', 'true').lower() == 'true'
+usage_accountant = create_usage_accountant() if USAGE_ACCOUNTING else None
+if usage_accountant is not None:
+    # ローカルサーバーなど長時間動くプロセスでは終了時に残りを出力する
+    atexit.register(usage_accountant.flush, True)
+
+# 送信に失敗したプッシュメッセージの再送キュー（ワーカー・定期実行で再送時刻を過ぎたものを再送）
+# Lambdaのsyncモードでは定期実行が別のコンテナで動くため、共有のDELIVERY_QUEUE_BACKEND=dynamodbを使う
+DELIVERY_RETRY = os.environ.get('DELIVERY_RETRY', 'true').lower() == 'true'
+DELIVERY_RETRY_BATCH_SIZE = int(os.environ.get('DELIVERY_RETRY_BATCH_SIZE', '10'))
+delivery_queue = create_delivery_queue() if DELIVERY_RETRY else None
+if (delivery_queue is not None and isinstance(delivery_queue, DeliveryQueue) and BOT_MODE == 'sync'
+        and os.environ.get('AWS_LAMBDA_FUNCTION_NAME')):
+    logger.warning("再送キューがコンテナ内のSQLiteのため、retry_handlerからは他のコンテナのメッセージを再送できません"
+                   "（DELIVERY_QUEUE_BACKEND=dynamodbを設定してください）")
+
+# webhookEventIdによる再配信イベントの重複処理防止
+EVENT_DEDUP = os.environ.get('EVENT_DEDUP', 'true').lower() == 'true'
+event_deduplicator = create_event_deduplicator() if EVENT_DEDUP else None
+
+# 連続して届いた同じユーザーのテキストメッセージを1回のClaude呼び出しにまとめる
+# 同じwebhook配信（split modeではキューのバッチ）内の連続メッセージはそのまま結合し、
+# COALESCE_WINDOW_SECONDS > 0の場合は別の配信で届いたメッセージもその時間だけ待ってまとめる
+MESSAGE_COALESCING = os.environ.get('MESSAGE_COALESCING', 'true').lower() == 'true'
+COALESCE_MAX_MESSAGES = int(os.environ.get('COALESCE_MAX_MESSAGES', '10'))
+COALESCE_WINDOW_SECONDS = float(os.environ.get('COALESCE_WINDOW_SECONDS', '0'))
+message_coalescer = MessageCoalescer(
+    window_seconds=COALESCE_WINDOW_SECONDS,
+    max_wait_seconds=float(os.environ.get('COALESCE_MAX_WAIT_SECONDS', '3')),
+    max_messages=COALESCE_MAX_MESSAGES
+) if MESSAGE_COALESCING and COALESCE_WINDOW_SECONDS > 0 else None
+
+# Claude API呼び出しの流量制御（同時実行数・ユーザーごとの上限・リトライ・期限）
+CLAUDE_GOVERNOR = os.environ.get('CLAUDE_GOVERNOR', 'true').lower() == 'true'
+claude_governor = ClaudeGovernor(
+    max_concurrency=int(os.environ.get('CLAUDE_MAX_CONCURRENCY', '8')),
+    user_rate_per_minute=float(os.environ.get('CLAUDE_USER_RATE_PER_MINUTE', '20')),
+    user_burst=float(os.environ.get('CLAUDE_USER_BURST', '5')),
+    max_retries=int(os.environ.get('CLAUDE_MAX_RETRIES', '4')),
+    base_delay=float(os.environ.get('CLAUDE_RETRY_BASE_DELAY', '0.5')),
+    max_delay=float(os.environ.get('CLAUDE_RETRY_MAX_DELAY', '8')),
+    deadline_seconds=float(os.environ.get('CLAUDE_DEADLINE_SECONDS', '25'))
+) if CLAUDE_GOVERNOR else None
+
+
+def on_circuit_transition(previous: str, state: str) -> None:
+    logger.warning("Claude APIのサーキットブレーカー: %s → %s", previous, state)
+    tracer.record('CircuitTransitions', 1, COUNT)
+    tracer.record(f"Circuit{state.title().replace('_', '')}", 1, COUNT)
+
+
+# Claude APIの障害時に呼び出しを遮断し、タイムアウトを待たずにキャッシュ済みの応答か定型文を返す
+CIRCUIT_BREAKER = os.environ.get('CIRCUIT_BREAKER', 'true').lower() == 'true'
+circuit_breaker = create_circuit_breaker(on_circuit_transition) if CIRCUIT_BREAKER else None
+
+
+def create_channel_clients(channel: Any) -> ChannelClients:
+    """
+    チャネルのLineBotApi・WebhookParserを生成（HTTPクライアントは全チャネルで共有する）
+    """
+    from linebot import LineBotApi, WebhookParser
+    from src.http_transport import HttpxLineClient
+
+    transport = get_http_transport()
+    logger.info("チャネル%sのクライアントを生成", channel.name)
+    return ChannelClients(
+        LineBotApi(
+            channel.access_token,
+            endpoint=LINE_API_ENDPOINT,
+            data_endpoint=LINE_API_DATA_ENDPOINT,
+            timeout=LINE_TIMEOUT_SECONDS,
+            http_client=functools.partial(HttpxLineClient, transport.client)
+        ),
+        WebhookParser(channel.channel_secret)
+    )
+
+
+# 1つのデプロイで複数のLINEチャネルを処理する（webhookのdestinationでチャネルを選ぶ）
+# 未設定の場合・未登録のdestinationはLINE_CHANNEL_SECRET・LINE_CHANNEL_ACCESS_TOKENのチャネルとして処理
+CHANNELS_CONFIG = os.environ.get('CHANNELS_CONFIG')
+channel_registry = create_channel_registry(create_channel_clients) if CHANNELS_CONFIG else None
+
+
+def get_http_transport():
+    """
+    LINE SDK・Anthropic SDKで共有するHTTPクライアントを初回利用時に生成して返す
+    """
+    global _http_transport
+    if _http_transport is None:
+        with _clients_lock:
+            if _http_transport is None:
+                from src.http_transport import create_http_transport
+                _http_transport = create_http_transport()
+    return _http_transport
+
+
+def get_line_bot_api():
+    """
+    処理中のチャネルのLineBotApiを返す（デフォルトのチャネルは初回利用時に生成する）
+    """
+    global _line_bot_api
+    channel = current_channel()
+    if channel is not None:
+        return channel_registry.clients(channel).line_bot_api
+    if _line_bot_api is None:
+        transport = get_http_transport()
+        with _clients_lock:
+            if _line_bot_api is None:
+                from linebot import LineBotApi
+                from src.http_transport import HttpxLineClient
+                _line_bot_api = LineBotApi(
+                    os.environ.get('LINE_CHANNEL_ACCESS_TOKEN'),
+                    endpoint=LINE_API_ENDPOINT,
+                    data_endpoint=LINE_API_DATA_ENDPOINT,
+                    timeout=LINE_TIMEOUT_SECONDS,
+                    http_client=functools.partial(HttpxLineClient, transport.client)
+                )
+    return _line_bot_api
+
+
+def get_handler():
+    """
+    イベントハンドラーを登録したWebhookHandlerを初回利用時に生成して返す
+    """
+    global _handler
+    if _handler is None:
+        with _clients_lock:
+            if _handler is None:
+                from linebot import WebhookHandler
+                from linebot.models import (
+                    MessageEvent, TextMessage, ImageMessage, FollowEvent, UnfollowEvent, PostbackEvent
+                )
+                webhook_handler = WebhookHandler(os.environ.get('LINE_CHANNEL_SECRET'))
+                webhook_handler.add(MessageEvent, message=TextMessage)(handle_text_message)
+                if image_preparer is not None:
+                    webhook_handler.add(MessageEvent, message=ImageMessage)(handle_image_message)
+                webhook_handler.add(FollowEvent)(handle_follow)
+                webhook_handler.add(UnfollowEvent)(handle_unfollow)
+                webhook_handler.add(PostbackEvent)(handle_postback)
+                _handler = webhook_handler
+    return _handler
+
+
+def get_fast_path():
+    """
+    Claudeを呼ばずに応答するイベント・コマンドの振り分けを初回利用時に生成して返す
+    """
+    global _fast_path
+    if _fast_path is None:
+        with _clients_lock:
+            if _fast_path is None:
+                from src.fast_path import create_fast_path_router
+                _fast_path = create_fast_path_router()
+    return _fast_path
+
+
+def get_dispatcher():
+    """
+    複数イベントを並行処理するディスパッチャーを初回利用時に生成して返す
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        webhook_handler = get_handler()
+        with _clients_lock:
+            if _dispatcher is None:
+                from src.event_dispatcher import ConcurrentEventDispatcher
+                _dispatcher = ConcurrentEventDispatcher(
+                    webhook_handler,
+                    max_workers=EVENT_CONCURRENCY,
+                    tracer=tracer,
+                    lean=LEAN_WEBHOOK_PARSING
+                )
+    return _dispatcher
+
+
+def get_claude_client():
+    """
+    Anthropicクライアントを初回利用時に生成して返す（Claudeを呼ばない経路ではimportしない）
+    """
+    global _claude_client
+    if _claude_client is None:
+        transport = get_http_transport()
+        with _clients_lock:
+            if _claude_client is None:
+                import anthropic
+                _claude_client = anthropic.Anthropic(
+                    api_key=os.environ.get('ANTHROPIC_API_KEY'),
+                    base_url=ANTHROPIC_BASE_URL,
+                    http_client=transport.client,
+                    timeout=transport.client.timeout,
+                    # 流量制御が有効な場合はリトライをClaudeGovernorに任せる
+                    max_retries=0 if claude_governor is not None else 2
+                )
+    return _claude_client
+
+
+def prewarm_connections() -> None:
+    """
+    クライアントを生成し、LINE API・Claude APIへの接続をプールに確立しておく
+    Lambdaでは初期化フェーズで実行し、最初のリクエストでのTLSハンドシェイクを省略する
+    """
+    try:
+        get_line_bot_api()
+        claude_client = get_claude_client()
+        get_http_transport().prewarm(
+            [LINE_API_ENDPOINT, str(claude_client.base_url)],
+            timeout=HTTP_PREWARM_TIMEOUT_SECONDS
+        )
+    except Exception as e:
+        logger.warning(f"接続の事前確立中にエラーが発生: {str(e)}")
+
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     LINE Botのwebhook用AWS Lambdaハンドラー
     """
+    tracer.start()
+    start = time.perf_counter()
+    
     try:
         signature = event['headers'].get('x-line-signature', event['headers'].get('X-Line-Signature'))
         body = event['body']
         
-        logger.info(f"Received event: {json.dumps(event)}")
+        if logger.isEnabledFor(logging.DEBUG) or random.random() < LOG_EVENT_SAMPLE_RATE:
+            logger.info("Received event: %s", TruncatedJson(event, LOG_EVENT_MAX_CHARS))
+        
+        from linebot.exceptions import InvalidSignatureError
         
         try:
-            handler.handle(body, signature)
+            channel = resolve_channel(body)
+            with deadline_scope(lambda_deadline(context, DEADLINE_SAFETY_MARGIN_SECONDS)), channel_scope(channel):
+                if BOT_MODE == 'split':
+                    enqueue_webhook(body, signature)
+                else:
+                    get_dispatcher().handle(
+                        body, signature, event_filter=is_new_event, merge_lane=merge_lane,
+                        parser=webhook_parser()
+                    )
         except InvalidSignatureError:
             logger.error("無効な署名")
             return {
@@ -44,68 +385,1168 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
         }
+    
+    finally:
+        tracer.record('InvocationLatency', (time.perf_counter() - start) * 1000)
+        flush_conversations()
+        flush_usage()
+        flush_metrics()
+
+
+def resolve_channel(body: str) -> Any:
+    """
+    webhookボディのdestinationに対応するチャネル（複数チャネル無効時・未登録の場合はNone）
+    """
+    if channel_registry is None:
+        return None
+    try:
+        destination = json.loads(body).get('destination')
+    except ValueError:
+        # 不正なボディはデフォルトのチャネルの署名検証で拒否する
+        return None
+    channel = channel_registry.resolve(destination)
+    if channel is None:
+        logger.warning("未登録のdestinationのためデフォルトのチャネルとして処理: %s", destination)
+    return channel
+
+
+def channel_for(destination: Optional[str]) -> Any:
+    """
+    キュー・バッチに保存したdestinationに対応するチャネル（複数チャネル無効時・未登録の場合はNone）
+    """
+    return channel_registry.resolve(destination) if channel_registry is not None else None
+
+
+def webhook_parser() -> Any:
+    """
+    処理中のチャネルのシークレットで署名を検証するWebhookParser
+    """
+    channel = current_channel()
+    if channel is None:
+        return get_handler().parser
+    return channel_registry.clients(channel).parser
+
+
+def enqueue_webhook(body: str, signature: str) -> None:
+    """
+    署名を検証し、webhookボディ内のイベントをキューに投入
+    """
+    from linebot.exceptions import InvalidSignatureError
+
+    with tracer.span('SignatureVerification'):
+        if not webhook_parser().signature_validator.validate(body, signature):
+            raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+
+    with tracer.span('BodyParsing'):
+        body_json = json.loads(body)
+    destination = body_json.get('destination')
+    records = [
+        json.dumps({'destination': destination, 'event': line_event}, ensure_ascii=False)
+        for line_event in body_json.get('events', [])
+        if claim_event(
+            line_event.get('webhookEventId'),
+            (line_event.get('deliveryContext') or {}).get('isRedelivery', False)
+        )
+    ]
+
+    if records:
+        with tracer.span('Enqueue'):
+            event_queue.enqueue(records)
+    tracer.record('EventCount', len(records), COUNT)
+    logger.info("%d件のイベントをキューに投入", len(records))
+
+
+def run_batch(lines: Iterable[str]) -> Dict[str, Any]:
+    """
+    JSONLのイベント・質問をMessage Batches APIでまとめて処理し、結果をプッシュメッセージで配信
+    夜間の再回答や障害後の未処理イベントの再処理など、リアルタイムでない処理に使う
+    """
+    from src.batch_processing import BatchProcessor, read_items
+
+    read = list(read_items(lines))
+    # 再処理するwebhookイベントは再配信として重複を確認し、処理済みのイベントには再び回答しない
+    items = [item for item in read if claim_event(item.event_id, True)]
+    duplicates = len(read) - len(items)
+    if not items:
+        return {'items': 0, 'succeeded': 0, 'failed': [], 'delivered': 0, 'queued': 0, 'dead_lettered': 0,
+                'duplicates': duplicates}
+
+    processor = BatchProcessor(
+        # 流量制御の対象外のため、ポーリングの一時的な失敗はSDKのリトライに任せる
+        get_claude_client().with_options(max_retries=3),
+        batch_request_params,
+        poll_interval_seconds=BATCH_POLL_INTERVAL_SECONDS,
+        max_wait_seconds=BATCH_MAX_WAIT_SECONDS,
+        delivery_concurrency=BATCH_DELIVERY_CONCURRENCY
+    )
+    try:
+        return dict(processor.run(items, deliver_batch_result), duplicates=duplicates)
+    finally:
+        flush_conversations()
+        flush_usage()
+
+
+def batch_request_params(item: Any) -> Dict[str, Any]:
+    """
+    バッチの1件分のMessages APIのパラメータ（通常の応答と同じルート・プロンプト・会話履歴）
+    """
+    route = select_route(item.text)
+    with channel_scope(channel_for(item.destination)):
+        return {
+            'model': route.model,
+            'max_tokens': route.max_tokens,
+            'temperature': 0.7,
+            'system': system_prompt(route.max_tokens),
+            'messages': build_messages(item.text, item.user_id)
+        }
 
 
-@handler.add(MessageEvent, message=TextMessage)
-def handle_text_message(event: MessageEvent) -> None:
+def deliver_batch_result(result: Any) -> str:
     """
-    LINEユーザーからのテキストメッセージを処理
+    バッチの結果を会話履歴・利用量に記録し、受信したチャネルからプッシュメッセージで送信
+    送信結果（再送キュー・dead letterに保存したかどうか）を返す
+    """
+    text = result.text
+    if result.stop_reason == 'max_tokens':
+        text = trim_to_sentence(text)
+    if usage_accountant is not None and result.usage is not None:
+        usage_accountant.record(
+            result.item.user_id, result.model, result.usage.input_tokens, result.usage.output_tokens
+        )
+    with channel_scope(channel_for(result.item.destination)):
+        remember_exchange(result.item.user_id, result.item.text, text)
+        return send_text(None, result.item.user_id, text)
+
+
+def worker_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    キューに投入されたイベントを処理するワーカー用ハンドラー
+    SQSトリガーの場合はRecordsを、それ以外は設定されたキューから取り出して処理
+    処理に失敗したdestinationのレコードはackせず（SQSトリガーではbatchItemFailuresで返し）、再配信させる
+    """
+    triggered = bool(event) and 'Records' in event
+    if not triggered and event_queue is None:
+        logger.error("イベントキューが設定されていないためワーカーを実行できません（BOT_MODE=splitで使用します）")
+        return {'processed': 0, 'received': 0, 'error': 'Event queue is not configured; set BOT_MODE=split'}
+
+    tracer.start()
+    start = time.perf_counter()
+
+    queued = event['Records'] if triggered else event_queue.dequeue(WORKER_BATCH_SIZE)
+    records = [item['body'] for item in queued] if triggered else [item.body for item in queued]
+
+    processed = 0
+    failed_destinations = []
+    with deadline_scope(lambda_deadline(context, DEADLINE_SAFETY_MARGIN_SECONDS)):
+        for destination, line_events in group_queued_records(records).items():
+            try:
+                process_queued_events(destination, line_events)
+                processed += len(line_events)
+            except Exception as e:
+                logger.error(f"キューイベントの処理中にエラーが発生: {str(e)}")
+                failed_destinations.append(destination)
+        # 再送はwebhookの応答を遅らせないよう、ワーカー・定期実行でのみ残り時間の範囲で行う
+        retry_deliveries()
+
+    def failed(record: str) -> bool:
+        # 読み込めないレコードは再配信しても処理できないため、処理済みとして扱う
+        try:
+            return json.loads(record).get('destination') in failed_destinations
+        except (ValueError, TypeError, AttributeError):
+            return False
+
+    retried = [item for item, record in zip(queued, records) if failed(record)]
+    result = {'processed': processed, 'received': len(records)}
+    if triggered:
+        result['batchItemFailures'] = [{'itemIdentifier': item.get('messageId')} for item in retried]
+    else:
+        event_queue.ack([item for item in queued if item not in retried])
+
+    tracer.record('InvocationLatency', (time.perf_counter() - start) * 1000)
+    flush_conversations()
+    flush_usage()
+    flush_metrics()
+
+    return result
+
+
+def group_queued_records(records: List[str]) -> Dict[Any, List[Dict[str, Any]]]:
+    """
+    キューのレコードをdestinationごとにまとめる（受信順を維持）
+    読み込めないレコードはログに出力して読み飛ばし、他のレコードの処理を続ける
+    """
+    grouped: Dict[Any, List[Dict[str, Any]]] = {}
+    skipped = 0
+    for record in records:
+        try:
+            queued = json.loads(record)
+            destination, line_event = queued.get('destination'), queued['event']
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+            logger.error("キューのレコードを読み込めません: %s %s", str(e), str(record)[:LOG_EVENT_MAX_CHARS])
+            skipped += 1
+            continue
+        grouped.setdefault(destination, []).append(line_event)
+    if skipped:
+        tracer.record('SkippedQueueRecords', skipped, COUNT)
+    return grouped
+
+
+def process_queued_events(destination: Any, line_events: List[Dict[str, Any]]) -> None:
+    """
+    キューから取り出したイベントを登録済みハンドラーで処理
+    """
+    body = json.dumps({'destination': destination, 'events': line_events})
+    channel = channel_for(destination)
+    secret = channel.channel_secret if channel is not None else os.environ.get('LINE_CHANNEL_SECRET', '')
+    with channel_scope(channel):
+        get_dispatcher().handle(body, _sign_body(body, secret), merge_lane=merge_lane, parser=webhook_parser())
+
+
+def _sign_body(body: str, secret: str) -> str:
+    # 受付ステージで検証済みのイベントをSDKのハンドラーに再投入するための署名
+    digest = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def is_new_event(event: Any) -> bool:
+    """
+    SDKのイベントが未処理（再配信による重複でない）かを判定
+    """
+    delivery_context = getattr(event, 'delivery_context', None)
+    return claim_event(
+        getattr(event, 'webhook_event_id', None),
+        bool(getattr(delivery_context, 'is_redelivery', False))
+    )
+
+
+def claim_event(webhook_event_id: Optional[str], is_redelivery: bool) -> bool:
+    """
+    webhookEventIdを処理済みとして登録し、重複していればFalseを返す
+    """
+    if event_deduplicator is None or not webhook_event_id:
+        return True
+
+    if event_deduplicator.claim(webhook_event_id, is_redelivery):
+        return True
+
+    logger.info("重複イベントをスキップ: %s", webhook_event_id)
+    return False
+
+
+def handle_text_message(event: Any) -> None:
+    """
+    LINEユーザーからのテキストメッセージを処理（get_handlerでMessageEvent/TextMessageに登録）
     """
     user_message = event.message.text
     user_id = event.source.user_id
+    reply_token = event.reply_token
+    
+    logger.info("%sからメッセージを受信: %s", user_id, user_message)
     
-    logger.info(f"{user_id}からメッセージを受信: {user_message}")
+    command = get_fast_path().match_command(user_message)
+    if command is not None:
+        run_command(command, reply_token, user_id)
+        return
     
+    if message_coalescer is not None and user_id:
+        pending = message_coalescer.submit(channel_key(user_id), user_message, reply_token)
+        if pending is None:
+            logger.info("%sのメッセージを待機中の呼び出しにまとめました", user_id)
+            return
+        if len(pending.texts) > 1:
+            tracer.record('CoalescedMessages', len(pending.texts) - 1, COUNT)
+        user_message, reply_token = pending.text, pending.reply_token
+    
+    reply_token, token_deadline = usable_reply_token(event, reply_token)
+    
+    with deadline_scope(token_deadline):
+        try:
+            if RESPONSE_STREAMING:
+                reply_with_stream(reply_token, user_id, user_message)
+                return
+            
+            response = get_claude_response(user_message, user_id)
+            
+            send_text(reply_token, user_id, response)
+            
+        except Exception as e:
+            logger.error(f"メッセージ処理中にエラーが発生: {str(e)}")
+            
+            error_message = "申し訳ございません。エラーが発生しました。しばらくしてから再度お試しください。"
+            try:
+                send_text(reply_token, user_id, error_message)
+            except Exception as send_error:
+                logger.error(f"エラーメッセージの送信に失敗: {str(send_error)}")
+
+
+def handle_image_message(event: Any) -> None:
+    """
+    LINEユーザーからの画像メッセージを処理（get_handlerでMessageEvent/ImageMessageに登録）
+    ストリーミング応答の設定にかかわらず、応答がそろってから返信する
+    """
+    message_id = event.message.id
+    user_id = event.source.user_id
+    reply_token = event.reply_token
+    
+    logger.info("%sから画像を受信: %s", user_id, message_id)
+    
+    reply_token, token_deadline = usable_reply_token(event, reply_token)
+    
+    with deadline_scope(token_deadline):
+        try:
+            send_text(reply_token, user_id, get_claude_image_response(message_id, user_id))
+        except Exception as e:
+            logger.error(f"画像メッセージの処理中にエラーが発生: {str(e)}")
+            
+            error_message = "申し訳ございません。エラーが発生しました。しばらくしてから再度お試しください。"
+            try:
+                send_text(reply_token, user_id, error_message)
+            except Exception as send_error:
+                logger.error(f"エラーメッセージの送信に失敗: {str(send_error)}")
+
+
+def merge_lane(events: List[Any]) -> List[Any]:
+    """
+    同じユーザーの連続したテキストメッセージを1つのイベントにまとめる（返信トークンは最後のイベントのもの）
+    """
+    if not MESSAGE_COALESCING or len(events) < 2:
+        return events
+
+    def is_text(event: Any) -> bool:
+        # SDKのイベントと軽量なイベントレコードの両方を扱えるようtypeで判定する
+        # コマンドはまとめずにファストパスで処理する
+        return (getattr(event, 'type', None) == 'message' and event.message is not None
+                and event.message.type == 'text'
+                and get_fast_path().match_command(event.message.text) is None)
+
+    merged: List[Any] = []
+    run: List[Any] = []
+    for event in events + [None]:
+        if event is not None and is_text(event) and len(run) < COALESCE_MAX_MESSAGES:
+            run.append(event)
+            continue
+        if run:
+            latest = run[-1]
+            if len(run) > 1:
+                latest.message.text = '\n'.join(item.message.text for item in run)
+                tracer.record('CoalescedMessages', len(run) - 1, COUNT)
+            merged.append(latest)
+            run = []
+        if event is not None:
+            if is_text(event):
+                run.append(event)
+            else:
+                merged.append(event)
+    return merged
+
+
+def handle_follow(event: Any) -> None:
+    """
+    友だち追加イベントにあいさつのテンプレートで返信
+    """
+    run_command('follow', event.reply_token, event.source.user_id)
+
+
+def handle_unfollow(event: Any) -> None:
+    """
+    ブロックされたユーザーの会話履歴を削除（返信はできない）
+    """
+    user_id = event.source.user_id
+    logger.info("%sにブロックされました", user_id)
+    if conversation_store is not None and user_id:
+        conversation_store.forget(channel_key(user_id))
+
+
+def handle_postback(event: Any) -> None:
+    """
+    ポストバックのactionに対応するコマンドを実行
+    """
+    action = get_fast_path().postback_action(event.postback.data)
+    if action is None or (action != 'reset' and get_fast_path().message(action) is None):
+        logger.info("未対応のポストバック: %s", event.postback.data)
+        return
+    run_command(action, event.reply_token, event.source.user_id)
+
+
+def run_command(name: str, reply_token: Optional[str], user_id: Optional[str]) -> None:
+    """
+    Claudeを呼ばずにコマンドを実行し、テンプレートのメッセージで返信
+    """
+    with tracer.span('FastPathLatency'):
+        if name == 'reset' and conversation_store is not None and user_id:
+            conversation_store.forget(channel_key(user_id))
+        
+        message = get_fast_path().message(name)
+        if message is None:
+            logger.warning("コマンド%sのテンプレートがありません", name)
+            return
+        if reply_token:
+            send_reply(reply_token, message, user_id)
+        elif user_id:
+            send_push(user_id, message)
+    tracer.record('FastPathEvents', 1, COUNT)
+
+
+def reply_token_deadline(event: Any) -> Optional[float]:
+    """
+    イベントの発生時刻から返信トークンの有効期限を計算
+    """
+    timestamp = getattr(event, 'timestamp', None)
+    if not timestamp:
+        return None
+    return wall_clock_deadline(timestamp / 1000 + REPLY_TOKEN_TTL_SECONDS)
+
+
+def usable_reply_token(event: Any, reply_token: Optional[str]) -> Tuple[Optional[str], Optional[float]]:
+    """
+    返信に使う返信トークンと、応答生成に適用する期限
+    返信トークンの有効期限が切れている場合はプッシュで送信するためNoneを返し、
+    返信トークンを使わない場合は期限を設けない（呼び出し全体の期限のみ）
+    """
+    if reply_token is None:
+        return None, None
+    token_deadline = reply_token_deadline(event)
+    if token_deadline is not None and token_deadline <= time.monotonic():
+        return None, None
+    return reply_token, token_deadline
+
+
+def get_claude_response(user_message: str, user_id: Optional[str] = None) -> str:
+    """
+    Claude APIからレスポンスを取得
+    """
+    start = None
+    model = DEFAULT_ROUTE.model
     try:
-        response = get_claude_response(user_message)
+        messages = build_messages(user_message, user_id)
+        cacheable = response_cache is not None and len(messages) == 1
+        
+        if cacheable:
+            cached = response_cache.get(channel_key(user_message))
+            if cached is not None:
+                remember_exchange(user_id, user_message, cached)
+                return cached
         
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=response)
+        route = select_route(user_message)
+        start = time.perf_counter()
+        model = route.model
+        message, fell_back = call_claude(
+            lambda model, timeout: get_claude_client().messages.create(
+                model=model,
+                max_tokens=route.max_tokens,
+                temperature=0.7,
+                system=system_prompt(route.max_tokens),
+                messages=messages,
+                **timeout_kwargs(timeout)
+            ),
+            route,
+            user_id
         )
         
-    except Exception as e:
-        logger.error(f"メッセージ処理中にエラーが発生: {str(e)}")
+        response_text = message.content[0].text
+        if message.stop_reason == 'max_tokens':
+            # 生成量の上限で途切れた場合は書きかけの文を送らない
+            response_text = trim_to_sentence(response_text)
+        latency_ms = (time.perf_counter() - start) * 1000
+        tracer.record('ClaudeLatency', latency_ms)
+        record_usage(message.usage, route, latency_ms, fell_back, user_id, getattr(message, 'model', None))
+        remember_exchange(user_id, user_message, response_text)
         
-        error_message = "申し訳ございません。エラーが発生しました。しばらくしてから再度お試しください。"
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text=error_message)
-        )
+        if cacheable:
+            response_cache.set(channel_key(user_message), response_text, time.perf_counter() - start)
+        
+        return response_text
+        
+    except Exception as e:
+        if start is not None and not isinstance(e, (CircuitOpen, DeadlineExceededBeforeCall)):
+            record_claude_error(user_id, model, (time.perf_counter() - start) * 1000)
+        if is_deadline_error(e) or isinstance(e, CircuitOpen):
+            return degraded_response(user_message, e)
+        return claude_error_message(e)
 
 
-def get_claude_response(user_message: str) -> str:
+def get_claude_image_response(message_id: str, user_id: Optional[str] = None) -> str:
     """
-    Claude APIからレスポンスを取得
+    画像メッセージを縮小してClaude APIに送り、レスポンスを取得（応答はメッセージIDをキーにキャッシュ）
     """
+    start = None
+    route = image_route()
+    image_key = f"image:{message_id}"
     try:
-        message = claude_client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1000,
-            temperature=0.7,
-            messages=[
-                {
-                    "role": "user",
-                    "content": user_message
-                }
-            ]
+        cached = response_cache.get(channel_key(image_key)) if response_cache is not None else None
+        if cached is not None:
+            return cached
+        
+        with tracer.span('ImagePreparationLatency'):
+            image = image_preparer.prepare(lambda: fetch_message_content(message_id))
+        tracer.record('ImageTokens', image.estimated_tokens, COUNT)
+        logger.info(
+            "画像を縮小: %dx%d (%d bytes) -> %dx%d (%d bytes, 約%dトークン)",
+            image.source_width, image.source_height, image.source_bytes,
+            image.width, image.height, len(image.data), image.estimated_tokens
+        )
+        
+        messages = build_messages(IMAGE_PROMPT, user_id, [
+            image.as_content_block(),
+            {'type': 'text', 'text': IMAGE_PROMPT}
+        ])
+        start = time.perf_counter()
+        message, fell_back = call_claude(
+            lambda model, timeout: get_claude_client().messages.create(
+                model=model,
+                max_tokens=route.max_tokens,
+                temperature=0.7,
+                system=system_prompt(route.max_tokens),
+                messages=messages,
+                **timeout_kwargs(timeout)
+            ),
+            route,
+            user_id
         )
         
         response_text = message.content[0].text
+        if message.stop_reason == 'max_tokens':
+            response_text = trim_to_sentence(response_text)
+        latency_ms = (time.perf_counter() - start) * 1000
+        tracer.record('ClaudeLatency', latency_ms)
+        record_usage(message.usage, route, latency_ms, fell_back, user_id, getattr(message, 'model', None))
+        # 会話履歴には画像そのものではなく、画像を送ったことだけを残す
+        remember_exchange(user_id, f"[画像] {IMAGE_PROMPT}", response_text)
         
-        if len(response_text) > 5000:
-            response_text = response_text[:4997] + "..."
+        if response_cache is not None:
+            response_cache.set(channel_key(image_key), response_text, time.perf_counter() - start)
         
         return response_text
         
-    except anthropic.RateLimitError:
-        logger.error("Claude APIのレート制限を超過")
-        return "現在リクエストが多いため、しばらくしてから再度お試しください。"
+    except ImageError as e:
+        logger.warning(f"画像を読み込めません: {message_id} {str(e)}")
+        if isinstance(e, ImageTooLarge):
+            return "画像のサイズが大きすぎるため読み込めませんでした。小さい画像でお試しください。"
+        if isinstance(e, ImageUnavailable):
+            return "画像を取得できませんでした。お手数ですが、もう一度送ってください。"
+        return "この画像は読み込めませんでした。別の形式の画像でお試しください。"
+    except Exception as e:
+        if start is not None and not isinstance(e, (CircuitOpen, DeadlineExceededBeforeCall)):
+            record_claude_error(user_id, route.model, (time.perf_counter() - start) * 1000)
+        if is_deadline_error(e) or isinstance(e, CircuitOpen):
+            return degraded_response(image_key, e)
+        return claude_error_message(e)
+
+
+def fetch_message_content(message_id: str) -> Iterator[bytes]:
+    """
+    コンテンツAPIからメッセージの画像をチャンクごとに取得（途中でやめた場合や失敗した場合も接続を閉じる）
+    LINE APIのエラー（保存期間切れ・削除済みなど）はImageUnavailableとして送出する
+    """
+    from linebot.exceptions import LineBotApiError
+
+    content = None
+    try:
+        content = get_line_bot_api().get_message_content(message_id, timeout=line_timeout())
+        yield from content.iter_content(IMAGE_CHUNK_BYTES)
+    except LineBotApiError as e:
+        raise ImageUnavailable(f"status_code={e.status_code} {e.error.message}") from e
+    finally:
+        close = getattr(getattr(content, 'response', None), 'close', None)
+        if close is not None:
+            close()
+
+
+def image_route() -> Route:
+    """
+    画像の質問に使うルート（ルーティング有効時は大きいモデルのルート）
+    """
+    if model_router is None:
+        return DEFAULT_ROUTE
+    return model_router.routes['large']
+
+
+def reply_with_stream(reply_token: Optional[str], user_id: str, user_message: str) -> None:
+    """
+    Claudeの応答をストリーミングで受け取り、最初のチャンクを返信、残りをプッシュメッセージで送信
+    各チャンクはsend_textと同じくREPLY_MESSAGE_CHARS以内の吹き出しに分けて送信する
+    """
+    chunker = SentenceChunker(min_chars=STREAM_FIRST_CHUNK_CHARS, max_chars=REPLY_BUDGET_CHARS)
+    replied = False
+    pending = ''
+    response_parts = []
+    start = None
+
+    def deliver(text: str) -> None:
+        nonlocal replied
+        send_text(reply_token if not replied else None, user_id, text)
+        replied = True
+
+    def buffer_chunk(chunk: str, threshold: int) -> None:
+        nonlocal pending
+        # 1回の送信が5通の吹き出しに収まるよう、REPLY_BUDGET_CHARSを超える前に送信する
+        if pending and len(pending) + len(chunk) > REPLY_BUDGET_CHARS:
+            deliver(pending)
+            pending = ''
+        pending += chunk
+        if len(pending) >= threshold:
+            deliver(pending)
+            pending = ''
+
+    try:
+        messages = build_messages(user_message, user_id)
+        cacheable = response_cache is not None and len(messages) == 1
+        cached = response_cache.get(channel_key(user_message)) if cacheable else None
         
-    except anthropic.APIError as e:
-        logger.error(f"Claude APIエラー: {str(e)}")
-        return "APIエラーが発生しました。しばらくしてから再度お試しください。"
+        if cached is not None:
+            response_parts.append(cached)
+            for chunk in chunker.feed(cached) + chunker.flush():
+                buffer_chunk(chunk, REPLY_BUDGET_CHARS)
+        else:
+            route = select_route(user_message)
+            start = time.perf_counter()
+            deadline = claude_deadline()
+            with closing(stream_claude_response(messages, user_id, route)) as stream:
+                for text in stream:
+                    if not response_parts:
+                        tracer.record('ClaudeTimeToFirstToken', (time.perf_counter() - start) * 1000)
+                    response_parts.append(text)
+                    for chunk in chunker.feed(text):
+                        # 最初のチャンクは即座に返信し、以降はある程度まとめてプッシュする
+                        buffer_chunk(chunk, STREAM_PUSH_CHARS if replied else 0)
+                    if deadline is not None and time.monotonic() >= deadline:
+                        # 期限を過ぎたら生成を打ち切る（closingでストリームを閉じる）
+                        raise DeadlineExceeded("Claude API stream abandoned at the deadline")
+            for chunk in chunker.flush():
+                buffer_chunk(chunk, STREAM_PUSH_CHARS)
+            tracer.record('ClaudeLatency', (time.perf_counter() - start) * 1000)
+            if cacheable:
+                response_cache.set(channel_key(user_message), ''.join(response_parts), time.perf_counter() - start)
         
+        remember_exchange(user_id, user_message, ''.join(response_parts))
+    except Exception as e:
+        if start is not None and not isinstance(e, (CircuitOpen, DeadlineExceededBeforeCall)):
+            record_claude_error(user_id, route.model, (time.perf_counter() - start) * 1000)
+        if (is_deadline_error(e) or isinstance(e, CircuitOpen)) and not response_parts:
+            message = degraded_response(user_message, e)
+        else:
+            message = claude_error_message(e)
+        buffer_chunk(('\n\n' if pending else '') + message, STREAM_PUSH_CHARS)
+
+    if pending.strip():
+        deliver(pending)
+
+
+def stream_claude_response(messages: List[Dict[str, str]], user_id: Optional[str] = None,
+                           route: Optional[Route] = None) -> Iterator[str]:
+    """
+    Claude APIのストリーミングでレスポンスのテキスト断片を取得
+    最初の断片を受け取る前に遅延・レート制限で失敗した場合はフォールバックモデルで再実行する
+    """
+    route = route or DEFAULT_ROUTE
+
+    def open_stream(model: str, timeout: Optional[float]) -> Iterator[str]:
+        start = time.perf_counter()
+        with get_claude_client().messages.stream(
+            model=model,
+            max_tokens=route.max_tokens,
+            temperature=0.7,
+            system=system_prompt(route.max_tokens),
+            messages=messages,
+            **timeout_kwargs(timeout)
+        ) as stream:
+            for text in stream.text_stream:
+                yield text
+            record_usage(stream.get_final_message().usage, route, (time.perf_counter() - start) * 1000,
+                         model != route.model, user_id, model)
+
+    def governed_stream(model: str, stream_user_id: Optional[str], deadline_seconds: Optional[float]) -> Iterator[str]:
+        deadline = call_deadline(deadline_seconds)
+        if claude_governor is None:
+            return guarded_stream(lambda: open_stream(model, remaining(deadline)))
+        return guarded_stream(
+            lambda: claude_governor.stream(lambda timeout: open_stream(model, timeout), stream_user_id, deadline)
+        )
+
+    started = False
+    try:
+        for text in governed_stream(route.model, user_id, route.deadline_seconds):
+            started = True
+            yield text
+    except Exception as e:
+        if started or not route.fallback_model or not should_fall_back(e):
+            raise
+        log_fallback(route, e)
+        # ユーザーごとの上限は最初の呼び出しで判定済みのため、フォールバックでは数えない
+        yield from governed_stream(route.fallback_model, None, None)
+
+
+def send_text(reply_token: Optional[str], user_id: Optional[str], text: str) -> str:
+    """
+    テキストを文単位で複数の吹き出しに分け、5通までは返信、残りはプッシュで送信
+    返信トークンがない場合はすべてプッシュで送信
+    送信結果（一部でも再送キュー・dead letterに保存した場合はその結果）を返す
+    """
+    from linebot.models import TextSendMessage
+
+    bubbles = [TextSendMessage(text=bubble) for bubble in pack_messages(text, REPLY_MESSAGE_CHARS)]
+    statuses = []
+    overflow = bubbles
+    if reply_token and bubbles:
+        statuses.append(send_reply(reply_token, bubbles[:LINE_MAX_MESSAGES], user_id))
+        overflow = bubbles[LINE_MAX_MESSAGES:]
+
+    if overflow and not user_id:
+        logger.warning("送信先のユーザーIDがないため、%d通のメッセージを送信できません", len(overflow))
+        return DELIVERY_DEAD_LETTERED
+    for i in range(0, len(overflow), LINE_MAX_MESSAGES):
+        statuses.append(send_push(user_id, overflow[i:i + LINE_MAX_MESSAGES]))
+    return worst_delivery_status(statuses)
+
+
+def worst_delivery_status(statuses: List[str]) -> str:
+    """
+    複数の送信結果のうち、最も配信から遠い結果を返す
+    """
+    for status in (DELIVERY_DEAD_LETTERED, DELIVERY_QUEUED):
+        if status in statuses:
+            return status
+    return DELIVERY_SENT
+
+
+def send_reply(reply_token: str, messages: Any, user_id: Optional[str] = None) -> str:
+    """
+    LINEの返信APIを呼び出す（所要時間を記録）
+    返信トークンの期限切れ・一時的な失敗の場合は、user_idがあればプッシュで送信する
+    """
+    try:
+        with tracer.span('LineReplyLatency'):
+            get_line_bot_api().reply_message(reply_token, messages, timeout=line_timeout())
+    except Exception as e:
+        if not user_id or not (is_invalid_reply_token(e) or is_retryable_line_error(e)):
+            raise
+        logger.warning(f"返信に失敗したためプッシュで送信: {str(e)}")
+        tracer.record('ReplyFallbackToPush', 1, COUNT)
+        return send_push(user_id, messages)
+    return DELIVERY_SENT
+
+
+def send_push(to: str, messages: Any) -> str:
+    """
+    LINEのプッシュAPIを呼び出す（所要時間を記録）
+    失敗した場合は再送キューに保存し（再送しても成功しない失敗はdead letterに保存）、ハンドラーを待たせない
+    送信結果（DELIVERY_SENT・DELIVERY_QUEUED・DELIVERY_DEAD_LETTERED）を返す
+    """
+    retry_key = str(uuid.uuid4())
+    try:
+        push_once(to, messages, retry_key)
+        return DELIVERY_SENT
+    except Exception as e:
+        if delivery_queue is None:
+            raise
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        payload = [message.as_json_dict() for message in messages]
+        if is_retryable_line_error(e):
+            logger.warning(f"プッシュに失敗したため再送キューに保存: {str(e)}")
+            tracer.record('DeliveryQueued', 1, COUNT)
+            delivery_queue.enqueue(to, payload, retry_key, str(e), channel=current_destination())
+            return DELIVERY_QUEUED
+        logger.error(f"プッシュに失敗したためdead letterに保存: {str(e)}")
+        tracer.record('DeliveryDeadLettered', 1, COUNT)
+        delivery_queue.dead_letter(to, payload, retry_key, str(e), channel=current_destination())
+        return DELIVERY_DEAD_LETTERED
+
+
+def push_once(to: str, messages: Any, retry_key: str) -> None:
+    """
+    リトライキー付きでプッシュAPIを1回呼び出す（同じキーで受理済みの場合は送信済みとみなす）
+    """
+    try:
+        with tracer.span('LinePushLatency'):
+            get_line_bot_api().push_message(to, messages, retry_key=retry_key, timeout=line_timeout())
+    except Exception as e:
+        if line_error_status(e) != 409:
+            raise
+        logger.info("リトライキー%sのプッシュは受理済み", retry_key)
+
+
+def push_queued(to: str, messages: Any, retry_key: str, destination: Optional[str]) -> None:
+    """
+    再送キューのメッセージを保存時のチャネルからプッシュする
+    """
+    channel = channel_for(destination)
+    if destination and channel is None:
+        raise ValueError(f"Channel {destination} is no longer configured")
+    with channel_scope(channel):
+        push_once(to, messages, retry_key)
+
+
+def current_destination() -> Optional[str]:
+    channel = current_channel()
+    return channel.destination if channel is not None else None
+
+
+def retry_deliveries() -> Dict[str, int]:
+    """
+    再送キューのうち再送時刻を過ぎたメッセージを送信し、結果ごとの件数を返す
+    """
+    if delivery_queue is None:
+        return {}
+    try:
+        result = delivery_queue.retry_due(
+            push_queued, is_retryable_line_error, DELIVERY_RETRY_BATCH_SIZE, expired=delivery_time_exhausted
+        )
     except Exception as e:
-        logger.error(f"Claude API呼び出し中に予期しないエラーが発生: {str(e)}")
-        return "予期しないエラーが発生しました。"
\ No newline at end of file
+        logger.error(f"メッセージの再送中にエラーが発生: {str(e)}")
+        return {}
+    for name, count in (('DeliveryRetried', result['delivered']), ('DeliveryRetrying', result['retrying']),
+                        ('DeliveryDeadLettered', result['dead_lettered']), ('DeliveryDeferred', result['deferred'])):
+        if count:
+            tracer.record(name, count, COUNT)
+    return result
+
+
+def delivery_time_exhausted() -> bool:
+    """
+    呼び出しの残り時間が、プッシュ送信1回分の最短のタイムアウトに満たないかどうか
+    """
+    left = remaining()
+    return left is not None and left < LINE_MIN_TIMEOUT_SECONDS
+
+
+def retry_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    再送キューを処理する定期実行用ハンドラー（EventBridgeのスケジュールなどから呼び出す）
+    """
+    tracer.start()
+    start = time.perf_counter()
+
+    with deadline_scope(lambda_deadline(context, DEADLINE_SAFETY_MARGIN_SECONDS)):
+        result = retry_deliveries()
+
+    tracer.record('InvocationLatency', (time.perf_counter() - start) * 1000)
+    flush_metrics()
+
+    return result
+
+
+def line_timeout() -> Optional[float]:
+    """
+    処理の期限に合わせたLINE API呼び出しのタイムアウト（期限がない場合はSDKのデフォルト）
+    """
+    left = remaining()
+    if left is None:
+        return None
+    return max(LINE_MIN_TIMEOUT_SECONDS, min(LINE_TIMEOUT_SECONDS, left))
+
+
+def record_usage(usage: Any, route: Route, latency_ms: float, fell_back: bool = False,
+                 user_id: Optional[str] = None, model: Optional[str] = None) -> None:
+    """
+    Claude APIのレスポンスのトークン使用量を記録し、ルール調整用にルートごとの値をログに出力
+    """
+    if usage_accountant is not None:
+        usage_accountant.record(
+            user_id, model or route.model, usage.input_tokens, usage.output_tokens, latency_ms
+        )
+    tracer.record('ClaudeInputTokens', usage.input_tokens, COUNT)
+    tracer.record('ClaudeOutputTokens', usage.output_tokens, COUNT)
+    logger.info(
+        "Claude応答: route=%s fallback=%s latency_ms=%.0f input_tokens=%d output_tokens=%d",
+        route.name, fell_back, latency_ms, usage.input_tokens, usage.output_tokens
+    )
+    if model_router is not None:
+        model_router.record(route, latency_ms, usage.input_tokens, usage.output_tokens, fell_back)
+
+
+def record_claude_error(user_id: Optional[str], model: str, latency_ms: float) -> None:
+    """
+    失敗したClaude API呼び出しを利用量の集計に記録
+    """
+    if usage_accountant is not None:
+        usage_accountant.record(user_id, model, latency_ms=latency_ms, error=True)
+
+
+def select_route(user_message: str) -> Route:
+    """
+    メッセージに対応するモデルのルートを選ぶ（ルーティング無効時はDEFAULT_ROUTE）
+    """
+    if model_router is None:
+        return DEFAULT_ROUTE
+    return model_router.route(user_message)
+
+
+def system_prompt(max_chars: int) -> str:
+    """
+    生成量の上限に合わせて回答の長さを指示するシステムプロンプト（日本語は約1文字1トークン）
+    チャネルにsystem_promptが設定されている場合は、アシスタントの説明をそれに置き換える
+    """
+    channel = current_channel()
+    persona = channel.system_prompt if channel is not None and channel.system_prompt else (
+        "あなたはLINEのチャットで回答するアシスタントです。"
+    )
+    return persona + f"回答は{max_chars}文字以内で、途中で途切れないように簡潔にまとめてください。"
+
+
+def channel_key(key: str) -> str:
+    """
+    会話履歴・応答キャッシュなどのキーをチャネルごとに分ける（デフォルトのチャネルはそのまま）
+    """
+    channel = current_channel()
+    return f"{channel.destination}:{key}" if channel is not None else key
+
+
+def call_claude(request: Callable[[str, Optional[float]], Any], route: Route,
+                user_id: Optional[str] = None) -> Tuple[Any, bool]:
+    """
+    ルートのモデルでClaude APIへのリクエストを流量制御の下で実行（requestにはモデル名と残り時間を渡す）
+    ルートの期限超過・レート制限・過負荷の場合はフォールバックモデルで再実行し、(応答, フォールバックしたか)を返す
+    """
+    try:
+        return governed_call(lambda timeout: request(route.model, timeout), user_id, route.deadline_seconds), False
+    except Exception as e:
+        if not route.fallback_model or not should_fall_back(e):
+            raise
+        log_fallback(route, e)
+        # ユーザーごとの上限は最初の呼び出しで判定済みのため、フォールバックでは数えない
+        return governed_call(lambda timeout: request(route.fallback_model, timeout), None, None), True
+
+
+def governed_call(request: Callable[[Optional[float]], Any], user_id: Optional[str],
+                  deadline_seconds: Optional[float]) -> Any:
+    """
+    流量制御が有効であれば流量制御の下で、無効であれば期限までの残り時間をタイムアウトとして実行
+    サーキットブレーカーが開いている場合は呼び出さずにCircuitOpenを送出
+    """
+    deadline = call_deadline(deadline_seconds)
+
+    def call() -> Any:
+        if claude_governor is None:
+            return request(remaining(deadline))
+        return claude_governor.call(request, user_id, deadline)
+
+    if circuit_breaker is None:
+        return call()
+    return circuit_breaker.call(call, is_dependency_failure)
+
+
+def guarded_stream(open_stream: Callable[[], Iterator[str]]) -> Iterator[str]:
+    """
+    ストリーミング呼び出しをサーキットブレーカーの下で実行（最初の断片を受け取った時点で成功として記録）
+    """
+    if circuit_breaker is None:
+        yield from open_stream()
+        return
+    if not circuit_breaker.allow():
+        raise CircuitOpen("Claude API circuit breaker is open")
+
+    start = time.monotonic()
+    recorded = False
+    try:
+        for text in open_stream():
+            if not recorded:
+                circuit_breaker.record_success(time.monotonic() - start)
+                recorded = True
+            yield text
+        if not recorded:
+            circuit_breaker.record_success(time.monotonic() - start)
+            recorded = True
+    except Exception as e:
+        if not recorded:
+            if is_dependency_failure(e):
+                circuit_breaker.record_failure(time.monotonic() - start)
+            else:
+                circuit_breaker.release()
+            recorded = True
+        raise
+    finally:
+        if not recorded:
+            # 最初の断片を受け取る前に呼び出し元がストリームを閉じた
+            circuit_breaker.release()
+
+
+def call_deadline(deadline_seconds: Optional[float]) -> Optional[float]:
+    """
+    ルートの応答期限（秒）と処理全体の期限のうち早い方を返す
+    残り時間がMIN_CLAUDE_SECONDSに満たない場合はClaudeを呼び出さずにDeadlineExceededを送出
+    """
+    own = time.monotonic() + deadline_seconds if deadline_seconds is not None else None
+    deadline = earliest(own, claude_deadline())
+    if deadline is not None and deadline - time.monotonic() < MIN_CLAUDE_SECONDS:
+        raise DeadlineExceededBeforeCall("Not enough time left for a Claude API call")
+    return deadline
+
+
+def claude_deadline() -> Optional[float]:
+    """
+    処理の期限から、応答後の返信に必要な時間を差し引いたClaude呼び出しの期限
+    """
+    deadline = current_deadline()
+    return deadline - LINE_REPLY_RESERVE_SECONDS if deadline is not None else None
+
+
+def is_deadline_error(error: Exception) -> bool:
+    """
+    期限超過・タイムアウトによる失敗かどうか（ストリーミング中の読み取りタイムアウトはhttpxの例外のまま届く）
+    """
+    import anthropic
+    import httpx
+
+    return isinstance(error, (DeadlineExceeded, anthropic.APITimeoutError, httpx.TimeoutException))
+
+
+def is_dependency_failure(error: Exception) -> bool:
+    """
+    Claude API側の不調による失敗かどうか（サーキットブレーカーで数える失敗）
+    ユーザーごとの上限や不正なリクエスト、呼び出し前の同時実行枠の待機・残り時間の不足など、
+    こちら側の理由による失敗は含めない
+    """
+    import anthropic
+
+    if isinstance(error, DeadlineExceededBeforeCall):
+        return False
+    return should_fall_back(error) or isinstance(error, anthropic.APIConnectionError)
+
+
+def degraded_response(user_message: str, error: Exception) -> str:
+    """
+    期限内に応答できない場合やサーキットブレーカーが開いている場合に、
+    キャッシュ済みの応答（履歴を問わず）か定型文を返す
+    """
+    tracer.record('CircuitOpenFallback' if isinstance(error, CircuitOpen) else 'DeadlineFallback', 1, COUNT)
+    cached = response_cache.get(channel_key(user_message)) if response_cache is not None else None
+    if cached is not None:
+        logger.warning(f"Claude APIで応答できないためキャッシュ済みの応答を返信: {str(error)}")
+        return cached
+    return claude_error_message(error)
+
+
+def log_fallback(route: Route, error: Exception) -> None:
+    logger.warning("%sの応答が遅延・制限されたため%sで再実行: %s", route.model, route.fallback_model, str(error))
+
+
+def timeout_kwargs(timeout: Optional[float]) -> Dict[str, float]:
+    """
+    残り時間が決まっている場合のみAnthropic SDKにtimeoutを指定する
+    """
+    return {'timeout': timeout} if timeout is not None else {}
+
+
+def build_messages(user_message: str, user_id: Optional[str] = None, content: Any = None) -> List[Dict[str, Any]]:
+    """
+    トークン予算内の会話履歴に今回のメッセージを加えてmessagesを作成
+    contentを指定した場合は、今回のメッセージの内容としてuser_messageの代わりに使う（画像のブロックなど）
+    """
+    history = []
+    if conversation_store is not None and user_id:
+        history = conversation_store.history(channel_key(user_id), CONVERSATION_TOKEN_BUDGET)
+        # 永続化が途中で失敗した場合などに備え、userのroleが連続しないようにする
+        if history and history[-1]['role'] == 'user':
+            history.pop()
+
+    return history + [
+        {
+            "role": "user",
+            "content": content if content is not None else user_message
+        }
+    ]
+
+
+def remember_exchange(user_id: Optional[str], user_message: str, response_text: str) -> None:
+    """
+    ユーザーの発言とClaudeの応答を会話履歴に追加
+    保存に失敗しても応答は送信済みのため、ログに記録して処理を続ける
+    """
+    if conversation_store is None or not user_id or not response_text:
+        return
+    key = channel_key(user_id)
+    try:
+        conversation_store.append(key, 'user', user_message)
+        conversation_store.append(key, 'assistant', response_text)
+    except Exception as e:
+        logger.error(f"会話履歴の保存中にエラーが発生: {str(e)}")
+
+
+def flush_conversations() -> None:
+    """
+    会話履歴の未反映分を永続化バックエンドに書き込む
+    """
+    if conversation_store is None:
+        return
+    try:
+        conversation_store.flush()
+    except Exception as e:
+        logger.error(f"会話履歴の保存中にエラーが発生: {str(e)}")
+
+
+def flush_usage() -> None:
+    """
+    利用量の集計を出力間隔が経過していれば出力する
+    """
+    if usage_accountant is None:
+        return
+    try:
+        usage_accountant.flush()
+    except Exception as e:
+        logger.error(f"利用量の出力中にエラーが発生: {str(e)}")
+
+
+def flush_metrics() -> None:
+    """
+    呼び出し内のメトリクスを、キャッシュ・重複検出・流量制御・メッセージ結合・モデルルーティング・利用量集計・チャネル・画像の縮小・サーキットブレーカーの状態とあわせて出力
+    """
+    properties = {}
+    if response_cache is not None:
+        properties['ResponseCache'] = response_cache.stats()
+    if event_deduplicator is not None:
+        properties['EventDedup'] = event_deduplicator.stats()
+    if claude_governor is not None:
+        properties['ClaudeGovernor'] = claude_governor.stats()
+    if message_coalescer is not None:
+        properties['MessageCoalescer'] = message_coalescer.stats()
+    if model_router is not None:
+        properties['ModelRouter'] = model_router.stats()
+    if usage_accountant is not None:
+        properties['UsageAccounting'] = usage_accountant.stats()
+    if channel_registry is not None:
+        properties['ChannelRegistry'] = channel_registry.stats()
+    if image_preparer is not None:
+        properties['ImagePreparer'] = image_preparer.stats()
+    if circuit_breaker is not None:
+        properties['CircuitBreaker'] = circuit_breaker.stats()
+        tracer.record('CircuitState', STATE_VALUES[properties['CircuitBreaker']['state']], 'None')
+
+    try:
+        tracer.flush(**properties)
+    except Exception as e:
+        logger.error(f"メトリクスの出力中にエラーが発生: {str(e)}")
+
+
+def claude_error_message(error: Exception) -> str:
+    """
+    Claude API呼び出しの例外をログに記録し、ユーザー向けのメッセージを返す
+    """
+    import anthropic
+
+    if isinstance(error, UserRateLimitExceeded):
+        logger.warning(str(error))
+        return "短時間に多くのメッセージが送信されました。少し時間をおいてから再度お試しください。"
+
+    if isinstance(error, CircuitOpen):
+        logger.warning(str(error))
+        return "ただいまAIの応答が不安定なため、しばらくしてから再度お試しください。"
+
+    if isinstance(error, DeadlineExceeded):
+        logger.error(f"Claude APIの応答待ちが期限を超過: {str(error)}")
+        return "応答の生成に時間がかかっています。しばらくしてから再度お試しください。"
+
+    if isinstance(error, anthropic.RateLimitError):
+        logger.error("Claude APIのレート制限を超過")
+        return "現在リクエストが多いため、しばらくしてから再度お試しください。"
+
+    if isinstance(error, anthropic.APIError):
+        logger.error(f"Claude APIエラー: {str(error)}")
+        return "APIエラーが発生しました。しばらくしてから再度お試しください。"
+
+    logger.error(f"Claude API呼び出し中に予期しないエラーが発生: {str(error)}")
+    return "予期しないエラーが発生しました。"
+
+
+if HTTP_PREWARM:
+    prewarm_connections()
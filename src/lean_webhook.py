@@ -0,0 +1,149 @@
+import base64
+import hashlib
+import hmac
+import json
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# webhookのイベント種別・メッセージ種別に対応するSDKのクラス名（ハンドラーの登録キー）
+EVENT_CLASS_NAMES = {
+    'message': 'MessageEvent',
+    'follow': 'FollowEvent',
+    'unfollow': 'UnfollowEvent',
+    'join': 'JoinEvent',
+    'leave': 'LeaveEvent',
+    'postback': 'PostbackEvent',
+    'beacon': 'BeaconEvent',
+    'accountLink': 'AccountLinkEvent',
+    'memberJoined': 'MemberJoinedEvent',
+    'memberLeft': 'MemberLeftEvent',
+    'things': 'ThingsEvent',
+    'unsend': 'UnsendEvent',
+    'videoPlayComplete': 'VideoPlayCompleteEvent'
+}
+
+MESSAGE_CLASS_NAMES = {
+    'text': 'TextMessage',
+    'image': 'ImageMessage',
+    'video': 'VideoMessage',
+    'audio': 'AudioMessage',
+    'location': 'LocationMessage',
+    'sticker': 'StickerMessage',
+    'file': 'FileMessage'
+}
+
+
+class LeanSource:
+    """
+    イベントの送信元（SDKのSourceUser/SourceGroup/SourceRoomと同じ属性名）
+    """
+
+    __slots__ = ('type', 'user_id', 'group_id', 'room_id')
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.type = data.get('type')
+        self.user_id = data.get('userId')
+        self.group_id = data.get('groupId')
+        self.room_id = data.get('roomId')
+
+
+class LeanMessage:
+    """
+    メッセージの内容（ハンドラーが使うid・type・textのみ）
+    """
+
+    __slots__ = ('id', 'type', 'class_name', 'text')
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.id = data.get('id')
+        self.type = data.get('type')
+        self.class_name = MESSAGE_CLASS_NAMES.get(self.type, 'Message')
+        self.text = data.get('text')
+
+
+class LeanPostback:
+    __slots__ = ('data',)
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data.get('data')
+
+
+class LeanDeliveryContext:
+    __slots__ = ('is_redelivery',)
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.is_redelivery = bool(data.get('isRedelivery', False))
+
+
+class LeanEvent:
+    """
+    webhookイベントのうちハンドラーが使う項目だけを持つレコード
+    属性名はSDKのイベントと同じにしてあるため、ハンドラーはどちらのイベントも同じように扱える
+    """
+
+    __slots__ = (
+        'type', 'class_name', 'mode', 'timestamp', 'source', 'reply_token',
+        'webhook_event_id', 'delivery_context', 'message', 'postback'
+    )
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.type = data.get('type')
+        self.class_name = EVENT_CLASS_NAMES.get(self.type, 'UnknownEvent')
+        self.mode = data.get('mode')
+        self.timestamp = data.get('timestamp')
+        self.reply_token = data.get('replyToken')
+        self.webhook_event_id = data.get('webhookEventId')
+
+        source = data.get('source')
+        self.source = LeanSource(source) if source else None
+        delivery_context = data.get('deliveryContext')
+        self.delivery_context = LeanDeliveryContext(delivery_context) if delivery_context else None
+        message = data.get('message')
+        self.message = LeanMessage(message) if message else None
+        postback = data.get('postback')
+        self.postback = LeanPostback(postback) if postback else None
+
+
+class LeanPayload:
+    """
+    SDKのWebhookPayloadに相当する、destinationとイベントのリスト
+    """
+
+    __slots__ = ('destination', 'events')
+
+    def __init__(self, destination: Optional[str], events: List[LeanEvent]) -> None:
+        self.destination = destination
+        self.events = events
+
+
+def verify_signature(channel_secret: bytes, body: bytes, signature: Optional[str]) -> bool:
+    """
+    生のボディのHMAC-SHA256とX-Line-Signatureを定数時間で比較
+    """
+    if not signature:
+        return False
+    digest = hmac.new(channel_secret, body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode('utf-8'))
+
+
+def parse_payload(body: Union[str, bytes]) -> LeanPayload:
+    """
+    webhookボディを軽量なイベントレコードに変換（orjsonがあれば使う）
+    """
+    body_json = _loads(body)
+    return LeanPayload(
+        body_json.get('destination'),
+        [LeanEvent(event) for event in body_json.get('events', [])]
+    )
+
+
+def handler_name(obj: Any) -> str:
+    """
+    ハンドラーの登録キーとなるクラス名（軽量レコードはSDKの対応するクラス名）
+    """
+    return getattr(obj, 'class_name', None) or obj.__class__.__name__
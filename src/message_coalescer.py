@@ -0,0 +1,71 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class PendingMessages:
+    """
+    まとめて処理するユーザーのメッセージと、最後に受信したメッセージの返信トークン
+    """
+
+    __slots__ = ('texts', 'reply_token', 'started_at', 'updated_at')
+
+    def __init__(self, text: str, reply_token: Optional[str]) -> None:
+        self.texts: List[str] = [text]
+        self.reply_token = reply_token
+        self.started_at = self.updated_at = time.monotonic()
+
+    @property
+    def text(self) -> str:
+        return '\n'.join(self.texts)
+
+
+class MessageCoalescer:
+    """
+    ユーザーごとのデバウンス
+    最初のメッセージを受けた呼び出しが、最後のメッセージからwindow_seconds経過するまで（最大max_wait_seconds）待ち、
+    その間に同じユーザーから届いたメッセージをまとめて1回で処理する
+    """
+
+    def __init__(self, window_seconds: float = 1.0, max_wait_seconds: float = 3.0, max_messages: int = 10) -> None:
+        self.window_seconds = window_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.max_messages = max_messages
+
+        self._pending: Dict[str, PendingMessages] = {}
+        self._condition = threading.Condition()
+        self.batches = 0
+        self.coalesced = 0
+
+    def submit(self, user_id: str, text: str, reply_token: Optional[str]) -> Optional[PendingMessages]:
+        """
+        メッセージを追加し、この呼び出しで処理すべき場合はまとめたメッセージを返す
+        待機中の他の呼び出しにまとめられた場合はNoneを返す
+        """
+        with self._condition:
+            pending = self._pending.get(user_id)
+            if pending is not None and len(pending.texts) < self.max_messages:
+                pending.texts.append(text)
+                pending.reply_token = reply_token
+                pending.updated_at = time.monotonic()
+                self.coalesced += 1
+                self._condition.notify_all()
+                return None
+
+            pending = PendingMessages(text, reply_token)
+            self._pending[user_id] = pending
+            while len(pending.texts) < self.max_messages:
+                wake_at = min(pending.updated_at + self.window_seconds, pending.started_at + self.max_wait_seconds)
+                timeout = wake_at - time.monotonic()
+                if timeout <= 0:
+                    break
+                self._condition.wait(timeout)
+
+            if self._pending.get(user_id) is pending:
+                del self._pending[user_id]
+            self.batches += 1
+            return pending
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            return {'batches': self.batches, 'coalesced': self.coalesced}
@@ -0,0 +1,196 @@
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+# ひらがな・カタカナ・漢字・全角記号
+JAPANESE_CHARS = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+ASCII_LETTERS = re.compile(r'[A-Za-z]')
+
+# 詳しい説明や推論が必要そうな質問のキーワード（大きいモデルに振り分ける）
+DEFAULT_LARGE_KEYWORDS = [
+    '説明', '詳しく', 'なぜ', '理由', '違い', '比較', '手順', '方法', 'コード', 'プログラム',
+    '翻訳', '要約', '計算', '分析', '考えて',
+    'explain', 'why', 'compare', 'difference', 'code', 'translate', 'summarize'
+]
+
+
+def detect_language(text: str) -> str:
+    """
+    テキストの言語を簡易判定（ja / en / other）
+    """
+    if JAPANESE_CHARS.search(text):
+        return 'ja'
+    if ASCII_LETTERS.search(text):
+        return 'en'
+    return 'other'
+
+
+class Route:
+    """
+    振り分け先のモデルと、そのモデルで使う生成量・応答期限（秒）・フォールバックモデル
+    deadline_secondsがNoneの場合は流量制御のデフォルトの期限を使う
+    """
+
+    __slots__ = ('name', 'model', 'max_tokens', 'deadline_seconds', 'fallback_model')
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        max_tokens: int,
+        deadline_seconds: Optional[float],
+        fallback_model: Optional[str] = None
+    ) -> None:
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.deadline_seconds = deadline_seconds
+        self.fallback_model = fallback_model
+
+
+class RoutingRule:
+    """
+    振り分けルール（指定した条件をすべて満たす場合にrouteを選ぶ）
+    条件: min_chars / max_chars（文字数）、language（ja / en / other）、keywords（いずれかを含む）
+    """
+
+    __slots__ = ('route', 'min_chars', 'max_chars', 'language', 'keywords')
+
+    def __init__(
+        self,
+        route: str,
+        min_chars: Optional[int] = None,
+        max_chars: Optional[int] = None,
+        language: Optional[str] = None,
+        keywords: Optional[List[str]] = None
+    ) -> None:
+        self.route = route
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.language = language
+        self.keywords = [keyword.lower() for keyword in keywords or []]
+
+    def matches(self, text: str, language: str) -> bool:
+        if self.min_chars is not None and len(text) < self.min_chars:
+            return False
+        if self.max_chars is not None and len(text) > self.max_chars:
+            return False
+        if self.language is not None and language != self.language:
+            return False
+        if self.keywords:
+            lowered = text.lower()
+            return any(keyword in lowered for keyword in self.keywords)
+        return True
+
+
+class ModelRouter:
+    """
+    メッセージの文字数・言語・キーワードからClaudeのモデル（ルート）を選ぶ
+    ルールは先頭から評価し、最初に一致したルールのルートを使う（一致しなければdefault_route）
+    """
+
+    def __init__(self, routes: Dict[str, Route], rules: List[RoutingRule], default_route: str) -> None:
+        unknown = {rule.route for rule in rules} - set(routes)
+        if default_route not in routes or unknown:
+            raise ValueError(f"Unknown route: {sorted(unknown) or default_route}")
+        self.routes = routes
+        self.rules = rules
+        self.default_route = default_route
+
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def route(self, text: str) -> Route:
+        """
+        テキストに対応するルートを返す
+        """
+        text = text.strip()
+        language = detect_language(text)
+        for rule in self.rules:
+            if rule.matches(text, language):
+                return self.routes[rule.route]
+        return self.routes[self.default_route]
+
+    def record(self, route: Route, latency_ms: float, input_tokens: int, output_tokens: int,
+               fallback: bool = False) -> None:
+        """
+        ルートごとの呼び出し回数・所要時間・トークン数を集計
+        """
+        with self._lock:
+            stats = self._stats.setdefault(route.name, {
+                'calls': 0, 'fallbacks': 0, 'latency_ms': 0.0, 'input_tokens': 0, 'output_tokens': 0
+            })
+            stats['calls'] += 1
+            stats['fallbacks'] += int(fallback)
+            stats['latency_ms'] += latency_ms
+            stats['input_tokens'] += input_tokens
+            stats['output_tokens'] += output_tokens
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        ルートごとの累計値（平均所要時間を含む）
+        """
+        with self._lock:
+            return {
+                name: {
+                    'calls': stats['calls'],
+                    'fallbacks': stats['fallbacks'],
+                    'avg_latency_ms': round(stats['latency_ms'] / stats['calls'], 1),
+                    'input_tokens': stats['input_tokens'],
+                    'output_tokens': stats['output_tokens']
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+def should_fall_back(error: Exception) -> bool:
+    """
+    フォールバックモデルで再実行すべき失敗（期限超過・レート制限・過負荷）かどうか
+    """
+    import anthropic
+    import httpx
+
+    from src.claude_governor import DeadlineExceeded
+
+    timeouts = (DeadlineExceeded, anthropic.APITimeoutError, httpx.TimeoutException)
+    if isinstance(error, timeouts + (anthropic.RateLimitError,)):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code >= 500
+
+
+def create_model_router(max_tokens: int) -> ModelRouter:
+    """
+    環境変数の設定からモデルルーターを作成（max_tokensは各ルートの生成量の上限）
+    """
+    fast_model = os.environ.get('MODEL_FAST', 'claude-3-haiku-20240307')
+    large_model = os.environ.get('MODEL_LARGE', 'claude-3-sonnet-20240229')
+
+    routes = {
+        'fast': Route(
+            name='fast',
+            model=fast_model,
+            max_tokens=min(int(os.environ.get('MODEL_FAST_MAX_TOKENS', '400')), max_tokens),
+            deadline_seconds=float(os.environ.get('MODEL_FAST_DEADLINE_SECONDS', '8')),
+            fallback_model=os.environ.get('MODEL_FAST_FALLBACK') or None
+        ),
+        'large': Route(
+            name='large',
+            model=large_model,
+            max_tokens=min(int(os.environ.get('MODEL_LARGE_MAX_TOKENS', str(max_tokens))), max_tokens),
+            deadline_seconds=float(os.environ.get('MODEL_LARGE_DEADLINE_SECONDS', '15')),
+            fallback_model=os.environ.get('MODEL_LARGE_FALLBACK', fast_model) or None
+        )
+    }
+
+    rules_json = os.environ.get('MODEL_ROUTER_RULES')
+    if rules_json:
+        rules = [RoutingRule(**rule) for rule in json.loads(rules_json)]
+    else:
+        rules = [
+            RoutingRule('large', keywords=DEFAULT_LARGE_KEYWORDS),
+            RoutingRule('fast', max_chars=int(os.environ.get('MODEL_FAST_MAX_CHARS', '40')))
+        ]
+
+    return ModelRouter(routes, rules, os.environ.get('MODEL_DEFAULT_ROUTE', 'large'))
@@ -0,0 +1,186 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger()
+
+TRAILING_PUNCTUATION = re.compile(r'[\s。、．，,.!！?？~〜ー…]+$')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """
+    キャッシュキー用にテキストを正規化（全角半角・大文字小文字・空白・末尾の記号の違いを吸収）
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = WHITESPACE.sub(' ', text).strip()
+    return TRAILING_PUNCTUATION.sub('', text)
+
+
+class SharedCacheBackend:
+    """
+    複数コンテナで共有するキャッシュ層の基底クラス
+    """
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, cost_seconds: float, expires_at: float) -> None:
+        raise NotImplementedError
+
+
+class SQLiteCacheBackend(SharedCacheBackend):
+    """
+    SQLiteを使った共有キャッシュ層（ローカル実行用）
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "cache_key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "cost_seconds REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT response, cost_seconds FROM response_cache "
+                "WHERE cache_key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: str, cost_seconds: float, expires_at: float) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache "
+                "(cache_key, response, cost_seconds, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, cost_seconds, expires_at)
+            )
+
+
+class ResponseCache:
+    """
+    正規化したメッセージをキーにしたClaude応答のキャッシュ
+    メモリ層（ウォームコンテナ内、LRU + TTL）と任意の共有層の2段構成
+    共有層の障害時はキャッシュミスとして扱い（応答の生成を止めない）、エラー件数を記録する
+    """
+
+    def __init__(
+        self,
+        shared: Optional[SharedCacheBackend] = None,
+        ttl_seconds: float = 3600,
+        max_entries: int = 500
+    ) -> None:
+        self.shared = shared
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        # key -> (応答, 生成にかかった秒数, 有効期限)
+        self._entries: "OrderedDict[str, Tuple[str, float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.shared_errors = 0
+        self.saved_seconds = 0.0
+
+    def get(self, message: str) -> Optional[str]:
+        """
+        キャッシュされた応答を返す（なければNone）
+        """
+        key = normalize_text(message)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[1]
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+
+        if self.shared is not None:
+            try:
+                found = self.shared.get(key)
+            except Exception as e:
+                logger.error(f"共有キャッシュの読み込み中にエラーが発生したためキャッシュミスとして扱います: {str(e)}")
+                with self._lock:
+                    self.shared_errors += 1
+                found = None
+            if found is not None:
+                response, cost_seconds = found
+                with self._lock:
+                    self._store(key, response, cost_seconds, now + self.ttl_seconds)
+                    self.shared_hits += 1
+                    self.saved_seconds += cost_seconds
+                return response
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, message: str, response: str, cost_seconds: float = 0.0) -> None:
+        """
+        応答をキャッシュに保存
+        """
+        key = normalize_text(message)
+        expires_at = time.time() + self.ttl_seconds
+
+        with self._lock:
+            self._store(key, response, cost_seconds, expires_at)
+
+        if self.shared is not None:
+            try:
+                self.shared.set(key, response, cost_seconds, expires_at)
+            except Exception as e:
+                logger.error(f"共有キャッシュへの書き込み中にエラーが発生: {str(e)}")
+                with self._lock:
+                    self.shared_errors += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'shared_errors': self.shared_errors,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                'saved_seconds': round(self.saved_seconds, 3),
+                'entries': len(self._entries)
+            }
+
+    def _store(self, key: str, response: str, cost_seconds: float, expires_at: float) -> None:
+        self._entries[key] = (response, cost_seconds, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def create_response_cache() -> ResponseCache:
+    """
+    環境変数の設定からレスポンスキャッシュを作成
+    """
+    shared = None
+    if os.environ.get('RESPONSE_CACHE_BACKEND', 'none') == 'sqlite':
+        shared = SQLiteCacheBackend(os.environ.get('RESPONSE_CACHE_SQLITE_PATH', 'response_cache.db'))
+
+    return ResponseCache(
+        shared=shared,
+        ttl_seconds=float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '3600')),
+        max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '500'))
+    )
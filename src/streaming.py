@@ -0,0 +1,83 @@
+import re
+from typing import List, Optional
+
+# 日本語・英語の文末と改行を区切りとみなす
+SENTENCE_END = re.compile(r'[。！？!?\n]|\.(?=\s)')
+
+
+class SentenceChunker:
+    """
+    ストリーミングで届くテキスト断片を文単位のチャンクにまとめる
+    min_charsに達した時点の最後の文末で区切り、max_charsを超えるチャンクは強制的に分割する
+    """
+
+    def __init__(self, min_chars: int = 40, max_chars: int = 5000) -> None:
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ''
+
+    def feed(self, text: str) -> List[str]:
+        """
+        テキスト断片を追加し、確定したチャンクを返す
+        """
+        self._buffer += text
+        chunks = []
+
+        while len(self._buffer) >= self.min_chars:
+            boundary = self._find_boundary()
+            if boundary is None:
+                if len(self._buffer) < self.max_chars:
+                    break
+                boundary = self.max_chars
+            chunk, self._buffer = self._buffer[:boundary], self._buffer[boundary:]
+            if chunk.strip():
+                chunks.append(chunk)
+
+        return chunks
+
+    def flush(self) -> List[str]:
+        """
+        残りのテキストをチャンクとして返す
+        """
+        rest, self._buffer = self._buffer, ''
+        if not rest.strip():
+            return []
+        return [rest[i:i + self.max_chars] for i in range(0, len(rest), self.max_chars)]
+
+    def _find_boundary(self) -> Optional[int]:
+        for match in SENTENCE_END.finditer(self._buffer, 0, self.max_chars):
+            if match.end() >= self.min_chars:
+                return match.end()
+        return None
+
+
+def pack_messages(text: str, max_chars: int = 5000) -> List[str]:
+    """
+    テキストを文単位に分割し、max_chars以内の吹き出し（メッセージ）に詰める
+    1文がmax_charsを超える場合はその文を強制的に分割する
+    """
+    chunker = SentenceChunker(min_chars=1, max_chars=max_chars)
+    sentences = chunker.feed(text) + chunker.flush()
+
+    messages = []
+    current = ''
+    for sentence in sentences:
+        if current and len(current) + len(sentence) > max_chars:
+            messages.append(current.strip())
+            current = ''
+        current += sentence
+    if current.strip():
+        messages.append(current.strip())
+    return messages
+
+
+def trim_to_sentence(text: str) -> str:
+    """
+    最後の文末より後ろの書きかけの文を取り除く（文末がない場合はそのまま返す）
+    """
+    last_end = None
+    for match in SENTENCE_END.finditer(text):
+        last_end = match.end()
+    if not last_end:
+        return text
+    return text[:last_end].rstrip()
@@ -0,0 +1,150 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+MILLISECONDS = 'Milliseconds'
+COUNT = 'Count'
+
+# EMFで1メトリクスあたりに出力できる値の上限
+MAX_VALUES_PER_METRIC = 100
+
+
+class _Metrics:
+    """
+    1回の呼び出しで記録したメトリクスの値と単位
+    """
+
+    __slots__ = ('values', 'units')
+
+    def __init__(self) -> None:
+        self.values: Dict[str, List[float]] = {}
+        self.units: Dict[str, str] = {}
+
+
+class Tracer:
+    """
+    1回の呼び出し内の区間ごとの所要時間と件数を集計し、
+    CloudWatch Embedded Metric Format（EMF）のJSON 1行として出力する
+    集計はstart()を呼んだコンテキストごとに分かれるため、複数スレッドで同時に処理する呼び出しも混ざらない
+    （start()の後にcopy_context()で引き継いだスレッドの記録は、同じ呼び出しに集計される）
+    """
+
+    def __init__(
+        self,
+        namespace: str = 'LineBot',
+        service: str = 'line-bot',
+        enabled: bool = True,
+        stream: Optional[TextIO] = None
+    ) -> None:
+        self.namespace = namespace
+        self.service = service
+        self.enabled = enabled
+        self._stream = stream
+        self._lock = threading.Lock()
+        # start()を呼んでいないコンテキストで記録した値の集計先
+        self._default = _Metrics()
+        self._current: ContextVar[Optional[_Metrics]] = ContextVar(f'tracer_{id(self)}', default=None)
+
+    def start(self) -> None:
+        """
+        呼び出しの開始時に、現在のコンテキストの集計を新しく始める
+        """
+        self._current.set(_Metrics())
+
+    def _metrics(self) -> _Metrics:
+        metrics = self._current.get()
+        return metrics if metrics is not None else self._default
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        with文の区間の所要時間をミリ秒で記録
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name: str, value: float, unit: str = MILLISECONDS) -> None:
+        """
+        メトリクスの値を記録（同じ名前の値は呼び出し内で配列として保持）
+        """
+        if not self.enabled:
+            return
+        metrics = self._metrics()
+        with self._lock:
+            values = metrics.values.setdefault(name, [])
+            if len(values) < MAX_VALUES_PER_METRIC:
+                values.append(round(value, 3) if unit == MILLISECONDS else value)
+            metrics.units[name] = unit
+
+    def flush(self, **properties: Any) -> None:
+        """
+        現在のコンテキストで集計したメトリクスをEMF形式で出力してリセット（propertiesは検索用の付加情報）
+        """
+        if not self.enabled:
+            return
+        metrics = self._metrics()
+        with self._lock:
+            values, units = metrics.values, metrics.units
+            metrics.values, metrics.units = {}, {}
+
+        if not values:
+            return
+
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service']],
+                    'Metrics': [{'Name': name, 'Unit': units[name]} for name in values]
+                }]
+            },
+            'Service': self.service
+        }
+        record.update(properties)
+        for name, metric_values in values.items():
+            record[name] = metric_values[0] if len(metric_values) == 1 else metric_values
+
+        stream = self._stream or sys.stdout
+        stream.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        stream.flush()
+
+
+class TruncatedJson:
+    """
+    ログ出力時にのみJSON化し、指定文字数で切り詰める（ログが出力されない場合は変換しない）
+    """
+
+    __slots__ = ('value', 'max_chars')
+
+    def __init__(self, value: Any, max_chars: int = 2000) -> None:
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        text = json.dumps(self.value, ensure_ascii=False, default=str)
+        if len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}...(truncated {len(text) - self.max_chars} chars)"
+        return text
+
+
+def create_tracer() -> Tracer:
+    """
+    環境変数の設定からトレーサーを作成
+    """
+    return Tracer(
+        namespace=os.environ.get('METRICS_NAMESPACE', 'LineBot'),
+        service=os.environ.get('METRICS_SERVICE', os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'line-bot')),
+        enabled=os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    )
@@ -0,0 +1,227 @@
+import bisect
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+# レイテンシのヒストグラムの上限値（ミリ秒）、最後のバケットはそれより大きい値
+LATENCY_BUCKETS_MS = (50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 30000, 60000)
+
+UsageKey = Tuple[int, str, str]
+
+
+class UsageCounters:
+    """
+    1時間・ユーザー・モデルごとの集計値（トークン数・レイテンシ・エラー数）
+    レイテンシは個々の値を保持せず、固定バケットのヒストグラムで数える
+    """
+
+    __slots__ = ('calls', 'errors', 'input_tokens', 'output_tokens', 'latency_ms_total', 'latency_ms_max', 'latency_buckets')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.latency_ms_total = 0.0
+        self.latency_ms_max = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add_latency(self, latency_ms: float) -> None:
+        self.latency_ms_total += latency_ms
+        self.latency_ms_max = max(self.latency_ms_max, latency_ms)
+        self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+
+    def merge(self, other: 'UsageCounters') -> None:
+        """
+        別の集計値を加算（出力に失敗した集計値を戻す）
+        """
+        self.calls += other.calls
+        self.errors += other.errors
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.latency_ms_total += other.latency_ms_total
+        self.latency_ms_max = max(self.latency_ms_max, other.latency_ms_max)
+        self.latency_buckets = [a + b for a, b in zip(self.latency_buckets, other.latency_buckets)]
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        ヒストグラムからパーセンタイルを推定（該当バケットの上限値、最後のバケットは最大値）
+        """
+        count = sum(self.latency_buckets)
+        if count == 0:
+            return None
+        rank = max(1, int(count * p + 0.5))
+        seen = 0
+        for index, bucket_count in enumerate(self.latency_buckets):
+            seen += bucket_count
+            if seen >= rank:
+                if index < len(LATENCY_BUCKETS_MS):
+                    return round(min(float(LATENCY_BUCKETS_MS[index]), self.latency_ms_max), 1)
+                break
+        return round(self.latency_ms_max, 1)
+
+
+class UsageSink:
+    """
+    集計結果の出力先の基底クラス
+    """
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+
+class StdoutUsageSink(UsageSink):
+    """
+    JSON Linesで標準出力に出力（CloudWatch Logs Insightsなどで集計する）
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        self._stream = stream
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        stream = self._stream or sys.stdout
+        stream.write(''.join(
+            json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records
+        ))
+        stream.flush()
+
+
+class SQLiteUsageSink(UsageSink):
+    """
+    SQLiteのusage_recordsテーブルに追記（ローカル実行用）
+    """
+
+    COLUMNS = (
+        'hour', 'user_id', 'model', 'calls', 'errors', 'input_tokens', 'output_tokens',
+        'latency_ms_total', 'latency_ms_p50', 'latency_ms_p95', 'latency_ms_max', 'flushed_at'
+    )
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage_records ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, hour TEXT NOT NULL, user_id TEXT NOT NULL, "
+                "model TEXT NOT NULL, calls INTEGER NOT NULL, errors INTEGER NOT NULL, "
+                "input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, "
+                "latency_ms_total REAL NOT NULL, latency_ms_p50 REAL, latency_ms_p95 REAL, "
+                "latency_ms_max REAL, flushed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_usage_records_hour ON usage_records (hour, user_id)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=30)
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT INTO usage_records ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in self.COLUMNS)})",
+                [tuple(record.get(column) for column in self.COLUMNS) for record in records]
+            )
+
+
+class UsageAccountant:
+    """
+    ユーザー・モデルごとのClaude API利用量をプロセス内で集計し、まとめて出力する
+    recordはカウンターの加算のみで、出力はflushでflush_interval_secondsごと（0なら毎回）に行う
+    """
+
+    def __init__(self, sink: UsageSink, flush_interval_seconds: float = 0.0) -> None:
+        self.sink = sink
+        self.flush_interval_seconds = flush_interval_seconds
+
+        self._lock = threading.Lock()
+        self._counters: Dict[UsageKey, UsageCounters] = {}
+        self._last_flush = time.monotonic()
+        self.flushed_records = 0
+
+    def record(self, user_id: Optional[str], model: str, input_tokens: int = 0, output_tokens: int = 0,
+               latency_ms: Optional[float] = None, error: bool = False) -> None:
+        """
+        1回のClaude API呼び出しの結果を加算
+        """
+        key = (int(time.time()) // 3600 * 3600, user_id or '-', model)
+        with self._lock:
+            counters = self._counters.get(key)
+            if counters is None:
+                counters = self._counters[key] = UsageCounters()
+            counters.calls += 1
+            counters.input_tokens += input_tokens
+            counters.output_tokens += output_tokens
+            if error:
+                counters.errors += 1
+            if latency_ms is not None:
+                counters.add_latency(latency_ms)
+
+    def flush(self, force: bool = False) -> int:
+        """
+        前回の出力からflush_interval_seconds経過していれば（forceの場合は常に）集計結果を出力してリセット
+        出力に失敗した場合は集計値を戻して例外を送出し、次回のflushで再度出力する
+        出力したレコード数を返す
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not self._counters or (not force and now - self._last_flush < self.flush_interval_seconds):
+                return 0
+            counters, self._counters = self._counters, {}
+            self._last_flush = now
+
+        records = [self._to_record(key, value) for key, value in counters.items()]
+        try:
+            self.sink.write(records)
+        except Exception:
+            with self._lock:
+                for key, value in counters.items():
+                    current = self._counters.get(key)
+                    if current is None:
+                        self._counters[key] = value
+                    else:
+                        current.merge(value)
+            raise
+        self.flushed_records += len(records)
+        return len(records)
+
+    @staticmethod
+    def _to_record(key: UsageKey, counters: UsageCounters) -> Dict[str, Any]:
+        hour, user_id, model = key
+        return {
+            'type': 'usage',
+            'hour': time.strftime('%Y-%m-%dT%H:00:00Z', time.gmtime(hour)),
+            'user_id': user_id,
+            'model': model,
+            'calls': counters.calls,
+            'errors': counters.errors,
+            'input_tokens': counters.input_tokens,
+            'output_tokens': counters.output_tokens,
+            'latency_ms_total': round(counters.latency_ms_total, 1),
+            'latency_ms_p50': counters.percentile(0.5),
+            'latency_ms_p95': counters.percentile(0.95),
+            'latency_ms_max': round(counters.latency_ms_max, 1),
+            'flushed_at': time.time()
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'pending_keys': len(self._counters), 'flushed_records': self.flushed_records}
+
+
+def create_usage_accountant() -> UsageAccountant:
+    """
+    環境変数の設定から利用量の集計を作成
+    """
+    if os.environ.get('USAGE_SINK', 'stdout') == 'sqlite':
+        sink: UsageSink = SQLiteUsageSink(os.environ.get('USAGE_SQLITE_PATH', 'usage.db'))
+    else:
+        sink = StdoutUsageSink()
+
+    return UsageAccountant(
+        sink,
+        flush_interval_seconds=float(os.environ.get('USAGE_FLUSH_INTERVAL_SECONDS', '0'))
+    )
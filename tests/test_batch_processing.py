@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Message Batches APIによる一括処理のテスト
+"""
+
+import os
+import sys
+import json
+import threading
+from types import SimpleNamespace
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.batch_processing import BatchItem, BatchProcessor, BatchResult, failed_record, read_items
+from src.delivery_queue import DELIVERY_DEAD_LETTERED, DELIVERY_QUEUED, DELIVERY_SENT
+
+
+class FakeBatches:
+    """作成したリクエストに即座に応答するMessage Batches APIのスタブ"""
+
+    def __init__(self, failing_ids=(), polls_until_ended=2):
+        self.failing_ids = set(failing_ids)
+        self.polls_until_ended = polls_until_ended
+        self.created = []
+        self.polls = 0
+
+    def create(self, requests):
+        self.created.append(requests)
+        return SimpleNamespace(id=f"batch-{len(self.created)}")
+
+    def retrieve(self, batch_id):
+        self.polls += 1
+        status = 'ended' if self.polls >= self.polls_until_ended else 'in_progress'
+        counts = SimpleNamespace(succeeded=0, errored=0, expired=0, canceled=0)
+        return SimpleNamespace(id=batch_id, processing_status=status, request_counts=counts)
+
+    def results(self, batch_id):
+        requests = self.created[int(batch_id.split('-')[1]) - 1]
+        # 結果の順序は送信順と一致しない
+        for request in reversed(requests):
+            if request['custom_id'] in self.failing_ids:
+                error = SimpleNamespace(error=SimpleNamespace(message='overloaded'))
+                result = SimpleNamespace(type='errored', error=error)
+            else:
+                text = f"回答: {request['params']['messages'][-1]['content']}"
+                message = SimpleNamespace(
+                    content=[SimpleNamespace(type='text', text=text)],
+                    usage=SimpleNamespace(input_tokens=1, output_tokens=2),
+                    model=request['params']['model'],
+                    stop_reason='end_turn'
+                )
+                result = SimpleNamespace(type='succeeded', message=message)
+            yield SimpleNamespace(custom_id=request['custom_id'], result=result)
+
+
+def build_params(item):
+    return {'model': 'haiku', 'max_tokens': 100, 'messages': [{'role': 'user', 'content': item.text}]}
+
+
+def create_processor(batches, **kwargs):
+    client = SimpleNamespace(messages=SimpleNamespace(batches=batches))
+    return BatchProcessor(client, build_params, poll_interval_seconds=0, **kwargs)
+
+
+def test_read_items_accepts_each_line_format():
+    """webhookボディ・キューのレコード・イベント・質問の各形式からテキストを取り出すこと"""
+    message = {"type": "message", "source": {"type": "user", "userId": "U2"},
+               "message": {"type": "text", "id": "1", "text": "障害中の質問"}}
+    lines = [
+        json.dumps({"user_id": "U1", "text": "夜間の質問"}),
+        json.dumps({"destination": "Ud", "events": [message, {"type": "follow", "source": {"userId": "U3"}}]}),
+        "",
+        json.dumps({"destination": "Ud", "event": message}),
+        json.dumps(message)
+    ]
+
+    items = list(read_items(lines))
+
+    assert [(item.user_id, item.text) for item in items] == [
+        ("U1", "夜間の質問"), ("U2", "障害中の質問"), ("U2", "障害中の質問"), ("U2", "障害中の質問")
+    ]
+    assert len({item.custom_id for item in items}) == 4
+    assert [item.destination for item in items] == [None, "Ud", "Ud", None]
+
+
+def test_read_items_skips_malformed_lines():
+    """読み込めない行は読み飛ばし、前後の行は処理すること"""
+    lines = [
+        json.dumps({"user_id": "U1", "text": "前"}),
+        "{not json",
+        json.dumps(["not", "an", "object"]),
+        json.dumps({"events": [{"type": "message", "message": "broken"}]}),
+        json.dumps({"user_id": "U2", "text": "後", "webhookEventId": "evt-1"})
+    ]
+
+    items = list(read_items(lines))
+
+    assert [(item.user_id, item.text, item.event_id) for item in items] == [("U1", "前", None), ("U2", "後", "evt-1")]
+    assert [item.custom_id for item in items] == ["item-0", "item-1"]
+
+
+def test_failed_records_are_replayed_on_the_same_channel():
+    """再実行用に書き出した失敗レコードを読み込むと、同じチャネルの質問になること"""
+    result = BatchResult(BatchItem("item-0", "U1", "夜間の質問", "Ud"), error="overloaded")
+
+    items = list(read_items([json.dumps(failed_record(result), ensure_ascii=False)]))
+
+    assert [(item.user_id, item.text, item.destination) for item in items] == [("U1", "夜間の質問", "Ud")]
+
+
+def test_run_submits_one_batch_and_delivers_in_order_per_user():
+    """1つのバッチで送信し、終了を待ってから成功した結果をユーザーごとに送信順で配信すること"""
+    items = list(read_items([
+        json.dumps({"user_id": user_id, "text": text})
+        for user_id, text in [("U1", "a"), ("U2", "b"), ("U1", "c"), ("U2", "d")]
+    ]))
+    batches = FakeBatches(failing_ids={items[3].custom_id}, polls_until_ended=3)
+    delivered = []
+    lock = threading.Lock()
+
+    def send(result):
+        with lock:
+            delivered.append((result.item.user_id, result.text))
+
+    summary = create_processor(batches, delivery_concurrency=2).run(items, send)
+
+    assert len(batches.created) == 1 and len(batches.created[0]) == 4
+    assert batches.polls == 3
+    assert [text for user_id, text in delivered if user_id == "U1"] == ["回答: a", "回答: c"]
+    assert [text for user_id, text in delivered if user_id == "U2"] == ["回答: b"]
+    assert (summary['succeeded'], summary['delivered']) == (3, 3)
+    assert [(result.item.text, result.error) for result in summary['failed']] == [("d", "overloaded")]
+
+
+def test_large_inputs_are_split_into_multiple_batches():
+    """max_requestsを超える件数は複数のバッチに分けて送信すること"""
+    items = list(read_items([json.dumps({"user_id": f"U{i}", "text": str(i)}) for i in range(5)]))
+    batches = FakeBatches(polls_until_ended=1)
+
+    summary = create_processor(batches, max_requests=2).run(items, lambda result: None)
+
+    assert [len(requests) for requests in batches.created] == [2, 2, 1]
+    assert summary['delivered'] == 5
+
+
+def test_queued_pushes_are_not_counted_as_delivered():
+    """再送キュー・dead letterに保存したプッシュは配信済みに数えず、別に集計すること"""
+    items = list(read_items([json.dumps({"user_id": f"U{i}", "text": str(i)}) for i in range(3)]))
+    statuses = {"0": DELIVERY_SENT, "1": DELIVERY_QUEUED, "2": DELIVERY_DEAD_LETTERED}
+
+    summary = create_processor(FakeBatches(polls_until_ended=1)).run(items, lambda result: statuses[result.item.text])
+
+    assert (summary['delivered'], summary['queued'], summary['dead_lettered']) == (1, 1, 1)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+複数チャネルの登録情報のテスト
+"""
+
+import os
+import sys
+import json
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.channel_registry import (
+    Channel, ChannelClients, ChannelRegistry, channel_scope, current_channel, load_channels
+)
+
+
+def create_registry(destinations, max_clients=16):
+    created = []
+
+    def factory(channel):
+        created.append(channel.destination)
+        return ChannelClients(f"api-{channel.destination}", f"parser-{channel.destination}")
+
+    channels = [Channel(destination, destination, 'secret', 'token') for destination in destinations]
+    return ChannelRegistry(channels, factory, max_clients=max_clients), created
+
+
+def test_load_channels_reads_secrets_from_environment(monkeypatch, tmp_path):
+    """JSON・JSONファイルから読み込み、シークレットは値または環境変数名で指定できること"""
+    monkeypatch.setenv('SHOP_SECRET', 'shop-secret')
+    monkeypatch.setenv('SHOP_TOKEN', 'shop-token')
+    config = json.dumps([
+        {"destination": "Ushop", "name": "shop", "channel_secret_env": "SHOP_SECRET",
+         "access_token_env": "SHOP_TOKEN", "system_prompt": "あなたはショップの店員です。"},
+        {"destination": "Usupport", "channel_secret": "support-secret", "access_token": "support-token"}
+    ])
+    path = tmp_path / 'channels.json'
+    path.write_text(config, encoding='utf-8')
+
+    for channels in (load_channels(config), load_channels(str(path))):
+        shop, support = channels
+        assert (shop.name, shop.channel_secret, shop.access_token) == ('shop', 'shop-secret', 'shop-token')
+        assert shop.system_prompt == "あなたはショップの店員です。"
+        assert (support.name, support.channel_secret, support.system_prompt) == ('Usupport', 'support-secret', None)
+
+
+def test_load_channels_rejects_missing_secret():
+    """シークレットが解決できないチャネルはエラーにすること"""
+    with pytest.raises(ValueError):
+        load_channels(json.dumps([{"destination": "U1", "channel_secret_env": "UNDEFINED_SECRET",
+                                   "access_token": "token"}]))
+
+
+def test_clients_are_created_lazily_and_reused():
+    """クライアントは初回利用時に1回だけ生成し、未登録のdestinationはNoneを返すこと"""
+    registry, created = create_registry(['U1', 'U2'])
+
+    assert created == []
+    channel = registry.resolve('U1')
+    assert registry.clients(channel).line_bot_api == 'api-U1'
+    assert registry.clients(channel).parser == 'parser-U1'
+    assert created == ['U1']
+    assert registry.resolve('Uunknown') is None
+    assert registry.resolve(None) is None
+
+
+def test_least_recently_used_clients_are_evicted():
+    """上限を超えたら最も長く使われていないチャネルのクライアントを破棄すること"""
+    registry, created = create_registry(['U1', 'U2', 'U3'], max_clients=2)
+
+    registry.clients(registry.resolve('U1'))
+    registry.clients(registry.resolve('U2'))
+    registry.clients(registry.resolve('U1'))
+    registry.clients(registry.resolve('U3'))
+    registry.clients(registry.resolve('U1'))
+    registry.clients(registry.resolve('U2'))
+
+    assert created == ['U1', 'U2', 'U3', 'U2']
+    assert registry.stats() == {'channels': 3, 'cached_clients': 2, 'created': 4, 'evictions': 2}
+
+
+def test_channel_scope_sets_current_channel():
+    """with文の中だけ処理中のチャネルが設定されること"""
+    channel = Channel('U1', 'one', 'secret', 'token')
+
+    assert current_channel() is None
+    with channel_scope(channel):
+        assert current_channel() is channel
+    assert current_channel() is None
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Claude API呼び出しのサーキットブレーカーのテスト
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.circuit_breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN, HALF_OPEN
+
+
+def fail():
+    raise ConnectionError("unavailable")
+
+
+def trip(breaker, count):
+    for _ in range(count):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+
+
+def test_opens_when_error_rate_exceeds_threshold():
+    """最小呼び出し数に達してエラー率がしきい値を超えると開き、以降は即座に遮断すること"""
+    transitions = []
+    breaker = CircuitBreaker(min_calls=4, error_rate=0.5, on_transition=lambda *t: transitions.append(t))
+
+    breaker.call(lambda: 'ok')
+    trip(breaker, 2)
+    assert breaker.state == CLOSED
+    trip(breaker, 1)
+
+    assert breaker.state == OPEN
+    assert transitions == [(CLOSED, OPEN)]
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: 'ok')
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_opens_when_calls_are_slow():
+    """遅延した呼び出しの割合がしきい値を超えると開くこと"""
+    breaker = CircuitBreaker(min_calls=2, slow_call_seconds=0.5, slow_call_rate=1.0)
+
+    breaker.record_success(0.6)
+    breaker.record_success(0.7)
+
+    assert breaker.state == OPEN
+
+
+def test_half_open_probes_close_the_circuit():
+    """open_seconds経過後に半開状態となり、試行呼び出しがすべて成功すると閉じること"""
+    breaker = CircuitBreaker(min_calls=1, open_seconds=0.05, half_open_probes=2)
+    trip(breaker, 1)
+    time.sleep(0.06)
+
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() and breaker.allow()
+    assert not breaker.allow()  # 試行呼び出しの枠を超えた分は遮断する
+
+    breaker.record_success(0.01)
+    assert breaker.state == HALF_OPEN
+    breaker.record_success(0.01)
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_reopens_the_circuit():
+    """半開状態の試行呼び出しが失敗すると再び開くこと"""
+    breaker = CircuitBreaker(min_calls=1, open_seconds=0.05)
+    trip(breaker, 1)
+    time.sleep(0.06)
+
+    trip(breaker, 1)
+
+    assert breaker.state == OPEN
+
+
+def test_non_dependency_errors_are_not_counted():
+    """is_failureがFalseを返す例外は失敗として数えないこと"""
+    breaker = CircuitBreaker(min_calls=1)
+
+    with pytest.raises(ValueError):
+        breaker.call(lambda: int('x'), is_failure=lambda error: not isinstance(error, ValueError))
+
+    assert breaker.state == CLOSED
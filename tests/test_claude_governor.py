@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Claude API呼び出しの流量制御のテスト
+"""
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.claude_governor import ClaudeGovernor, DeadlineExceededBeforeCall, UserRateLimitExceeded
+
+
+class RetryableError(Exception):
+    def __init__(self, retry_after=0.0):
+        super().__init__("retryable")
+        self.retry_after = retry_after
+
+
+def retry_policy(error):
+    return error.retry_after if isinstance(error, RetryableError) else None
+
+
+def test_retryable_errors_are_retried_until_success():
+    """リトライ可能なエラーはバックオフ後に再実行されること"""
+    governor = ClaudeGovernor(base_delay=0.01, max_delay=0.02, retry_after=retry_policy)
+    attempts = []
+
+    def request(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise RetryableError()
+        return "ok"
+
+    assert governor.call(request) == "ok"
+    assert len(attempts) == 3
+    assert governor.stats()['retries'] == 2
+
+
+def test_non_retryable_error_is_raised_immediately():
+    """リトライ不可のエラーはそのまま送出されること"""
+    governor = ClaudeGovernor(retry_after=retry_policy)
+    attempts = []
+
+    def request(timeout):
+        attempts.append(timeout)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        governor.call(request)
+    assert len(attempts) == 1
+
+
+def test_retry_after_beyond_deadline_gives_up():
+    """retry-afterが期限を超える場合は待たずに諦めること"""
+    governor = ClaudeGovernor(deadline_seconds=0.2, retry_after=retry_policy)
+
+    def request(timeout):
+        raise RetryableError(retry_after=5)
+
+    start = time.monotonic()
+    with pytest.raises(RetryableError):
+        governor.call(request)
+    assert time.monotonic() - start < 0.1
+    assert governor.stats()['deadline_exceeded'] == 1
+
+
+def test_user_token_bucket_limits_bursts():
+    """ユーザーごとのバースト上限を超えるとUserRateLimitExceededになること"""
+    governor = ClaudeGovernor(user_rate_per_minute=1, user_burst=2, retry_after=retry_policy)
+
+    assert governor.call(lambda timeout: 1, user_id="U1") == 1
+    assert governor.call(lambda timeout: 2, user_id="U1") == 2
+    with pytest.raises(UserRateLimitExceeded):
+        governor.call(lambda timeout: 3, user_id="U1")
+    assert governor.call(lambda timeout: 4, user_id="U2") == 4
+
+
+def test_concurrency_is_bounded():
+    """同時実行数が上限を超えず、空きを待てない場合は期限切れになること"""
+    governor = ClaudeGovernor(max_concurrency=1, deadline_seconds=0.1, user_rate_per_minute=0,
+                              retry_after=retry_policy)
+    release = threading.Event()
+    thread = threading.Thread(target=governor.call, args=(lambda timeout: release.wait(),))
+    thread.start()
+    time.sleep(0.02)
+
+    try:
+        with pytest.raises(DeadlineExceededBeforeCall):
+            governor.call(lambda timeout: "second")
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_stream_retries_only_before_first_item():
+    """ストリーミングは最初の要素を受け取る前の失敗のみリトライすること"""
+    governor = ClaudeGovernor(base_delay=0.01, retry_after=retry_policy)
+    opened = []
+
+    def open_stream(timeout):
+        opened.append(timeout)
+        if len(opened) == 1:
+            raise RetryableError()
+        yield "a"
+        yield "b"
+
+    assert list(governor.stream(open_stream)) == ["a", "b"]
+    assert len(opened) == 2
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+会話履歴ストアのテスト
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.conversation_store import ConversationStore, SQLiteConversationBackend, estimate_tokens
+
+
+def test_history_is_trimmed_to_token_budget():
+    """トークン予算を超える古い発言は除外され、userの発言から始まること"""
+    store = ConversationStore()
+    for i in range(5):
+        store.append("U1", "user", f"question {i} " * 10)
+        store.append("U1", "assistant", f"answer {i} " * 10)
+
+    budget = estimate_tokens("question 4 " * 10) + estimate_tokens("answer 4 " * 10) + 5
+    history = store.history("U1", budget)
+
+    assert [message['role'] for message in history] == ["user", "assistant"]
+    assert history[0]['content'].startswith("question 4")
+
+
+def test_expired_conversation_is_dropped():
+    """TTLを過ぎた会話は破棄されること"""
+    store = ConversationStore(ttl_seconds=0.05)
+    store.append("U1", "user", "hello")
+    store.append("U1", "assistant", "hi")
+    time.sleep(0.1)
+
+    assert store.history("U1", 1000) == []
+    assert store.stats()['bytes'] == 0
+
+
+def test_least_recently_used_user_is_evicted():
+    """ユーザー数の上限を超えると最も使われていない会話が破棄されること"""
+    store = ConversationStore(max_users=2)
+    store.append("U1", "user", "one")
+    store.append("U2", "user", "two")
+    store.history("U1", 1000)
+    store.append("U3", "user", "three")
+
+    assert store.history("U1", 1000) != []
+    assert store.history("U2", 1000) == []
+
+
+def test_memory_cap_is_enforced():
+    """メモリ上限を超えないように会話が破棄されること"""
+    store = ConversationStore(max_bytes=2000)
+    for i in range(20):
+        store.append(f"U{i}", "user", "x" * 200)
+
+    assert store.stats()['bytes'] <= 2000
+
+
+def test_sqlite_backend_restores_history(tmp_path):
+    """永続化した履歴が新しいストア（コールドスタート相当）で読み込まれること"""
+    backend = SQLiteConversationBackend(str(tmp_path / "conversations.db"))
+    store = ConversationStore(backend=backend, flush_batch_size=100)
+    store.append("U1", "user", "hello")
+    store.append("U1", "assistant", "hi")
+    store.flush()
+
+    restored = ConversationStore(backend=backend)
+    assert restored.history("U1", 1000) == [
+        {'role': 'user', 'content': 'hello'},
+        {'role': 'assistant', 'content': 'hi'}
+    ]
+
+
+def test_forget_removes_pending_and_persisted_history(tmp_path):
+    """forgetでメモリ上・未反映・永続化済みの履歴がすべて削除されること"""
+    backend = SQLiteConversationBackend(str(tmp_path / "conversations.db"))
+    store = ConversationStore(backend=backend, flush_batch_size=100)
+    store.append("U1", "user", "hello")
+    store.append("U1", "assistant", "hi")
+    store.flush()
+    store.append("U1", "user", "pending")
+    store.append("U2", "user", "other")
+
+    store.forget("U1")
+    store.flush()
+
+    assert store.history("U1", 1000) == []
+    assert ConversationStore(backend=backend).history("U1", 1000) == []
+    assert ConversationStore(backend=backend).history("U2", 1000) == [{'role': 'user', 'content': 'other'}]
+
+
+def test_warm_stores_see_each_others_turns(tmp_path):
+    """同じバックエンドを使う別コンテナのストアが、互いの発言を読み直すこと"""
+    backend = SQLiteConversationBackend(str(tmp_path / "conversations.db"))
+    first = ConversationStore(backend=backend, flush_batch_size=100)
+    second = ConversationStore(backend=backend, flush_batch_size=100)
+    assert second.history("U1", 1000) == []
+
+    first.append("U1", "user", "hello")
+    first.append("U1", "assistant", "hi")
+    first.flush()
+    second.append("U1", "user", "again")
+
+    assert second.history("U1", 1000) == [
+        {'role': 'user', 'content': 'hello'},
+        {'role': 'assistant', 'content': 'hi'},
+        {'role': 'user', 'content': 'again'}
+    ]
+
+
+class FailingBackend(SQLiteConversationBackend):
+    def __init__(self, path):
+        super().__init__(path)
+        self.fail = True
+
+    def save_batch(self, items):
+        if self.fail:
+            raise OSError("disk full")
+        super().save_batch(items)
+
+
+def test_failed_flush_keeps_pending_turns(tmp_path):
+    """書き込みに失敗した発言が未反映に戻り、次回のflushで保存されること"""
+    backend = FailingBackend(str(tmp_path / "conversations.db"))
+    store = ConversationStore(backend=backend, flush_batch_size=100)
+    store.append("U1", "user", "hello")
+    store.append("U1", "assistant", "hi")
+
+    with pytest.raises(OSError):
+        store.flush()
+    assert store.stats()['pending'] == 2
+    assert store.history("U1", 1000) == [
+        {'role': 'user', 'content': 'hello'},
+        {'role': 'assistant', 'content': 'hi'}
+    ]
+
+    backend.fail = False
+    store.flush()
+    assert store.stats()['pending'] == 0
+    assert ConversationStore(backend=backend).history("U1", 1000) == [
+        {'role': 'user', 'content': 'hello'},
+        {'role': 'assistant', 'content': 'hi'}
+    ]
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+処理の期限のテスト
+"""
+
+import os
+import sys
+import time
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.deadline import current_deadline, deadline_scope, earliest, lambda_deadline, remaining, wall_clock_deadline
+
+
+class FakeLambdaContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_earliest_ignores_missing_deadlines():
+    """Noneを除いた最も早い期限を返すこと"""
+    assert earliest(None, 5.0, 3.0) == 3.0
+    assert earliest(None, None) is None
+
+
+def test_nested_scope_cannot_extend_deadline():
+    """内側の期限は外側より遅くならず、withを抜けると元に戻ること"""
+    assert current_deadline() is None
+
+    with deadline_scope(100.0):
+        with deadline_scope(200.0) as inner:
+            assert inner == 100.0
+        with deadline_scope(50.0):
+            assert current_deadline() == 50.0
+        assert current_deadline() == 100.0
+
+    assert current_deadline() is None
+
+
+def test_lambda_deadline_subtracts_safety_margin():
+    """Lambdaの残り実行時間から安全マージンを差し引いた期限になること"""
+    deadline = lambda_deadline(FakeLambdaContext(3000), safety_margin_seconds=0.5)
+
+    assert 2.4 < remaining(deadline) <= 2.5
+    assert lambda_deadline({}) is None
+
+
+def test_wall_clock_deadline():
+    """UNIX時刻の期限をtime.monotonic()基準の残り時間に変換できること"""
+    assert 9.9 < remaining(wall_clock_deadline(time.time() + 10)) <= 10.0
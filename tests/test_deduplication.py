@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+重複イベント検出のテスト
+"""
+
+import os
+import sys
+import time
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.deduplication import EventDeduplicator, SharedDedupStore, SQLiteDedupStore
+
+
+def test_duplicate_event_is_dropped_and_counted():
+    """同じwebhookEventIdの2回目以降は処理されず件数が記録されること"""
+    deduplicator = EventDeduplicator()
+
+    assert deduplicator.claim("01H00000000000000000000000") is True
+    assert deduplicator.claim("01H00000000000000000000000", is_redelivery=True) is False
+    assert deduplicator.claim("01H00000000000000000000001") is True
+
+    assert deduplicator.stats() == {'processed': 2, 'duplicates': 1, 'redeliveries': 1, 'store_errors': 0}
+
+
+def test_entries_expire_after_ttl():
+    """TTLを過ぎたイベントIDは再び処理対象になること"""
+    deduplicator = EventDeduplicator(ttl_seconds=0.05)
+    deduplicator.claim("event-1")
+    time.sleep(0.1)
+
+    assert deduplicator.claim("event-1") is True
+
+
+def test_redelivery_processed_by_other_container_is_dropped(tmp_path):
+    """他のコンテナで処理済みの再配信イベントは共有ストアで検出されること"""
+    shared = SQLiteDedupStore(str(tmp_path / "events.db"))
+    EventDeduplicator(shared=shared).claim("event-1")
+
+    other_container = EventDeduplicator(shared=shared)
+    assert other_container.claim("event-1", is_redelivery=True) is False
+    assert other_container.claim("event-2", is_redelivery=True) is True
+
+
+def test_shared_store_errors_fail_open():
+    """共有ストアの障害時は未処理のイベントとして処理し、件数を記録すること"""
+    class BrokenStore(SharedDedupStore):
+        def claim(self, event_id, ttl_seconds):
+            raise ConnectionError("store unavailable")
+
+    deduplicator = EventDeduplicator(shared=BrokenStore())
+
+    assert deduplicator.claim("event-1", is_redelivery=True) is True
+    assert deduplicator.claim("event-1", is_redelivery=True) is False
+    assert deduplicator.stats()['store_errors'] == 1
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+送信に失敗したメッセージの再送キューのテスト
+"""
+
+import os
+import sys
+import sqlite3
+import threading
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from linebot.exceptions import LineBotApiError
+from linebot.models import Error
+
+from src.delivery_queue import DeliveryQueue, is_invalid_reply_token, is_retryable_line_error
+
+MESSAGES = [{'type': 'text', 'text': 'こんにちは'}]
+
+
+def line_error(status, message='error'):
+    return LineBotApiError(status_code=status, headers={}, error=Error(message=message))
+
+
+def test_error_classification():
+    """返信トークンの無効・再送可能な失敗を判定できること"""
+    assert is_invalid_reply_token(line_error(400, 'Invalid reply token'))
+    assert not is_invalid_reply_token(line_error(400, 'The request body has 1 error(s)'))
+    assert is_retryable_line_error(line_error(429))
+    assert is_retryable_line_error(line_error(503))
+    assert is_retryable_line_error(ConnectionError())
+    assert not is_retryable_line_error(line_error(400))
+
+
+def test_due_messages_are_resent_with_the_same_retry_key(tmp_path):
+    """再送時刻を過ぎたメッセージを同じリトライキー・チャネルで再送し、成功したら削除すること"""
+    queue = DeliveryQueue(str(tmp_path / 'delivery.db'), base_delay=0)
+    queue.enqueue('U1', MESSAGES, 'key-1', '503', channel='Udest')
+    sent = []
+
+    def send(to, messages, key, channel):
+        sent.append((to, messages[0].as_json_dict(), key, channel))
+
+    result = queue.retry_due(send, is_retryable_line_error)
+
+    assert result == {'delivered': 1, 'retrying': 0, 'dead_lettered': 0, 'deferred': 0}
+    assert sent == [('U1', MESSAGES[0], 'key-1', 'Udest')]
+    assert queue.stats() == {'pending': 0, 'dead_letters': 0}
+
+
+def test_failures_back_off_then_move_to_dead_letters(tmp_path):
+    """再送可能な失敗はバックオフ後に再送し、上限回数で失敗したらdead letterに移すこと"""
+    path = str(tmp_path / 'delivery.db')
+    queue = DeliveryQueue(path, max_attempts=3, base_delay=0)
+    queue.enqueue('U1', MESSAGES, 'key-1', '503')
+
+    def fail(to, messages, key, channel):
+        raise line_error(503)
+
+    assert queue.retry_due(fail, is_retryable_line_error)['retrying'] == 1
+    assert queue.retry_due(fail, is_retryable_line_error)['dead_lettered'] == 1
+    assert queue.stats() == {'pending': 0, 'dead_letters': 1}
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT recipient, attempts FROM dead_letters").fetchall() == [('U1', 3)]
+
+
+def test_messages_wait_for_backoff(tmp_path):
+    """バックオフ中のメッセージは再送しないこと"""
+    queue = DeliveryQueue(str(tmp_path / 'delivery.db'), base_delay=60)
+    queue.enqueue('U1', MESSAGES, 'key-1', '503')
+
+    result = queue.retry_due(lambda to, messages, key, channel: None, is_retryable_line_error)
+
+    assert result['delivered'] == 0
+    assert queue.stats()['pending'] == 1
+
+
+def test_retry_stops_when_expired(tmp_path):
+    """期限切れになったら送信をやめ、残りは次回すぐに再送できること"""
+    queue = DeliveryQueue(str(tmp_path / 'delivery.db'), base_delay=0)
+    queue.enqueue('U1', MESSAGES, 'key-1', '503')
+    queue.enqueue('U2', MESSAGES, 'key-2', '503')
+    sent = []
+
+    result = queue.retry_due(lambda to, messages, key, channel: sent.append(to), is_retryable_line_error,
+                             expired=lambda: len(sent) >= 1)
+
+    assert sent == ['U1']
+    assert result['delivered'] == 1
+    assert result['deferred'] == 1
+    assert queue.retry_due(lambda to, messages, key, channel: sent.append(to), is_retryable_line_error)['delivered'] == 1
+    assert sent == ['U1', 'U2']
+
+
+def test_tables_without_channel_column_are_migrated(tmp_path):
+    """channel列のない既存のファイルにも列を追加して使えること"""
+    path = str(tmp_path / 'delivery.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE pending_deliveries (id INTEGER PRIMARY KEY AUTOINCREMENT, recipient TEXT NOT NULL, "
+            "messages TEXT NOT NULL, retry_key TEXT NOT NULL, attempts INTEGER NOT NULL, "
+            "next_attempt_at REAL NOT NULL, created_at REAL NOT NULL, last_error TEXT)"
+        )
+    queue = DeliveryQueue(path, base_delay=0)
+    queue.enqueue('U1', MESSAGES, 'key-1', '503', channel='Udest')
+    sent = []
+
+    queue.retry_due(lambda to, messages, key, channel: sent.append(channel), is_retryable_line_error)
+
+    assert sent == ['Udest']
+
+
+def test_due_messages_are_claimed_once_across_processes(tmp_path):
+    """同じファイルの再送キューを複数のプロセスから同時に処理しても、各メッセージを1回だけ送ること"""
+    path = str(tmp_path / 'delivery.db')
+    DeliveryQueue(path, base_delay=0)
+    for i in range(10):
+        DeliveryQueue(path, base_delay=0).enqueue(f'U{i}', MESSAGES, f'key-{i}', '503')
+    # プロセスごとに別のインスタンス（別のロック）で同じファイルを処理する
+    queues = [DeliveryQueue(path, base_delay=0) for _ in range(2)]
+    sent = []
+    start = threading.Barrier(len(queues))
+
+    def drain(queue):
+        start.wait()
+        for _ in range(5):
+            queue.retry_due(lambda to, messages, key, channel: sent.append(to), is_retryable_line_error, limit=3)
+
+    threads = [threading.Thread(target=drain, args=(queue,)) for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(sent) == sorted(f'U{i}' for i in range(10))
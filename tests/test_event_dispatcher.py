@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+複数イベント並行処理ディスパッチャーのテスト
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import base64
+import threading
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from linebot import WebhookHandler, WebhookParser
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import MessageEvent, TextMessage
+
+from src.deadline import current_deadline, deadline_scope
+from src.event_dispatcher import ConcurrentEventDispatcher
+
+CHANNEL_SECRET = 'test-secret'
+
+
+def create_signed_body(messages):
+    """(user_id, text)のリストから署名付きwebhookボディを作成"""
+    events = [
+        {
+            "type": "message",
+            "mode": "active",
+            "timestamp": 0,
+            "source": {"type": "user", "userId": user_id},
+            "replyToken": f"token-{i}",
+            "message": {"type": "text", "id": str(i), "text": text}
+        }
+        for i, (user_id, text) in enumerate(messages)
+    ]
+    body = json.dumps({"destination": "Udest", "events": events})
+    digest = hmac.new(CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return body, base64.b64encode(digest).decode('utf-8')
+
+
+def test_events_from_same_user_keep_order():
+    """同じユーザーのイベントは受信順に処理されること"""
+    handler = WebhookHandler(CHANNEL_SECRET)
+    received = []
+    lock = threading.Lock()
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def handle(event):
+        # 先に届いたイベントほど遅く終わるようにして順序の崩れを検出する
+        time.sleep(0.05 / (int(event.message.id) + 1))
+        with lock:
+            received.append((event.source.user_id, event.message.text))
+
+    body, signature = create_signed_body([
+        ("U1", "1-a"), ("U2", "2-a"), ("U1", "1-b"), ("U2", "2-b"), ("U1", "1-c")
+    ])
+    ConcurrentEventDispatcher(handler, max_workers=4).handle(body, signature)
+
+    assert [text for user, text in received if user == "U1"] == ["1-a", "1-b", "1-c"]
+    assert [text for user, text in received if user == "U2"] == ["2-a", "2-b"]
+
+
+def test_events_from_different_users_run_concurrently():
+    """異なるユーザーのイベントは並行して処理されること"""
+    handler = WebhookHandler(CHANNEL_SECRET)
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def handle(event):
+        time.sleep(0.2)
+
+    body, signature = create_signed_body([(f"U{i}", "hello") for i in range(4)])
+
+    start = time.perf_counter()
+    ConcurrentEventDispatcher(handler, max_workers=4).handle(body, signature)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.6
+
+
+def test_handler_errors_are_raised():
+    """ハンドラー内の例外は呼び出し元に伝播すること"""
+    handler = WebhookHandler(CHANNEL_SECRET)
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def handle(event):
+        raise RuntimeError("boom")
+
+    body, signature = create_signed_body([("U1", "a"), ("U2", "b")])
+
+    with pytest.raises(RuntimeError):
+        ConcurrentEventDispatcher(handler, max_workers=2).handle(body, signature)
+
+
+def test_deadline_is_propagated_to_lanes():
+    """呼び出し元で設定した処理の期限が各レーンのスレッドに引き継がれること"""
+    handler = WebhookHandler(CHANNEL_SECRET)
+    deadlines = []
+    lock = threading.Lock()
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def handle(event):
+        with lock:
+            deadlines.append(current_deadline())
+
+    body, signature = create_signed_body([(f"U{i}", "hello") for i in range(3)])
+    with deadline_scope(12345.0):
+        ConcurrentEventDispatcher(handler, max_workers=4).handle(body, signature)
+
+    assert deadlines == [12345.0] * 3
+
+
+def test_merge_lane_is_applied_per_user():
+    """merge_laneでユーザーごとのイベント列をまとめてから処理すること"""
+    handler = WebhookHandler(CHANNEL_SECRET)
+    received = []
+    lock = threading.Lock()
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def handle(event):
+        with lock:
+            received.append((event.source.user_id, event.message.text))
+
+    def merge_lane(events):
+        events[-1].message.text = "+".join(event.message.text for event in events)
+        return events[-1:]
+
+    body, signature = create_signed_body([("U1", "a"), ("U2", "x"), ("U1", "b")])
+    ConcurrentEventDispatcher(handler, max_workers=4).handle(body, signature, merge_lane=merge_lane)
+
+    assert sorted(received) == [("U1", "a+b"), ("U2", "x")]
+
+
+def test_lean_parsing_dispatches_to_registered_handlers():
+    """軽量パースでも登録済みハンドラーに同じ属性でイベントが渡されること"""
+    handler = WebhookHandler(CHANNEL_SECRET)
+    received = []
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def handle(event, destination):
+        received.append((event.source.user_id, event.message.text, event.reply_token, destination))
+
+    body, signature = create_signed_body([("U1", "こんにちは")])
+    ConcurrentEventDispatcher(handler, max_workers=1, lean=True).handle(body, signature)
+
+    assert received == [("U1", "こんにちは", "token-0", "Udest")]
+
+
+def test_parser_overrides_channel_secret():
+    """parserを指定した場合はそのチャネルシークレットで署名を検証すること"""
+    handler = WebhookHandler('other-channel-secret')
+    received = []
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def handle(event):
+        received.append(event.message.text)
+
+    body, signature = create_signed_body([("U1", "hello")])
+    for lean in (False, True):
+        dispatcher = ConcurrentEventDispatcher(handler, max_workers=1, lean=lean)
+        with pytest.raises(InvalidSignatureError):
+            dispatcher.handle(body, signature)
+        dispatcher.handle(body, signature, parser=WebhookParser(CHANNEL_SECRET))
+
+    assert received == ["hello", "hello"]
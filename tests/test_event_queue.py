@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+イベントキューのテスト
+"""
+
+import os
+import sys
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.event_queue import InMemoryEventQueue, SQLiteEventQueue, SQSEventQueue, create_event_queue
+
+
+def bodies(records):
+    return [record.body for record in records]
+
+
+def test_in_memory_queue_preserves_order():
+    """プロセス内キューが投入順に取り出せること"""
+    queue = InMemoryEventQueue()
+    queue.enqueue(["a", "b", "c"])
+
+    assert bodies(queue.dequeue(2)) == ["a", "b"]
+    assert bodies(queue.dequeue(10)) == ["c"]
+    assert queue.dequeue(10) == []
+
+
+def test_sqlite_queue_hides_dequeued_records(tmp_path):
+    """SQLiteキューから取り出したレコードが、ackするまでほかのワーカーに取り出されないこと"""
+    path = str(tmp_path / "queue.db")
+    queue = SQLiteEventQueue(path)
+    queue.enqueue(["first", "second", "third"])
+
+    first = queue.dequeue(2)
+    assert bodies(first) == ["first", "second"]
+    # 別インスタンス（別プロセス相当）からも同じキューを参照できる
+    assert bodies(SQLiteEventQueue(path).dequeue(10)) == ["third"]
+    assert queue.dequeue(10) == []
+
+
+def test_sqlite_queue_redelivers_records_that_were_not_acked(tmp_path):
+    """ackしなかったレコードは可視性タイムアウト後に再び取り出され、ackしたレコードは削除されること"""
+    queue = SQLiteEventQueue(str(tmp_path / "queue.db"), visibility_timeout=0)
+    queue.enqueue(["done", "failed"])
+
+    done, failed = queue.dequeue(10)
+    queue.ack([done])
+
+    assert bodies(queue.dequeue(10)) == ["failed"]
+
+
+class FakeSQSClient:
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.sent = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.sent.append([entry['MessageBody'] for entry in Entries])
+        failed = self.failures.pop(0) if self.failures else []
+        return {'Failed': [entry for entry in failed if entry['Id'] in {e['Id'] for e in Entries}]}
+
+
+def sqs_queue(client):
+    queue = SQSEventQueue.__new__(SQSEventQueue)
+    queue._queue_url = 'https://sqs.test/queue'
+    queue._client = client
+    return queue
+
+
+def test_sqs_queue_resends_failed_entries():
+    """send_message_batchで一時的に失敗したエントリだけを再送すること"""
+    client = FakeSQSClient([[{'Id': '1', 'SenderFault': False, 'Code': 'InternalError'}]])
+
+    sqs_queue(client).enqueue(["a", "b"])
+
+    assert client.sent == [["a", "b"], ["b"]]
+
+
+def test_sqs_queue_raises_when_entries_keep_failing():
+    """送信者側の誤りで失敗したエントリは再送せずに例外を送出すること"""
+    client = FakeSQSClient([[{'Id': '0', 'SenderFault': True, 'Code': 'InvalidMessageContents'}]])
+
+    with pytest.raises(RuntimeError, match='InvalidMessageContents'):
+        sqs_queue(client).enqueue(["a", "b"])
+    assert client.sent == [["a", "b"]]
+
+
+def test_create_event_queue_rejects_unknown_backend():
+    """未知のバックエンド指定はエラーになること"""
+    with pytest.raises(ValueError):
+        create_event_queue("unknown")
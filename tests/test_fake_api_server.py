@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Claude API / LINE APIの擬似サーバーのテスト（SDKから擬似サーバーを呼び出す）
+"""
+
+import os
+import sys
+import functools
+
+import httpx
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from anthropic import Anthropic
+from linebot import LineBotApi
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+
+import scripts.fake_api_server as fake_api_server
+from src.http_transport import HttpTransport, HttpxLineClient
+
+
+@pytest.fixture
+def server():
+    """レイテンシなし・エラー注入なしの設定で、記録をリセットした擬似サーバー"""
+    vars(fake_api_server.config).update(vars(fake_api_server.parse_args([
+        '--claude-latency-ms', '0', '--tokens-per-second', '0', '--output-tokens', '5',
+        '--line-latency-ms', '0', '--error-latency-ms', '0'
+    ])))
+    fake_api_server.app.test_client().delete('/_fake/requests')
+    return httpx.Client(transport=httpx.WSGITransport(app=fake_api_server.app), base_url='http://fake.test')
+
+
+@pytest.fixture
+def line_api(server):
+    transport = HttpTransport(transport=httpx.WSGITransport(app=fake_api_server.app))
+    return LineBotApi('token', endpoint='http://fake.test', data_endpoint='http://fake.test',
+                      http_client=functools.partial(HttpxLineClient, transport.client))
+
+
+def claude_client(server):
+    return Anthropic(api_key='key', base_url='http://fake.test', http_client=server, max_retries=0)
+
+
+def test_messages_endpoint_answers_the_sdk(server):
+    """Messages APIの応答をSDKが読み込め、max_tokensで打ち切られた場合はstop_reasonに反映されること"""
+    message = claude_client(server).messages.create(
+        model='claude-fake', max_tokens=3, messages=[{'role': 'user', 'content': 'こんにちは'}]
+    )
+
+    assert message.content[0].text == 'これはローカルの'
+    assert message.stop_reason == 'max_tokens'
+    assert message.usage.output_tokens == 3
+
+
+def test_messages_endpoint_streams_to_the_sdk(server):
+    """stream=trueの応答をSDKのストリーミングで受け取れること"""
+    with claude_client(server).messages.stream(
+        model='claude-fake', max_tokens=100, messages=[{'role': 'user', 'content': 'こんにちは'}]
+    ) as stream:
+        text = ''.join(stream.text_stream)
+        message = stream.get_final_message()
+
+    assert text == 'これはローカルの擬似サーバー'
+    assert message.stop_reason == 'end_turn'
+
+
+def test_reply_tokens_are_single_use(server, line_api):
+    """返信トークンは1回のみ有効で、2回目は400になること"""
+    line_api.reply_message('reply-token', TextSendMessage(text='こんにちは'))
+
+    with pytest.raises(LineBotApiError) as raised:
+        line_api.reply_message('reply-token', TextSendMessage(text='もう一度'))
+    assert raised.value.status_code == 400
+    assert server.get('/_fake/stats').json() == {
+        'line /v2/bot/message/reply 200': 1, 'line /v2/bot/message/reply 400': 1
+    }
+
+
+def test_push_rejects_an_accepted_retry_key(server, line_api):
+    """受理済みのリトライキーでのプッシュは409になり、記録にはリクエストが残ること"""
+    line_api.push_message('U1', TextSendMessage(text='こんにちは'), retry_key='key-1')
+
+    with pytest.raises(LineBotApiError) as raised:
+        line_api.push_message('U1', TextSendMessage(text='こんにちは'), retry_key='key-1')
+    assert raised.value.status_code == 409
+    pushes = server.get('/_fake/requests', params={'api': 'line'}).json()['requests']
+    assert [(item['status'], item['body']['to']) for item in pushes] == [(200, 'U1'), (409, 'U1')]
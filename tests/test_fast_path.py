@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+ファストパス（Claudeを呼ばない応答）のテスト
+"""
+
+import os
+import sys
+import json
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.fast_path import FastPathRouter, create_fast_path_router, DEFAULT_TEMPLATES, DEFAULT_COMMANDS
+
+
+def test_commands_match_exactly_after_normalization():
+    """コマンドは正規化後の完全一致で判定し、通常の文章には反応しないこと"""
+    router = FastPathRouter(DEFAULT_TEMPLATES, DEFAULT_COMMANDS)
+
+    assert router.match_command('ヘルプ') == 'help'
+    assert router.match_command('  HELP ') == 'help'
+    assert router.match_command('リセット！') == 'reset'
+    assert router.match_command('/reset please') == 'reset'
+    assert router.match_command('ヘルプの使い方を教えて') is None
+    assert router.match_command('reset the router') is None
+
+
+def test_templates_are_prebuilt_messages():
+    """応答メッセージが生成時に作成され、同じオブジェクトが返されること"""
+    router = FastPathRouter({'help': 'ヘルプ本文'}, {})
+
+    assert router.message('help').text == 'ヘルプ本文'
+    assert router.message('help') is router.message('help')
+    assert router.message('unknown') is None
+
+
+def test_postback_action():
+    """ポストバックのdataからactionを取り出せること"""
+    assert FastPathRouter.postback_action('action=reset&item=1') == 'reset'
+    assert FastPathRouter.postback_action('item=1') is None
+    assert FastPathRouter.postback_action('') is None
+
+
+def test_create_from_environment(monkeypatch):
+    """環境変数でテンプレートとコマンドを追加・上書きできること"""
+    monkeypatch.setenv('FOLLOW_MESSAGE', 'ようこそ')
+    monkeypatch.setenv('FAST_PATH_TEMPLATES', json.dumps({'about': 'このボットについて'}))
+    monkeypatch.setenv('FAST_PATH_COMMANDS', json.dumps({'about': ['about', 'について']}))
+
+    router = create_fast_path_router()
+
+    assert router.message('follow').text == 'ようこそ'
+    assert router.match_command('について') == 'about'
+    assert router.message('about').text == 'このボットについて'
+    assert router.match_command('help') == 'help'
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+共有HTTPクライアントのテスト
+"""
+
+import os
+import sys
+import json
+import functools
+
+import httpx
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from linebot import LineBotApi
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+
+from src.http_transport import HttpTransport, HttpxLineClient, to_httpx_timeout
+
+
+def create_transport(requests):
+    """受信したリクエストを記録して200を返すモックのHTTPクライアント"""
+    def handle(request):
+        requests.append(request)
+        return httpx.Response(200, json={})
+    return HttpTransport(transport=httpx.MockTransport(handle))
+
+
+def test_line_bot_api_uses_shared_client():
+    """LineBotApiのリクエストが共有のhttpx.Client経由で送信されること"""
+    requests = []
+    transport = create_transport(requests)
+    api = LineBotApi('token', endpoint='http://line.test',
+                     http_client=functools.partial(HttpxLineClient, transport.client))
+
+    api.reply_message('reply-token', TextSendMessage(text='こんにちは'), timeout=1.5)
+
+    assert len(requests) == 1
+    request = requests[0]
+    assert str(request.url) == 'http://line.test/v2/bot/message/reply'
+    assert request.headers['Authorization'] == 'Bearer token'
+    assert json.loads(request.content)['messages'][0]['text'] == 'こんにちは'
+    assert request.extensions['timeout']['read'] == 1.5
+
+
+def test_requests_style_timeout_is_converted():
+    """(接続, 読み取り)のタプルのタイムアウトをhttpx.Timeoutに変換できること"""
+    timeout = to_httpx_timeout((2.0, 7.0))
+
+    assert timeout.connect == 2.0
+    assert timeout.read == 7.0
+    assert to_httpx_timeout(5).read == 5
+
+
+def test_stream_response_is_iterable():
+    """stream=TrueのGETでレスポンスを分割して読み出せること"""
+    transport = HttpTransport(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=b'abcdef')))
+    client = HttpxLineClient(transport.client)
+
+    response = client.get('http://line.test/content', stream=True)
+
+    assert response.status_code == 200
+    assert b''.join(response.iter_content(chunk_size=2)) == b'abcdef'
+
+
+def test_streamed_error_response_is_read():
+    """stream=TrueのGETがエラー応答の場合も本文を読み込み、LineBotApiErrorを送出すること"""
+    def handle(request):
+        # イテレータの本文はMockTransportでも読み込み前のストリームとして返る
+        return httpx.Response(404, headers={'Content-Type': 'application/json'},
+                              content=iter([b'{"message": "Not found"}']))
+
+    transport = HttpTransport(transport=httpx.MockTransport(handle))
+    api = LineBotApi('token', endpoint='http://line.test', data_endpoint='http://line.test',
+                     http_client=functools.partial(HttpxLineClient, transport.client))
+
+    with pytest.raises(LineBotApiError) as raised:
+        api.get_message_content('message-id')
+    assert raised.value.status_code == 404
+    assert raised.value.error.message == 'Not found'
+
+
+def test_prewarm_ignores_connection_errors():
+    """事前接続の失敗は無視し、成功した数を返すこと"""
+    def handle(request):
+        if request.url.host == 'down.test':
+            raise httpx.ConnectError('connection refused', request=request)
+        return httpx.Response(404)
+
+    transport = HttpTransport(transport=httpx.MockTransport(handle))
+
+    assert transport.prewarm(['http://line.test', 'http://down.test']) == 1
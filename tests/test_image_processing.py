@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+画像メッセージの縮小処理のテスト
+"""
+
+import io
+import os
+import sys
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+Image = pytest.importorskip('PIL.Image')
+
+from src.image_processing import (
+    ImagePreparer, ImageTooLarge, UnsupportedImage, downscale_image, estimate_image_tokens, read_limited, target_size
+)
+
+
+def encode(image, image_format, **kwargs):
+    output = io.BytesIO()
+    image.save(output, image_format, **kwargs)
+    return output.getvalue()
+
+
+def test_target_size_respects_edge_and_token_budget():
+    """長辺と推定トークン数の上限に収まるよう縦横比を保って縮小し、拡大はしないこと"""
+    assert target_size(800, 600, 1568, 1600) == (800, 600)
+
+    width, height = target_size(4032, 3024, 1568, 1600)
+    assert max(width, height) <= 1568
+    assert estimate_image_tokens(width, height) <= 1600
+    assert abs(width / height - 4032 / 3024) < 0.01
+
+    assert target_size(4000, 1000, 1000, 100000) == (1000, 250)
+
+
+def test_phone_photo_is_downscaled_and_rotated():
+    """EXIFの回転を反映し、上限の大きさのJPEGに縮小すること"""
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    data = encode(Image.new('RGB', (4032, 3024), (200, 100, 50)), 'JPEG', quality=95, exif=exif)
+
+    prepared = downscale_image(data, max_edge=1568, max_tokens=1600)
+
+    assert prepared.media_type == 'image/jpeg'
+    assert (prepared.source_width, prepared.source_height) == (3024, 4032)
+    assert prepared.width < prepared.height
+    assert prepared.estimated_tokens <= 1600
+    with Image.open(io.BytesIO(prepared.data)) as result:
+        assert result.size == (prepared.width, prepared.height)
+
+
+def test_small_image_is_sent_as_is():
+    """縮小が不要な対応形式の画像は再エンコードしないこと"""
+    data = encode(Image.new('RGB', (320, 240)), 'PNG')
+
+    prepared = downscale_image(data)
+
+    assert prepared.data == data
+    assert prepared.media_type == 'image/png'
+    assert prepared.as_content_block()['source']['media_type'] == 'image/png'
+
+
+def test_transparent_image_is_flattened_to_jpeg():
+    """透過画像は白背景のJPEGに変換すること"""
+    data = encode(Image.new('RGBA', (3000, 3000), (0, 0, 0, 0)), 'PNG')
+
+    prepared = downscale_image(data, max_edge=1000)
+
+    assert (prepared.media_type, prepared.width, prepared.height) == ('image/jpeg', 1000, 1000)
+    with Image.open(io.BytesIO(prepared.data)) as result:
+        assert result.getpixel((0, 0))[0] > 240
+
+
+def test_invalid_or_oversized_input_is_rejected():
+    """画像でないデータ・上限を超えるデータはエラーにすること"""
+    with pytest.raises(UnsupportedImage):
+        downscale_image(b'not an image')
+    with pytest.raises(ImageTooLarge):
+        read_limited(iter([b'x' * 600, b'x' * 600]), 1000)
+
+
+def test_preparer_reads_chunks_and_counts_bytes():
+    """取得したチャンクをつなげて縮小し、元の画像と送信する画像のサイズを集計すること"""
+    data = encode(Image.new('RGB', (2000, 1500)), 'JPEG')
+    preparer = ImagePreparer(max_edge=800)
+
+    image = preparer.prepare(lambda: iter([data[:1000], data[1000:]]))
+
+    assert (image.width, image.height) == (800, 600)
+    assert preparer.stats() == {'prepared': 1, 'source_bytes': len(data), 'sent_bytes': len(image.data)}
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Lambdaハンドラーの送信・チャネル振り分け・画像処理のテスト（LINE・Claudeのクライアントはスタブ）
+"""
+
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import base64
+from types import SimpleNamespace
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'secret')
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'token')
+os.environ.setdefault('ANTHROPIC_API_KEY', 'key')
+
+from linebot import WebhookParser
+from linebot.exceptions import LineBotApiError
+from linebot.models import Error
+
+import src.lambda_function as bot
+from src.channel_registry import Channel, ChannelClients, ChannelRegistry, channel_scope
+from src.circuit_breaker import CircuitBreaker
+from src.claude_governor import ClaudeGovernor
+from src.conversation_store import ConversationStore, SQLiteConversationBackend
+from src.deduplication import EventDeduplicator, SharedDedupStore
+from src.delivery_queue import DeliveryQueue
+from src.event_queue import SQLiteEventQueue
+
+USER_ID = 'U123456789abcdef0123456789abcdef0'
+
+
+def line_error(status, message='error'):
+    return LineBotApiError(status_code=status, headers={}, error=Error(message=message))
+
+
+def texts(messages):
+    # TextSendMessageと再送キューのRawMessageの両方からテキストを取り出す
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    return [message.as_json_dict()['text'] for message in messages]
+
+
+class FakeLineBotApi:
+    """返信・プッシュを記録し、指定した失敗を送出するLineBotApiのスタブ"""
+
+    def __init__(self, reply_error=None, push_error=None, content=b'', content_error=None):
+        self.reply_error = reply_error
+        self.push_error = push_error
+        self.content = content
+        self.content_error = content_error
+        self.replies = []
+        self.pushes = []
+        self.closed = 0
+
+    def reply_message(self, reply_token, messages, timeout=None):
+        if self.reply_error is not None:
+            raise self.reply_error
+        self.replies.append((reply_token, texts(messages)))
+
+    def push_message(self, to, messages, retry_key=None, timeout=None):
+        if self.push_error is not None:
+            raise self.push_error
+        self.pushes.append((to, texts(messages)))
+
+    def get_message_content(self, message_id, timeout=None):
+        if self.content_error is not None:
+            raise self.content_error
+
+        def close():
+            self.closed += 1
+
+        return SimpleNamespace(
+            response=SimpleNamespace(close=close),
+            iter_content=lambda chunk_size: iter([self.content])
+        )
+
+
+@pytest.fixture
+def line_api(monkeypatch, tmp_path):
+    """デフォルトのチャネルのLineBotApiをスタブにし、状態を持つ機能をテストごとに分ける"""
+    api = FakeLineBotApi()
+    monkeypatch.setattr(bot, '_line_bot_api', api)
+    monkeypatch.setattr(bot, 'delivery_queue', DeliveryQueue(str(tmp_path / 'delivery.db'), base_delay=0))
+    monkeypatch.setattr(bot, 'response_cache', None)
+    monkeypatch.setattr(bot, 'conversation_store', None)
+    monkeypatch.setattr(bot, 'usage_accountant', None)
+    monkeypatch.setattr(bot, 'event_deduplicator', None)
+    monkeypatch.setattr(bot, 'channel_registry', None)
+    monkeypatch.setattr(bot.tracer, 'enabled', False)
+    return api
+
+
+@pytest.fixture
+def channels(monkeypatch, line_api):
+    """destinationがUa・Ubの2チャネルを登録し、チャネルごとのLineBotApiのスタブを返す"""
+    apis = {}
+
+    def create_clients(channel):
+        apis[channel.destination] = FakeLineBotApi()
+        return ChannelClients(apis[channel.destination], WebhookParser(channel.channel_secret))
+
+    registry = ChannelRegistry([
+        Channel('Ua', 'a', 'secret-a', 'token-a'),
+        Channel('Ub', 'b', 'secret-b', 'token-b')
+    ], create_clients)
+    monkeypatch.setattr(bot, 'channel_registry', registry)
+    return apis
+
+
+def sign(body, secret):
+    digest = hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def text_event(text, reply_token='reply-token'):
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": USER_ID},
+        "replyToken": reply_token,
+        "message": {"type": "text", "id": "1", "text": text}
+    }
+
+
+def webhook_event(body, secret):
+    return {'headers': {'x-line-signature': sign(body, secret)}, 'body': body}
+
+
+def image_event(reply_token='reply-token', timestamp=None):
+    return SimpleNamespace(
+        message=SimpleNamespace(id='m1'),
+        source=SimpleNamespace(user_id=USER_ID),
+        reply_token=reply_token,
+        timestamp=timestamp if timestamp is not None else int(time.time() * 1000)
+    )
+
+
+def test_send_text_replies_five_bubbles_and_pushes_the_rest(monkeypatch, line_api):
+    """応答を吹き出しに分け、5通までを返信し、残りをプッシュで送信すること"""
+    monkeypatch.setattr(bot, 'REPLY_MESSAGE_CHARS', 6)
+    sentences = [f"{i}番目です。" for i in range(7)]
+
+    bot.send_text('reply-token', USER_ID, ''.join(sentences))
+
+    assert line_api.replies == [('reply-token', sentences[:5])]
+    assert line_api.pushes == [(USER_ID, sentences[5:])]
+
+
+def test_send_text_without_reply_token_pushes_in_groups_of_five(monkeypatch, line_api):
+    """返信トークンがない場合は、5通ずつプッシュで送信すること"""
+    monkeypatch.setattr(bot, 'REPLY_MESSAGE_CHARS', 6)
+    sentences = [f"{i}番目です。" for i in range(7)]
+
+    bot.send_text(None, USER_ID, ''.join(sentences))
+
+    assert line_api.replies == []
+    assert line_api.pushes == [(USER_ID, sentences[:5]), (USER_ID, sentences[5:])]
+
+
+def test_reply_budget_fits_in_one_reply():
+    """応答の文字数の上限とmax_tokensが、1回の返信で送れる量を超えないこと"""
+    assert bot.REPLY_MAX_CHARS <= bot.LINE_MAX_MESSAGES * bot.REPLY_MESSAGE_CHARS
+    assert bot.DEFAULT_ROUTE.max_tokens == bot.REPLY_MAX_CHARS
+
+
+def test_invalid_reply_token_falls_back_to_push(line_api):
+    """返信トークンが無効な場合は、同じメッセージをプッシュで送信すること"""
+    line_api.reply_error = line_error(400, 'Invalid reply token')
+
+    bot.send_text('reply-token', USER_ID, 'こんにちは。')
+
+    assert line_api.pushes == [(USER_ID, ['こんにちは。'])]
+
+
+def test_reply_errors_without_user_are_raised(line_api):
+    """プッシュの送信先がない場合は返信の失敗をそのまま送出すること"""
+    line_api.reply_error = line_error(400, 'Invalid reply token')
+
+    with pytest.raises(LineBotApiError):
+        bot.send_text('reply-token', None, 'こんにちは。')
+
+
+def test_failed_push_is_queued_with_its_channel(line_api, channels):
+    """一時的に失敗したプッシュを処理中のチャネルとともに再送キューに保存し、同じチャネルから再送すること"""
+    with channel_scope(bot.channel_registry.resolve('Ua')):
+        bot.get_line_bot_api().push_error = line_error(503)
+        bot.send_text(None, USER_ID, 'こんにちは。')
+    assert bot.delivery_queue.stats() == {'pending': 1, 'dead_letters': 0}
+
+    channels['Ua'].push_error = None
+    bot.retry_deliveries()
+
+    assert channels['Ua'].pushes == [(USER_ID, ['こんにちは。'])]
+    assert line_api.pushes == []
+    assert bot.delivery_queue.stats() == {'pending': 0, 'dead_letters': 0}
+
+
+def test_permanent_push_failures_are_dead_lettered(line_api):
+    """再送しても成功しないプッシュの失敗はdead letterに保存すること"""
+    line_api.push_error = line_error(400)
+
+    bot.send_text(None, USER_ID, 'こんにちは。')
+
+    assert bot.delivery_queue.stats() == {'pending': 0, 'dead_letters': 1}
+
+
+def test_webhook_does_not_retry_deliveries_but_worker_does(line_api):
+    """再送キューはwebhookの応答中には処理せず、ワーカーの処理後に再送すること"""
+    bot.delivery_queue.enqueue(USER_ID, [{'type': 'text', 'text': '再送'}], 'key-1', '503')
+    body = json.dumps({'destination': 'Udefault', 'events': []})
+
+    response = bot.lambda_handler(webhook_event(body, os.environ['LINE_CHANNEL_SECRET']), None)
+
+    assert response['statusCode'] == 200
+    assert line_api.pushes == []
+
+    bot.worker_handler({'Records': []}, None)
+
+    assert line_api.pushes == [(USER_ID, ['再送'])]
+
+
+def test_reply_with_stream_replies_first_chunk_and_pushes_the_rest(monkeypatch, line_api):
+    """ストリーミングの最初の文を返信し、残りをまとめてプッシュすること"""
+    def stream(messages, user_id, route):
+        yield from ['最初の文です。', '次の文です。', '最後の文です。']
+
+    monkeypatch.setattr(bot, 'STREAM_FIRST_CHUNK_CHARS', 1)
+    monkeypatch.setattr(bot, 'select_route', lambda user_message: bot.DEFAULT_ROUTE)
+    monkeypatch.setattr(bot, 'stream_claude_response', stream)
+
+    bot.reply_with_stream('reply-token', USER_ID, '質問')
+
+    assert line_api.replies == [('reply-token', ['最初の文です。'])]
+    assert line_api.pushes == [(USER_ID, ['次の文です。最後の文です。'])]
+
+
+def test_reply_with_stream_packs_chunks_into_bubbles(monkeypatch, line_api):
+    """ストリーミングの返信・プッシュもREPLY_MESSAGE_CHARS以内の吹き出しに分けて送ること"""
+    def stream(messages, user_id, route):
+        yield from ['最初の文です。', '次の文です。', '最後の文です。']
+
+    monkeypatch.setattr(bot, 'STREAM_FIRST_CHUNK_CHARS', 1)
+    monkeypatch.setattr(bot, 'REPLY_MESSAGE_CHARS', 8)
+    monkeypatch.setattr(bot, 'select_route', lambda user_message: bot.DEFAULT_ROUTE)
+    monkeypatch.setattr(bot, 'stream_claude_response', stream)
+
+    bot.reply_with_stream('reply-token', USER_ID, '質問')
+
+    assert line_api.replies == [('reply-token', ['最初の文です。'])]
+    assert line_api.pushes == [(USER_ID, ['次の文です。', '最後の文です。'])]
+
+
+def test_reply_with_stream_reports_errors_after_partial_output(monkeypatch, line_api):
+    """ストリームが途中で失敗した場合は、送信済みの文に続けてエラーメッセージを送ること"""
+    def failing_stream(messages, user_id, route):
+        yield '最初の文です。'
+        raise ConnectionError('stream closed')
+
+    monkeypatch.setattr(bot, 'STREAM_FIRST_CHUNK_CHARS', 1)
+    monkeypatch.setattr(bot, 'select_route', lambda user_message: bot.DEFAULT_ROUTE)
+    monkeypatch.setattr(bot, 'stream_claude_response', failing_stream)
+
+    bot.reply_with_stream('reply-token', USER_ID, '質問')
+
+    assert line_api.replies == [('reply-token', ['最初の文です。'])]
+    assert len(line_api.pushes) == 1
+    assert line_api.pushes[0][1][0] == bot.claude_error_message(ConnectionError('stream closed'))
+
+
+def test_webhook_is_verified_and_answered_on_its_channel(monkeypatch, line_api, channels):
+    """destinationのチャネルのシークレットで署名を検証し、そのチャネルから返信すること"""
+    monkeypatch.setattr(bot, 'get_claude_response', lambda user_message, user_id: f"{user_message}への回答です。")
+    body = json.dumps({'destination': 'Ub', 'events': [text_event('質問です')]})
+
+    assert bot.lambda_handler(webhook_event(body, 'secret-a'), None)['statusCode'] == 400
+    assert bot.lambda_handler(webhook_event(body, 'secret-b'), None)['statusCode'] == 200
+
+    assert channels['Ub'].replies == [('reply-token', ['質問ですへの回答です。'])]
+    assert 'Ua' not in channels
+    assert line_api.replies == []
+
+
+def test_dedup_store_errors_do_not_fail_the_webhook(monkeypatch, line_api):
+    """重複検出の共有ストアの障害時も、イベントを未処理として処理して200を返すこと"""
+    class BrokenStore(SharedDedupStore):
+        def claim(self, event_id, ttl_seconds):
+            raise ConnectionError('store unavailable')
+
+    monkeypatch.setattr(bot, 'event_deduplicator', EventDeduplicator(shared=BrokenStore()))
+    monkeypatch.setattr(bot, 'get_claude_response', lambda user_message, user_id: '回答です。')
+    event = dict(text_event('質問です'), webhookEventId='01H00000000000000000000000',
+                 deliveryContext={'isRedelivery': True})
+    body = json.dumps({'destination': 'Udefault', 'events': [event]})
+
+    response = bot.lambda_handler(webhook_event(body, os.environ['LINE_CHANNEL_SECRET']), None)
+
+    assert response['statusCode'] == 200
+    assert line_api.replies == [('reply-token', ['回答です。'])]
+
+
+def test_conversation_store_errors_do_not_replace_the_answer(monkeypatch, line_api, tmp_path):
+    """会話履歴の保存に失敗しても、Claudeの応答がそのまま返されること"""
+    class BrokenBackend(SQLiteConversationBackend):
+        def save_batch(self, items):
+            raise OSError('disk full')
+
+    backend = BrokenBackend(str(tmp_path / 'conversations.db'))
+    monkeypatch.setattr(bot, 'conversation_store', ConversationStore(backend=backend, flush_batch_size=1))
+    message = SimpleNamespace(content=[SimpleNamespace(text='回答です。')], stop_reason='end_turn', usage=None)
+    monkeypatch.setattr(bot, 'call_claude', lambda request, route, user_id=None: (message, False))
+    monkeypatch.setattr(bot, 'record_usage', lambda *args: None)
+
+    assert bot.get_claude_response('質問です', USER_ID) == '回答です。'
+
+
+def test_batch_replay_skips_events_that_were_already_answered(monkeypatch, line_api):
+    """再処理するwebhookイベントのうち、処理済みのwebhookEventIdはバッチに含めないこと"""
+    import src.batch_processing as batch_processing
+
+    submitted = []
+    monkeypatch.setattr(bot, 'event_deduplicator', EventDeduplicator())
+    monkeypatch.setattr(bot, 'get_claude_client', lambda: SimpleNamespace(with_options=lambda **kwargs: None))
+    monkeypatch.setattr(batch_processing.BatchProcessor, 'run',
+                        lambda self, items, send: submitted.extend(item.text for item in items) or {})
+    answered = dict(text_event('回答済み'), webhookEventId='evt-1')
+    pending = dict(text_event('未回答'), webhookEventId='evt-2')
+    assert bot.claim_event('evt-1', False)
+
+    summary = bot.run_batch([json.dumps({'destination': 'Udefault', 'events': [answered, pending]})])
+
+    assert submitted == ['未回答']
+    assert summary['duplicates'] == 1
+    assert bot.run_batch([json.dumps(pending)])['duplicates'] == 1
+
+
+def test_waiting_for_a_claude_slot_is_not_a_dependency_failure(monkeypatch, line_api):
+    """同時実行枠の待機で期限を超えた場合は、サーキットブレーカー・利用量のエラーに数えないこと"""
+    governor = ClaudeGovernor(max_concurrency=1, deadline_seconds=0.05, user_rate_per_minute=0)
+    breaker = CircuitBreaker(min_calls=1)
+    errors = []
+    monkeypatch.setattr(bot, 'claude_governor', governor)
+    monkeypatch.setattr(bot, 'circuit_breaker', breaker)
+    monkeypatch.setattr(bot, 'record_claude_error', lambda *args: errors.append(args))
+    monkeypatch.setattr(bot, 'get_claude_client', lambda: pytest.fail('Claude API was called'))
+
+    governor._semaphore.acquire()
+    try:
+        bot.get_claude_response('質問です', USER_ID)
+    finally:
+        governor._semaphore.release()
+
+    assert governor.stats()['deadline_exceeded'] >= 1
+    assert breaker.stats()['calls'] == 0
+    assert errors == []
+
+
+def test_worker_answers_queued_events_on_their_channels(monkeypatch, line_api, channels):
+    """キューのレコードをdestinationごとのチャネルで処理し、読み込めないレコードは読み飛ばすこと"""
+    monkeypatch.setattr(bot, 'get_claude_response', lambda user_message, user_id: f"{user_message}への回答です。")
+    records = [
+        json.dumps({'destination': 'Ua', 'event': text_event('Aへの質問', 'token-a')}),
+        'not json',
+        json.dumps({'destination': 'Ub'}),
+        json.dumps({'destination': 'Ub', 'event': text_event('Bへの質問', 'token-b')})
+    ]
+
+    result = bot.worker_handler({'Records': [{'body': record} for record in records]}, None)
+
+    assert result == {'processed': 2, 'received': 4, 'batchItemFailures': []}
+    assert channels['Ua'].replies == [('token-a', ['Aへの質問への回答です。'])]
+    assert channels['Ub'].replies == [('token-b', ['Bへの質問への回答です。'])]
+    assert line_api.replies == []
+
+
+def test_worker_leaves_failed_records_on_the_queue(monkeypatch, line_api, channels, tmp_path):
+    """処理に失敗したdestinationのレコードはackせず、再び取り出されること"""
+    queue = SQLiteEventQueue(str(tmp_path / 'events.db'), visibility_timeout=0)
+    monkeypatch.setattr(bot, 'event_queue', queue)
+    monkeypatch.setattr(bot, 'get_claude_response', lambda user_message, user_id: f"{user_message}への回答です。")
+    original = bot.process_queued_events
+
+    def process(destination, line_events):
+        if destination == 'Ub':
+            raise RuntimeError('channel down')
+        original(destination, line_events)
+
+    monkeypatch.setattr(bot, 'process_queued_events', process)
+    queue.enqueue([
+        json.dumps({'destination': 'Ua', 'event': text_event('Aへの質問', 'token-a')}),
+        json.dumps({'destination': 'Ub', 'event': text_event('Bへの質問', 'token-b')}),
+        'not json'
+    ])
+
+    assert bot.worker_handler({}, None) == {'processed': 1, 'received': 3}
+    assert channels['Ua'].replies == [('token-a', ['Aへの質問への回答です。'])]
+    assert [json.loads(record.body)['destination'] for record in queue.dequeue(10)] == ['Ub']
+
+
+def test_worker_without_event_queue_returns_an_error(monkeypatch, line_api):
+    """イベントキューがない（BOT_MODE=sync）場合は、キューを取り出さずにエラーを返すこと"""
+    monkeypatch.setattr(bot, 'event_queue', None)
+
+    result = bot.worker_handler({}, None)
+
+    assert result['processed'] == 0
+    assert 'BOT_MODE=split' in result['error']
+
+
+def test_expired_reply_token_is_answered_by_push(monkeypatch, line_api):
+    """返信トークンが期限切れの場合は、期限切れの期限を適用せずに応答を生成してプッシュで送ること"""
+    deadlines = []
+
+    def respond(message_id, user_id):
+        deadlines.append(bot.current_deadline())
+        return '画像の説明です。'
+
+    monkeypatch.setattr(bot, 'get_claude_image_response', respond)
+    expired = int((time.time() - bot.REPLY_TOKEN_TTL_SECONDS - 10) * 1000)
+
+    bot.handle_image_message(image_event(timestamp=expired))
+
+    assert deadlines == [None]
+    assert line_api.replies == []
+    assert line_api.pushes == [(USER_ID, ['画像の説明です。'])]
+
+
+@pytest.mark.parametrize('setup, expected', [
+    (lambda api: setattr(api, 'content_error', line_error(404, 'Not found')), '画像を取得できませんでした'),
+    (lambda api: setattr(api, 'content', b'not an image'), 'この画像は読み込めませんでした'),
+    (lambda api: setattr(api, 'content', b'x' * 2048), '画像のサイズが大きすぎる'),
+])
+def test_image_errors_are_answered_with_image_messages(monkeypatch, line_api, setup, expected):
+    """画像を取得・読み込みできない場合は、画像に応じたメッセージで返信すること"""
+    monkeypatch.setattr(bot.image_preparer, 'max_input_bytes', 1024)
+    setup(line_api)
+
+    bot.handle_image_message(image_event())
+
+    assert len(line_api.replies) == 1
+    assert expected in line_api.replies[0][1][0]
+    if line_api.content_error is None:
+        assert line_api.closed == 1
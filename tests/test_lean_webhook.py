@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+軽量なwebhookパースのテスト
+"""
+
+import os
+import sys
+import json
+import hmac
+import hashlib
+import base64
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.lean_webhook import handler_name, parse_payload, verify_signature
+
+SECRET = b'test-secret'
+
+
+def sign(body):
+    return base64.b64encode(hmac.new(SECRET, body, hashlib.sha256).digest()).decode('utf-8')
+
+
+def test_verify_signature():
+    """生のボディのHMACで署名を検証し、不一致や署名なしは拒否すること"""
+    body = '{"events": []}'.encode('utf-8')
+
+    assert verify_signature(SECRET, body, sign(body))
+    assert not verify_signature(SECRET, body + b' ', sign(body))
+    assert not verify_signature(SECRET, body, None)
+
+
+def test_parse_payload_extracts_handler_fields():
+    """ハンドラーが使う項目をSDKと同じ属性名で取り出すこと"""
+    body = json.dumps({
+        "destination": "Udest",
+        "events": [
+            {
+                "type": "message",
+                "timestamp": 1700000000000,
+                "source": {"type": "user", "userId": "U1"},
+                "replyToken": "reply-1",
+                "webhookEventId": "evt-1",
+                "deliveryContext": {"isRedelivery": True},
+                "message": {"type": "text", "id": "1", "text": "こんにちは", "emojis": []}
+            },
+            {"type": "postback", "source": {"type": "user", "userId": "U2"},
+             "replyToken": "reply-2", "postback": {"data": "action=help"}},
+            {"type": "join", "source": {"type": "group", "groupId": "G1"}}
+        ]
+    }).encode('utf-8')
+
+    payload = parse_payload(body)
+    message, postback, join = payload.events
+
+    assert payload.destination == "Udest"
+    assert (message.source.user_id, message.reply_token, message.message.text) == ("U1", "reply-1", "こんにちは")
+    assert message.timestamp == 1700000000000
+    assert message.webhook_event_id == "evt-1"
+    assert message.delivery_context.is_redelivery is True
+    assert (handler_name(message), handler_name(message.message)) == ('MessageEvent', 'TextMessage')
+    assert postback.postback.data == "action=help"
+    assert handler_name(postback) == 'PostbackEvent'
+    assert join.source.group_id == "G1" and join.source.user_id is None
+    assert join.message is None
+
+
+def test_records_have_no_instance_dict():
+    """イベントレコードが__slots__のみで構成されること"""
+    event = parse_payload(b'{"events": [{"type": "follow", "source": {"type": "user", "userId": "U1"}}]}').events[0]
+
+    assert not hasattr(event, '__dict__')
+    assert handler_name(event) == 'FollowEvent'
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+ユーザーごとのメッセージ結合（デバウンス）のテスト
+"""
+
+import os
+import sys
+import time
+import threading
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.message_coalescer import MessageCoalescer
+
+
+def submit_later(coalescer, delay, user_id, text, reply_token, results):
+    def run():
+        time.sleep(delay)
+        results.append(coalescer.submit(user_id, text, reply_token))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_messages_within_window_are_coalesced():
+    """待機時間内に届いた同じユーザーのメッセージが1つにまとめられ、最後の返信トークンが使われること"""
+    coalescer = MessageCoalescer(window_seconds=0.2, max_wait_seconds=2.0)
+    followers = []
+    threads = [
+        submit_later(coalescer, 0.05, "U1", "明日の", "token-2", followers),
+        submit_later(coalescer, 0.1, "U1", "天気は？", "token-3", followers)
+    ]
+
+    pending = coalescer.submit("U1", "こんにちは", "token-1")
+    for thread in threads:
+        thread.join()
+
+    assert pending.text == "こんにちは\n明日の\n天気は？"
+    assert pending.reply_token == "token-3"
+    assert followers == [None, None]
+    assert coalescer.stats() == {'batches': 1, 'coalesced': 2}
+
+
+def test_other_users_are_not_coalesced():
+    """別のユーザーのメッセージはまとめられないこと"""
+    coalescer = MessageCoalescer(window_seconds=0.1)
+    results = []
+    thread = submit_later(coalescer, 0.02, "U2", "hello", "token-2", results)
+
+    pending = coalescer.submit("U1", "こんにちは", "token-1")
+    thread.join()
+
+    assert pending.text == "こんにちは"
+    assert results[0].text == "hello"
+
+
+def test_max_wait_bounds_latency():
+    """メッセージが届き続けてもmax_wait_secondsで待機を打ち切ること"""
+    coalescer = MessageCoalescer(window_seconds=0.1, max_wait_seconds=0.25)
+    stop = threading.Event()
+
+    def keep_sending():
+        time.sleep(0.02)
+        while not stop.is_set():
+            coalescer.submit("U1", "まだ", "token")
+            time.sleep(0.05)
+
+    sender = threading.Thread(target=keep_sending)
+    sender.start()
+    start = time.monotonic()
+    pending = coalescer.submit("U1", "最初", "token-1")
+    elapsed = time.monotonic() - start
+    stop.set()
+    sender.join()
+
+    assert pending.texts[0] == "最初"
+    assert elapsed < 0.4
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+モデルルーターのテスト
+"""
+
+import os
+import sys
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.claude_governor import DeadlineExceeded
+from src.model_router import ModelRouter, Route, RoutingRule, create_model_router, detect_language, should_fall_back
+
+
+def create_router(rules):
+    routes = {
+        'fast': Route('fast', 'small-model', 300, 5, fallback_model=None),
+        'large': Route('large', 'large-model', 1000, 15, fallback_model='small-model')
+    }
+    return ModelRouter(routes, rules, 'large')
+
+
+def test_detect_language():
+    """日本語・英語・それ以外を判定できること"""
+    assert detect_language("こんにちは") == 'ja'
+    assert detect_language("hello") == 'en'
+    assert detect_language("123") == 'other'
+
+
+def test_default_rules_route_short_messages_to_fast_model(monkeypatch):
+    """短いあいさつは小さいモデル、説明を求める質問や長文は大きいモデルに振り分けること"""
+    monkeypatch.delenv('MODEL_ROUTER_RULES', raising=False)
+    router = create_model_router(max_tokens=1000)
+
+    assert router.route("ありがとう").name == 'fast'
+    assert router.route("hi").name == 'fast'
+    assert router.route("量子コンピューターについて説明して").name == 'large'
+    assert router.route("あ" * 100).name == 'large'
+
+
+def test_first_matching_rule_wins():
+    """ルールは先頭から評価し、条件をすべて満たす最初のルールを使うこと"""
+    router = create_router([
+        RoutingRule('large', language='en', min_chars=10),
+        RoutingRule('fast', max_chars=20)
+    ])
+
+    assert router.route("good morning everyone").name == 'large'
+    assert router.route("thanks").name == 'fast'
+    assert router.route("あ" * 30).name == 'large'
+
+
+def test_rules_from_environment(monkeypatch):
+    """MODEL_ROUTER_RULESのJSONでルールを設定でき、max_tokensは上限で抑えられること"""
+    monkeypatch.setenv('MODEL_ROUTER_RULES', '[{"route": "fast", "keywords": ["天気"]}]')
+    monkeypatch.setenv('MODEL_FAST_MAX_TOKENS', '5000')
+    router = create_model_router(max_tokens=800)
+
+    assert router.route("明日の天気は？").name == 'fast'
+    assert router.route("こんにちは").name == 'large'
+    assert router.routes['fast'].max_tokens == 800
+
+
+def test_unknown_route_is_rejected():
+    """存在しないルートを参照するルールはエラーになること"""
+    with pytest.raises(ValueError):
+        create_router([RoutingRule('medium', max_chars=10)])
+
+
+def test_stats_are_aggregated_per_route():
+    """ルートごとに回数・平均所要時間・トークン数を集計すること"""
+    router = create_router([])
+    route = router.routes['large']
+
+    router.record(route, 100.0, 10, 50)
+    router.record(route, 300.0, 20, 70, fallback=True)
+
+    assert router.stats() == {
+        'large': {'calls': 2, 'fallbacks': 1, 'avg_latency_ms': 200.0, 'input_tokens': 30, 'output_tokens': 120}
+    }
+
+
+def test_should_fall_back_only_on_slow_or_limited_calls():
+    """期限超過ではフォールバックし、それ以外の例外ではフォールバックしないこと"""
+    assert should_fall_back(DeadlineExceeded("deadline"))
+    assert not should_fall_back(ValueError("bad request"))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+レスポンスキャッシュのテスト
+"""
+
+import os
+import sys
+import time
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.response_cache import ResponseCache, SharedCacheBackend, SQLiteCacheBackend, normalize_text
+
+
+def test_normalized_variants_share_cache_entry():
+    """表記ゆれのある同じ質問が同じキャッシュを参照すること"""
+    cache = ResponseCache()
+    cache.set("営業時間は？", "9時から18時です", cost_seconds=2.0)
+
+    assert normalize_text("ＡＢＣ  Test!") == normalize_text("abc test")
+    assert cache.get("営業時間は") == "9時から18時です"
+    assert cache.get("営業時間は?") == "9時から18時です"
+    assert cache.get("住所は？") is None
+
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+    assert stats['saved_seconds'] == 4.0
+
+
+def test_entries_expire_and_are_evicted():
+    """TTL切れとサイズ上限で古いエントリが破棄されること"""
+    cache = ResponseCache(ttl_seconds=0.05, max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.set("c", "3")
+
+    assert cache.get("a") is None
+    assert cache.get("c") == "3"
+    time.sleep(0.1)
+    assert cache.get("c") is None
+
+
+def test_shared_tier_is_used_after_cold_start(tmp_path):
+    """共有層に保存された応答が別のキャッシュ（別コンテナ相当）から参照できること"""
+    shared = SQLiteCacheBackend(str(tmp_path / "cache.db"))
+    ResponseCache(shared=shared).set("hello", "hi")
+
+    cache = ResponseCache(shared=shared)
+    assert cache.get("hello") == "hi"
+    assert cache.get("hello") == "hi"
+    assert cache.stats()['shared_hits'] == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_shared_tier_errors_are_treated_as_misses():
+    """共有層の読み書きに失敗してもキャッシュミスとして扱い、メモリ層は使えること"""
+    class BrokenBackend(SharedCacheBackend):
+        def get(self, key):
+            raise ConnectionError("cache unavailable")
+
+        def set(self, key, value, cost_seconds, expires_at):
+            raise ConnectionError("cache unavailable")
+
+    cache = ResponseCache(shared=BrokenBackend())
+
+    assert cache.get("こんにちは") is None
+    cache.set("こんにちは", "こんにちは！", cost_seconds=1.0)
+
+    assert cache.get("こんにちは") == "こんにちは！"
+    assert cache.stats()['shared_errors'] == 2
+    assert cache.stats()['misses'] == 1
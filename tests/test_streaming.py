@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+ストリーミング応答のチャンク分割のテスト
+"""
+
+import os
+import sys
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.streaming import SentenceChunker, pack_messages, trim_to_sentence
+
+
+def test_chunks_are_cut_at_sentence_end():
+    """min_charsを超えた最初の文末でチャンクが確定すること"""
+    chunker = SentenceChunker(min_chars=10)
+
+    assert chunker.feed("こんにちは。") == []
+    assert chunker.feed("今日はいい天気ですね。明日") == ["こんにちは。今日はいい天気ですね。"]
+    assert chunker.feed("も晴れるでしょう") == []
+    assert chunker.flush() == ["明日も晴れるでしょう"]
+
+
+def test_english_period_requires_following_space():
+    """英文のピリオドは後ろに空白がある場合のみ文末とみなすこと"""
+    chunker = SentenceChunker(min_chars=5)
+
+    assert chunker.feed("Version 3.5 is out") == []
+    assert chunker.feed(". Next") == ["Version 3.5 is out."]
+
+
+def test_long_text_without_boundary_is_split_at_max_chars():
+    """文末がない長いテキストはmax_charsで分割されること"""
+    chunker = SentenceChunker(min_chars=5, max_chars=20)
+
+    assert chunker.feed("a" * 45) == ["a" * 20, "a" * 20]
+    assert chunker.flush() == ["a" * 5]
+
+
+def test_pack_messages_splits_on_sentence_boundaries():
+    """文の途中で分割せず、max_chars以内の吹き出しに詰めること"""
+    text = "一文目です。" * 3 + "二文目は少し長めの文です。"
+
+    messages = pack_messages(text, max_chars=20)
+
+    assert messages == ["一文目です。一文目です。一文目です。", "二文目は少し長めの文です。"]
+    assert all(len(message) <= 20 for message in messages)
+
+
+def test_pack_messages_force_splits_long_sentence():
+    """max_charsを超える1文は強制的に分割すること"""
+    messages = pack_messages("あ" * 25, max_chars=10)
+
+    assert messages == ["あ" * 10, "あ" * 10, "あ" * 5]
+
+
+def test_trim_to_sentence_drops_unfinished_sentence():
+    """最後の文末より後ろの書きかけの文を取り除くこと"""
+    assert trim_to_sentence("完了した文です。書きかけの") == "完了した文です。"
+    assert trim_to_sentence("文末のない文") == "文末のない文"
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+区間計測とEMF出力のテスト
+"""
+
+import io
+import os
+import sys
+import json
+import threading
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.tracing import Tracer, TruncatedJson, COUNT
+
+
+def test_flush_writes_single_emf_line():
+    """記録したメトリクスがEMF形式のJSON 1行で出力されること"""
+    stream = io.StringIO()
+    tracer = Tracer(namespace='Test', service='bot', stream=stream)
+    tracer.start()
+
+    with tracer.span('ClaudeLatency'):
+        pass
+    tracer.record('ClaudeOutputTokens', 10, COUNT)
+    tracer.record('ClaudeOutputTokens', 20, COUNT)
+    tracer.flush(RequestId='abc')
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    metrics = record['_aws']['CloudWatchMetrics'][0]
+    assert metrics['Namespace'] == 'Test'
+    assert {'Name': 'ClaudeOutputTokens', 'Unit': 'Count'} in metrics['Metrics']
+    assert record['Service'] == 'bot'
+    assert record['ClaudeOutputTokens'] == [10, 20]
+    assert isinstance(record['ClaudeLatency'], float)
+    assert record['RequestId'] == 'abc'
+
+
+def test_nothing_is_written_without_metrics_or_when_disabled():
+    """メトリクスがない場合と無効化されている場合は出力しないこと"""
+    stream = io.StringIO()
+    Tracer(stream=stream).flush()
+
+    disabled = Tracer(enabled=False, stream=stream)
+    disabled.record('InvocationLatency', 1.0)
+    disabled.flush()
+
+    assert stream.getvalue() == ''
+
+
+def test_concurrent_invocations_are_flushed_separately():
+    """別スレッドで同時に処理する呼び出しのメトリクスが混ざらないこと"""
+    stream = io.StringIO()
+    tracer = Tracer(stream=stream)
+    started = threading.Barrier(2)
+
+    def invoke(request_id):
+        tracer.start()
+        tracer.record('EventCount', 1, COUNT)
+        started.wait()
+        tracer.flush(RequestId=request_id)
+
+    threads = [threading.Thread(target=invoke, args=(request_id,)) for request_id in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert sorted(record['RequestId'] for record in records) == ['a', 'b']
+    assert all(record['EventCount'] == 1 for record in records)
+
+
+def test_truncated_json_is_capped():
+    """長いJSONが指定文字数で切り詰められること"""
+    text = str(TruncatedJson({'body': 'x' * 100}, max_chars=20))
+
+    assert text.startswith('{"body": "xxxxxxxxx')
+    assert 'truncated' in text
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+ユーザー・モデルごとの利用量集計のテスト
+"""
+
+import os
+import io
+import sys
+import json
+import sqlite3
+
+import pytest
+
+# プロジェクトルートをPythonパスに追加
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from src.usage_accounting import UsageAccountant, UsageCounters, UsageSink, StdoutUsageSink, SQLiteUsageSink
+
+
+def test_records_are_aggregated_per_user_and_model():
+    """同じユーザー・モデルの呼び出しは1レコードにまとめて出力されること"""
+    stream = io.StringIO()
+    accountant = UsageAccountant(StdoutUsageSink(stream))
+
+    accountant.record('U1', 'haiku', 10, 20, 120.0)
+    accountant.record('U1', 'haiku', 5, 7, 480.0)
+    accountant.record('U1', 'haiku', latency_ms=30000.0, error=True)
+    accountant.record('U2', 'sonnet', 100, 200, 900.0)
+
+    assert accountant.flush() == 2
+    records = {(r['user_id'], r['model']): r for r in map(json.loads, stream.getvalue().splitlines())}
+    haiku = records[('U1', 'haiku')]
+    assert (haiku['calls'], haiku['errors'], haiku['input_tokens'], haiku['output_tokens']) == (3, 1, 15, 27)
+    assert haiku['latency_ms_max'] == 30000.0
+    assert records[('U2', 'sonnet')]['input_tokens'] == 100
+
+
+def test_flush_waits_for_interval():
+    """出力間隔が経過するまではforceなしでは出力しないこと"""
+    stream = io.StringIO()
+    accountant = UsageAccountant(StdoutUsageSink(stream), flush_interval_seconds=60)
+
+    accountant.record('U1', 'haiku', 1, 1, 10.0)
+
+    assert accountant.flush() == 0
+    assert stream.getvalue() == ''
+    assert accountant.flush(force=True) == 1
+    assert accountant.flush(force=True) == 0
+
+
+def test_failed_write_keeps_counters_for_the_next_flush():
+    """出力に失敗した集計値は失われず、その後の呼び出し分と合わせて次回出力されること"""
+    class FlakySink(UsageSink):
+        def __init__(self):
+            self.fail = True
+            self.records = []
+
+        def write(self, records):
+            if self.fail:
+                raise OSError("sink unavailable")
+            self.records.extend(records)
+
+    sink = FlakySink()
+    accountant = UsageAccountant(sink)
+    accountant.record('U1', 'haiku', 10, 20, 120.0)
+
+    with pytest.raises(OSError):
+        accountant.flush()
+    accountant.record('U1', 'haiku', 5, 7, 3000.0)
+    sink.fail = False
+
+    assert accountant.flush() == 1
+    record = sink.records[0]
+    assert (record['calls'], record['input_tokens'], record['output_tokens']) == (2, 15, 27)
+    assert (record['latency_ms_max'], record['latency_ms_p95']) == (3000.0, 3000.0)
+
+
+def test_percentile_from_histogram():
+    """ヒストグラムからバケットの上限値でパーセンタイルを推定すること"""
+    counters = UsageCounters()
+    for latency_ms in [80] * 19 + [2500]:
+        counters.add_latency(latency_ms)
+
+    assert counters.percentile(0.5) == 100
+    assert counters.percentile(0.95) == 100
+    assert counters.percentile(1.0) == 2500
+    assert UsageCounters().percentile(0.95) is None
+
+
+def test_sqlite_sink(tmp_path):
+    """SQLiteの出力先にレコードが追記されること"""
+    path = str(tmp_path / 'usage.db')
+    accountant = UsageAccountant(SQLiteUsageSink(path))
+
+    accountant.record('U1', 'haiku', 10, 20, 150.0)
+    accountant.flush()
+    accountant.record('U1', 'haiku', 1, 2, 150.0)
+    accountant.flush()
+
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute(
+            "SELECT user_id, SUM(calls), SUM(input_tokens), SUM(output_tokens) FROM usage_records GROUP BY user_id"
+        ).fetchall()
+    assert rows == [('U1', 2, 11, 22)]